@@ -19,23 +19,65 @@ compare classification accuracy across an array of different thresholds. Also ca
 #%% Import Statements
 import mne
 import numpy as np
-import matplotlib.pyplot as plt
 from mne.preprocessing import ICA
 import math
+import scipy.signal
+import os
 from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
-# Define figure size
-plt.rcParams["figure.figsize"] = (14,8)
+from epoching import extract_epochs, extract_ragged_epochs
+from component_features import SourceActivations
+from artifact_rejection import DEFAULT_EEG_REJECT, annotate_bad_segments
+from group_ica import GroupICA
+from event_index import build_event_index, get_event_index, get_events_array, get_truth_labels, set_event_index
+from data_cache import (DEFAULT_CACHE_SIZE_LIMIT, find_cache_entries, get_cache_key, hash_arrays, hash_file,
+                        load_cache_entry, save_cache_entry)
+from pipeline_trace import record_arrays, stage
 
 #%% Loading in raw data, Band-pass filtering, and re-referencing
-def load_data(subject):
+def load_data(subject, l_freq=1, h_freq=30, cache_dir=None, cache_size_limit=DEFAULT_CACHE_SIZE_LIMIT,
+              memory_budget=None, dtype=np.float64, resample_fs=None):
     '''
     Function to load in a specified subjects .fif data file, Band-pass filter the raw EEG data between 1 - 30Hz, and
     re-reference the data to the average across electrodes.
 
+    If cache_dir is given, the pre-processed data is stored there (keyed on the hash of the .fif file and the filter and
+    reference settings) and later calls memory-map it instead of reading and filtering the recording again. On a cache hit
+    fif_file is an MNE RawArray holding only the 64 EEG channels and the stim channel(s).
+
+    If memory_budget is given, only the EEG and stim channels are read, and they are filtered and re-referenced a chunk
+    at a time (see _read_filtered_chunks) into one preallocated array, so peak memory is about one copy of the EEG data
+    plus the budget instead of three or four copies of the whole recording. fif_file is then a RawArray over that array.
+
+    dtype sets the precision of the whole pipeline: raw_eeg_data is returned in it, and the epochs, source activations
+    and spectra computed from it keep it (variances are still accumulated in float64). fif_file always holds float64
+    data, since MNE stores raw data in float64.
+
+    If resample_fs is given, the filtered, re-referenced recording is decimated to it right away (see
+    _decimate_recording), so every later stage - epoching, the source activation matmul, variance features and spectra -
+    works on fewer samples. fs, eeg_times and the stim channel (and so the event sample numbers get_eeg_epochs uses)
+    are those of the decimated recording.
+
     Parameters
     ----------
     subject : string of subject number (two digits)
         String denoting which subject we are analyzing.
+    l_freq : float, optional
+        Lower edge of the band-pass filter in Hz. The default is 1.
+    h_freq : float, optional
+        Upper edge of the band-pass filter in Hz. The default is 30.
+    cache_dir : string, optional
+        Directory of the pre-processed data cache. The default is None (no caching).
+    cache_size_limit : int, optional
+        Size budget of the cache directory in bytes, least recently used entries are evicted past it. The default is
+        data_cache.DEFAULT_CACHE_SIZE_LIMIT.
+    memory_budget : int, optional
+        Bytes of working memory (on top of the output array) allowed for chunked loading. The default is None (read
+        the whole recording with preload=True and filter it in one go).
+    dtype : data-type, optional
+        Data type of raw_eeg_data, np.float64 or np.float32. The default is np.float64.
+    resample_fs : float, optional
+        Sampling frequency in Hz to decimate to after filtering, e.g. 128. The recording's sampling frequency must be an
+        integer multiple of it, and it must be at least 2*h_freq. The default is None (keep the recording's rate).
 
     Returns
     -------
@@ -43,7 +85,7 @@ def load_data(subject):
         FIF file with MNE built in functions - all data can be extracted.
     raw_eeg_data : Array of size (channels, samples) - samples depend on which subject is read
         Array of floats containing the eeg recording data taken at each time point (across all
-        trials and condiditons) for the one subject.
+        trials and condiditons) for the one subject. Read-only memory map on a cache hit (in float64).
     eeg_times : Array of time points eeg samples were taken
         1-D array of times (in seconds) of the time points each eeg sample was taken at.
     channel_names: Array of channel names (each is string)
@@ -52,29 +94,238 @@ def load_data(subject):
         smapling frquency of 512 Hz.
 
     '''
+    fif_path = f'data/P{subject}-raw.fif'
+    if resample_fs is not None and resample_fs < 2*h_freq:
+        raise ValueError(f'resample_fs ({resample_fs} Hz) must be at least twice h_freq ({h_freq} Hz).')
+    if cache_dir is not None:
+        with stage('load', source='cache'):
+            # decimated entries get their own keys, the keys of full-rate entries are unchanged
+            resample_parameters = {} if resample_fs is None else dict(resample_fs=resample_fs)
+            cache_key = get_cache_key(hash_file(fif_path, cache_dir), l_freq=l_freq, h_freq=h_freq, reference='average',
+                                      **resample_parameters)
+            cached_arrays, cache_metadata = load_cache_entry(cache_dir, cache_key)
+            if cached_arrays is not None:
+                print(f'Loading pre-processed data from cache entry {cache_key[:12]}...')
+                # the measurement info (channel types, montage, filter settings, reference) saved with the data
+                cache_info = mne.io.read_info(os.path.join(cache_metadata['entry_dir'], 'info.fif'), verbose=False)
+                fif_file = _make_raw_array(cached_arrays['data'], cache_info)
+                if 'event_index' in cached_arrays:
+                    set_event_index(fif_file, cached_arrays['event_index'])
+                raw_eeg_data = cached_arrays['data'][0:64, :].astype(dtype, copy=False)
+                channel_names = np.array(cached_arrays['channel_names'][0:64])
+                record_arrays(raw_eeg_data=raw_eeg_data)
+                return fif_file, raw_eeg_data, cached_arrays['times'], channel_names, cache_metadata['fs']
 
-    fif_file=mne.io.read_raw_fif(f'data/P{subject}-raw.fif', preload=True)
-    
-    # pre-processing data before extraction
-    print('Band-pass filtering between 1 - 30 Hz...')
-    fif_file.filter(1,30)
-    print('Rereferencing the raw data to the average across electrodes...')
-    fif_file.set_eeg_reference(ref_channels='average')
+    chunked_data = None
+    if memory_budget is None:
+        with stage('load', source='fif'):
+            fif_file=mne.io.read_raw_fif(fif_path, preload=True)
+            record_arrays(raw_data=fif_file._data)
+        
+        # pre-processing data before extraction
+        with stage('filter', l_freq=l_freq, h_freq=h_freq):
+            print(f'Band-pass filtering between {l_freq} - {h_freq} Hz...')
+            fif_file.filter(l_freq,h_freq)
+        with stage('reference', ref_channels='average'):
+            print('Rereferencing the raw data to the average across electrodes...')
+            fif_file.set_eeg_reference(ref_channels='average')
+    else:
+        with stage('load', source='fif', chunked=True, memory_budget=memory_budget):
+            print(f'Band-pass filtering between {l_freq} - {h_freq} Hz and rereferencing to the average across '
+                  'electrodes in chunks...')
+            fif_file, chunked_data = _read_filtered_chunks(fif_path, l_freq, h_freq, memory_budget)
+            record_arrays(raw_data=chunked_data)
+    if resample_fs is not None:
+        with stage('resample', resample_fs=resample_fs):
+            print(f'Decimating from {fif_file.info["sfreq"]:g} Hz to {resample_fs:g} Hz...')
+            fif_file, chunked_data = _decimate_recording(fif_file, resample_fs)
+            record_arrays(raw_data=chunked_data)
     
     # extracting data
-    raw_eeg_data = fif_file.get_data()[0:64, :]
     channel_names = fif_file.ch_names[0:64]
     eeg_times = fif_file.times
     fs = fif_file.info['sfreq']
     channel_names = np.array(channel_names)
+    if cache_dir is None:
+        raw_eeg_data = fif_file.get_data()[0:64, :] if chunked_data is None else chunked_data[0:64, :]
+        raw_eeg_data = raw_eeg_data.astype(dtype, copy=False)
+    else:
+        # keep the eeg channels followed by the stim channel(s) so events can still be found on a cache hit
+        if chunked_data is None:
+            stim_picks = mne.pick_types(fif_file.info, meg=False, stim=True)
+            cache_picks = np.concatenate([np.arange(64), stim_picks[stim_picks >= 64]])
+            cached_data = fif_file.get_data(picks=cache_picks)
+        else:
+            # the chunked reader only kept the eeg and stim channels, the decimated recording keeps every channel
+            cache_picks = np.arange(len(fif_file.ch_names))
+            cached_data = chunked_data
+        raw_eeg_data = cached_data[0:64, :].astype(dtype, copy=False)
+        # the trial events are decoded once and stored with the data, so a cache hit never scans the stim channel
+        cache_arrays = dict(data=cached_data, times=eeg_times, channel_names=np.array(fif_file.ch_names)[cache_picks],
+                            event_index=get_event_index(fif_file))
+        cache_info = mne.pick_info(fif_file.info, cache_picks)
+        cache_metadata = dict(fs=fs, l_freq=l_freq, h_freq=h_freq, reference='average')
+        save_cache_entry(cache_dir, cache_key, cache_arrays, cache_metadata, size_limit=cache_size_limit,
+                         file_writers={'info.fif': lambda info_path: mne.io.write_info(info_path, cache_info)})
     return fif_file, raw_eeg_data, eeg_times, channel_names, fs
+
+
+def _make_raw_array(data, info, first_samp=0):
+    '''
+    Function to wrap pre-processed (channels, samples) data - a cache entry's memory map or the output of
+    _read_filtered_chunks - in an MNE RawArray without copying it.
+
+    Parameters
+    ----------
+    data : Array of float64 of size (channels, samples)
+        EEG and stim channel data.
+    info : MNE Info
+        Measurement info of the channels in data (channel types, montage, filter settings, reference).
+    first_samp : int, optional
+        Sample number of the first sample in the original recording, so events keep their sample numbers. The default
+        is 0.
+
+    Returns
+    -------
+    fif_file : MNE RawArray
+        Raw object holding the eeg and stim channels.
+
+    '''
+    return mne.io.RawArray(data, info, first_samp=first_samp, verbose=False)
+
+
+def _read_filtered_chunks(fif_path, l_freq, h_freq, memory_budget):
+    '''
+    Function to read only the EEG and stim channels of a .fif recording, band-pass filter the EEG channels and
+    re-reference them to their average, one chunk of samples at a time, into one preallocated array.
+
+    The filter is the same zero-phase FIR filter Raw.filter designs. Each chunk is read with half a filter length of
+    overlap on both sides (padded past the ends of the recording the same way Raw.filter pads), so the chunks join
+    without edge effects and the result matches filtering the whole recording at once. The average reference is applied
+    per sample, so it works chunk by chunk as well.
+
+    Parameters
+    ----------
+    fif_path : string
+        Path of the .fif file.
+    l_freq : float
+        Lower edge of the band-pass filter in Hz.
+    h_freq : float
+        Upper edge of the band-pass filter in Hz.
+    memory_budget : int
+        Bytes of working memory allowed for one chunk (reading, padding and filtering it).
+
+    Returns
+    -------
+    fif_file : MNE RawArray
+        Raw object over data holding the eeg channels followed by the stim channel(s).
+    data : Array of float64 of size (channels, samples)
+        Filtered, re-referenced eeg channels followed by the stim channel(s).
+
+    '''
+    raw = mne.io.read_raw_fif(fif_path, preload=False)
+    eeg_picks = mne.pick_types(raw.info, meg=False, eeg=True, exclude='bads')
+    stim_picks = mne.pick_types(raw.info, meg=False, stim=True)
+    n_eeg_channels = len(eeg_picks)
+    n_samples = raw.n_times
+    filter_taps = mne.filter.create_filter(None, raw.info['sfreq'], l_freq, h_freq, verbose=False)
+    n_edge = (len(filter_taps) - 1)//2
+    if n_samples <= 2*n_edge + 1:
+        raise ValueError(f'The recording ({n_samples} samples) is too short for chunked filtering with a '
+                         f'{len(filter_taps)}-tap filter.')
+
+    # each chunk sample costs about 4 float64 values per eeg channel: the padded chunk, its filtered copy and the
+    # FFT convolution's work arrays
+    chunk_size = int(memory_budget//(n_eeg_channels*8*4)) - 2*n_edge
+    if chunk_size < len(filter_taps):
+        raise ValueError(f'A memory budget of {memory_budget} bytes is too small to filter {n_eeg_channels} channels '
+                         f'with a {len(filter_taps)}-tap filter; at least '
+                         f'{(len(filter_taps) + 2*n_edge)*n_eeg_channels*8*4} bytes are needed.')
+
+    data = np.empty((n_eeg_channels + len(stim_picks), n_samples))
+    for chunk_start in range(0, n_samples, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, n_samples)
+        read_start = max(chunk_start - n_edge, 0)
+        read_stop = min(chunk_stop + n_edge, n_samples)
+        chunk = raw.get_data(picks=eeg_picks, start=read_start, stop=read_stop)
+        # past the ends of the recording, pad like Raw.filter does (odd reflection about the end sample)
+        left_pad = n_edge - (chunk_start - read_start)
+        right_pad = n_edge - (read_stop - chunk_stop)
+        if left_pad > 0 or right_pad > 0:
+            chunk = np.concatenate([2*chunk[:, :1] - chunk[:, left_pad:0:-1], chunk,
+                                    2*chunk[:, -1:] - chunk[:, -2:-right_pad-2:-1]], axis=1)
+        filtered_chunk = scipy.signal.oaconvolve(chunk, filter_taps[np.newaxis], mode='valid', axes=1)
+        filtered_chunk -= np.mean(filtered_chunk, axis=0)
+        data[:n_eeg_channels, chunk_start:chunk_stop] = filtered_chunk
+        data[n_eeg_channels:, chunk_start:chunk_stop] = raw.get_data(picks=stim_picks, start=chunk_start,
+                                                                     stop=chunk_stop)
+
+    info = mne.pick_info(raw.info, np.concatenate([eeg_picks, stim_picks]))
+    # record the filter and reference the way Raw.filter and set_eeg_reference do
+    with info._unlock():
+        info['highpass'] = l_freq
+        info['lowpass'] = h_freq
+        info['custom_ref_applied'] = mne.io.constants.FIFF.FIFFV_MNE_CUSTOM_REF_ON
+    fif_file = _make_raw_array(data, info, first_samp=raw.first_samp)
+    fif_file.set_annotations(raw.annotations)
+    return fif_file, data
     
 
+def _decimate_recording(fif_file, resample_fs):
+    '''
+    Function to decimate a filtered recording by an integer factor with a polyphase anti-aliasing filter
+    (scipy.signal.resample_poly), one channel at a time into one preallocated array.
+
+    Decimated sample k lines up with original sample k*factor. The stim channel is not filtered: decimated sample k takes
+    the largest stim value of the original samples that round to it (k*factor - factor//2 up to k*factor + factor//2), so
+    an event at original sample s is found at round(s/factor) and no event is lost or smeared.
+
+    Parameters
+    ----------
+    fif_file : Raw MNE FIF file
+        Filtered recording (data loaded).
+    resample_fs : float
+        Sampling frequency to decimate to, in Hz. The recording's sampling frequency must be an integer multiple of it.
+
+    Returns
+    -------
+    fif_file : MNE RawArray
+        Raw object over data holding every channel of the recording at resample_fs.
+    data : Array of float64 of size (channels, decimated samples)
+        Decimated channels.
+
+    '''
+    factor = fif_file.info['sfreq']/resample_fs
+    if abs(factor - round(factor)) > 1e-9 or round(factor) < 1:
+        raise ValueError(f"The sampling frequency ({fif_file.info['sfreq']:g} Hz) is not an integer multiple of "
+                         f'resample_fs ({resample_fs:g} Hz).')
+    factor = int(round(factor))
+    n_samples = fif_file.n_times
+    n_decimated = -(-n_samples//factor)
+    stim_picks = mne.pick_types(fif_file.info, meg=False, stim=True)
+    data = np.empty((len(fif_file.ch_names), n_decimated))
+    for channel_index in range(len(fif_file.ch_names)):
+        channel_data = fif_file.get_data(picks=[channel_index])[0]
+        if channel_index in stim_picks:
+            # pad so block k covers the original samples that round to decimated sample k
+            padded_stim = np.pad(channel_data, (factor//2, factor), mode='edge')
+            data[channel_index] = np.max(np.reshape(padded_stim[:n_decimated*factor], (n_decimated, factor)), axis=1)
+        else:
+            data[channel_index] = scipy.signal.resample_poly(channel_data, 1, factor, padtype='line')
+
+    info = fif_file.info.copy()
+    with info._unlock():
+        info['sfreq'] = resample_fs
+    decimated_file = _make_raw_array(data, info, first_samp=int(round(fif_file.first_samp/factor)))
+    decimated_file.set_annotations(fif_file.annotations)
+    return decimated_file, data
+    
 
 #%% Epoching the data
-def get_eeg_epochs(fif_file, raw_eeg_data, start_time, end_time, fs):
+def get_eeg_epochs(fif_file, raw_eeg_data, start_time, end_time, fs, trials=None):
     '''
-    Function to epoch the EEG raw data into target/nontarget epochs. 
+    Function to epoch the EEG raw data into target/nontarget epochs. The trials come from the recording's event index
+    (see event_index.get_event_index), so the stim channel is only scanned the first time a recording is epoched.
 
     Parameters
     ----------
@@ -84,16 +335,21 @@ def get_eeg_epochs(fif_file, raw_eeg_data, start_time, end_time, fs):
         Array of floats containing the eeg recording data taken at each time point (across all
         trials and condiditons) for the one subject.
     start_time : float
-        start time relative to event start.
+        start time relative to event start in seconds, added to the onset (a negative start_time starts the epochs
+        before the onset). Earlier versions subtracted it, which only gave the same epochs for start_time=0.
     end_time : float
         end time relative to event start.
     fs : float
         smapling frquency of 512 Hz.
+    trials : structured array of event_index.EVENT_INDEX_DTYPE, optional
+        Trials to epoch, e.g. from event_index.select_trials. The default is None (all trials).
 
     Returns
     -------
     eeg_epochs : 3-D Array of size (trials, channels, time points)
-        3-D array contianing epoched eeg data into the trials seen in the experiment.
+        3-D array contianing epoched eeg data into the trials seen in the experiment. When the trials are evenly
+        spaced this is a read-only view into raw_eeg_data (no samples are copied), otherwise a new array. Writing to
+        it in place raises an error; use np.array(eeg_epochs) for a writable copy.
     epoch_times : 1-D array of length epoch time points
         Array of times using epoch time points.
     target_events : array of size (target_events, (event onset, post-experiment feedback, stimulus/condiiton id))
@@ -102,25 +358,81 @@ def get_eeg_epochs(fif_file, raw_eeg_data, start_time, end_time, fs):
         array containing the information on all events.
 
     '''
-    eeg_epochs = np.array([])
-    
-    # finding all trials present in experiment
-    all_trials = mne.find_events(fif_file)
-    # only using event trials (when music was perceived or imagined) - any event id under 1000 is one of the event trials
-    all_trials = all_trials[all_trials[:, 2] <1000]
-
-    # get all event start times    
-    event_start_times = all_trials[:, 0]
-    # epoch the data based on user entered end time and start time starting at onset of trial
-    for event_start_time in event_start_times:
-        start_epoch = int(event_start_time) - int(start_time*fs)
-        end_epoch = int(int(event_start_time) + (end_time*fs))
-        epoch_data = raw_eeg_data[:, start_epoch:end_epoch]
-        eeg_epochs = np.append(eeg_epochs, epoch_data)
-    eeg_epochs = np.reshape(eeg_epochs, [len(all_trials), np.size(raw_eeg_data, axis=0), int(end_time*fs)])
-    epoch_times = np.arange(0, np.size(eeg_epochs, axis=2))
+    with stage('epoch', start_time=start_time, end_time=end_time):
+        # all event trials (when music was perceived or imagined) - any event id under 1000 is one of the event trials
+        if trials is None:
+            trials = get_event_index(fif_file)
+        all_trials = get_events_array(trials)
+
+        # get all event start times    
+        event_start_times = all_trials[:, 0]
+        # epoch the data based on user entered end time and start time starting at onset of trial
+        start_epochs = event_start_times + int(start_time*fs)
+        n_epoch_samples = int(end_time*fs) - int(start_time*fs)
+        eeg_epochs = extract_epochs(raw_eeg_data, start_epochs, n_epoch_samples)
+        epoch_times = np.arange(0, np.size(eeg_epochs, axis=2))
+        record_arrays(eeg_epochs=eeg_epochs, all_trials=all_trials)
     return eeg_epochs, epoch_times, all_trials
 
+def get_ragged_eeg_epochs(fif_file, raw_eeg_data, start_time, fs, trial_durations=None, max_duration=16, trials=None):
+    '''
+    Function to epoch the EEG raw data into variable-length epochs, so each trial can keep its full stimulus length
+    (7 - 16 s in OpenMIIR) instead of being cut to the shortest one. The epochs are stored in one flat buffer with an
+    offsets index, which plot_component_variance, make_prediction and test_all_components_thresholds accept in place of
+    a 3-D epoch array.
+
+    Parameters
+    ----------
+    fif_file : Raw MNE FIF file
+        FIF file with MNE built in functions - all data can be extracted.
+    raw_eeg_data : Array of size (channels, samples) - samples depend on which subject is read
+        Array of floats containing the eeg recording data taken at each time point (across all
+        trials and condiditons) for the one subject.
+    start_time : float
+        start time relative to event start.
+    fs : float
+        smapling frquency of 512 Hz.
+    trial_durations : dictionary, optional
+        Length in seconds of each stimulus, keyed by stimulus id (event id // 10). The default is None: each trial runs
+        until the next trial starts, so nearly every epoch has its own length and RaggedEpochs.power_spectra only
+        batches trials together with pad_to_fast_length.
+    max_duration : float, optional
+        Longest epoch in seconds (measured from event start). The default is 16.
+    trials : structured array of event_index.EVENT_INDEX_DTYPE, optional
+        Trials to epoch, e.g. from event_index.select_trials. The default is None (all trials).
+
+    Returns
+    -------
+    ragged_epochs : RaggedEpochs
+        Variable-length epochs, ragged_epochs[i] is the (channels, time points) data of trial i.
+    all_trials : array of size (all trials, (event onset, post-experiment feedback, stimulus/condiiton id))
+        array containing the information on all events.
+
+    '''
+    with stage('epoch', start_time=start_time, max_duration=max_duration, ragged=True):
+        # all event trials - any event id under 1000 is one of the event trials
+        event_index = get_event_index(fif_file)
+        if trials is None:
+            trials = event_index
+        all_trials = get_events_array(trials)
+        event_start_times = all_trials[:, 0]
+        n_recording_samples = np.size(raw_eeg_data, axis=1)
+
+        # end of each epoch relative to event start, in samples
+        if trial_durations is None:
+            # each trial runs until the next trial of the whole recording starts
+            next_event_start_times = np.append(event_index['onset'][1:], n_recording_samples)
+            end_offsets = next_event_start_times[trials['trial_index']] - event_start_times
+        else:
+            end_offsets = np.array([int(trial_durations[stimulus_id]*fs) for stimulus_id in trials['stimulus_id']])
+        end_offsets = np.minimum(end_offsets, int(max_duration*fs))
+
+        start_epochs = event_start_times + int(start_time*fs)
+        end_epochs = np.minimum(event_start_times + end_offsets, n_recording_samples)
+        ragged_epochs = extract_ragged_epochs(raw_eeg_data, start_epochs, end_epochs - start_epochs)
+        record_arrays(ragged_data=ragged_epochs.data, offsets=ragged_epochs.offsets)
+    return ragged_epochs, all_trials
+
 #%% Setting Event Truth Labels
 def get_event_truth_labels(all_trials):
     '''
@@ -129,7 +441,8 @@ def get_event_truth_labels(all_trials):
     Parameters
     ----------
     all_trials : array of size (all trials, (event onset, post-experiment feedback, stimulus/condiiton id))
-        array containing the information on all events (both perceived and imagined trials).
+        array containing the information on all events (both perceived and imagined trials). An event index (structured
+        array of event_index.EVENT_INDEX_DTYPE) is accepted as well.
 
     Returns
     -------
@@ -137,30 +450,39 @@ def get_event_truth_labels(all_trials):
         boolean array containing labels denoting weather trial contained a perceived music (target) event or not.
 
     '''
-    # initialize array
-    is_target_event = np.array([])
-    # for each trial that occured, label if trial was a target (perceived music) event or not
-    for trial_index in range(len(all_trials)):
-        # decode event id and condition
-        event_id = all_trials[trial_index, 2]
-        condition = event_id % 10
-        # if the condition 1 then it was perceived music, if not it was imagined
-        if condition == 1:
-            is_target_event = np.append(is_target_event,True)
-        elif condition == 2 or condition==3 or condition == 4:
-            is_target_event = np.append(is_target_event,False)
-        else:
-            pass
-    is_target_event = np.array(is_target_event, dtype='bool')
+    with stage('label'):
+        # decode the condition of every trial at once: condition 1 is perceived music, 2 - 4 imagined
+        event_index = all_trials if all_trials.dtype.names is not None else build_event_index(all_trials)
+        is_target_event = get_truth_labels(event_index)
+        record_arrays(is_target_event=is_target_event)
     return is_target_event
 
 
 
 #%% Running ICA and plotting component variance
-def perform_ICA(raw_fif_file, channel_names, top_n_components):
+def perform_ICA(raw_fif_file, channel_names, top_n_components, decim=3, fit_start=None, fit_stop=None, random_state=97,
+                max_iter=800, cache_dir=None, warm_start=False, cache_size_limit=DEFAULT_CACHE_SIZE_LIMIT, plot=True,
+                reject=DEFAULT_EEG_REJECT, reject_segment_duration=1.0, n_components=0.999):
     '''
     Function to preform ICA on the specified raw EEG data
 
+    Before fitting, segments with an artifact on any eeg channel (see artifact_rejection.annotate_bad_segments) are
+    marked as BAD_amplitude annotations on raw_fif_file, and ICA is fit on the remaining clean spans only. How many
+    segments were rejected is printed. The annotations are removed again after the fit, so raw_fif_file is left as it
+    was passed in (with or without a cache hit).
+
+    The number of components is then chosen from the clean data (see get_pca_component_count): never more than its
+    numerical rank (63 for 64 average-referenced channels) and, for a fractional n_components, only as many principal
+    components as are needed to explain that fraction of the variance. FastICA runs in that smaller space; use
+    get_unmixing_matrix and get_mixing_matrix for the matrices between the eeg channels and the sources.
+
+    If cache_dir is given, the fitted ICA is saved there under a key made from the hash of the eeg data and the fit
+    parameters, and reloaded instead of refit when the same fit is asked for again. On a cache miss with warm_start, the
+    most recent cold (not warm-started) cached fit of the same data in the same PCA basis (same decim, time span,
+    rejection and n_components, e.g. only a different max_iter or random_state) is used as the starting unmixing
+    matrix, so FastICA only has to refine it. A warm-started fit is cached under a key that also names its seed entry,
+    so it is never returned for the cold fit of the same parameters.
+
     Parameters
     ----------
     fif_file : Raw MNE FIF file
@@ -169,6 +491,34 @@ def perform_ICA(raw_fif_file, channel_names, top_n_components):
         Array of eeg channel names.
     top_n_components : int
         the number of top components the user wishes to plot.
+    decim : int, optional
+        Only every decim-th sample is used to fit ICA. The default is 3.
+    fit_start : float, optional
+        First time point (in seconds) used to fit ICA. The default is None (start of the recording).
+    fit_stop : float, optional
+        Last time point (in seconds) used to fit ICA. The default is None (end of the recording).
+    random_state : int, optional
+        Seed of the ICA fit. The default is 97.
+    max_iter : int, optional
+        Maximum number of FastICA iterations. The default is 800.
+    cache_dir : string, optional
+        Directory of the ICA cache. The default is None (no caching).
+    warm_start : bool, optional
+        If True, start a new fit from the most recent cold cached fit of the same data and PCA basis. The default is
+        False.
+    cache_size_limit : int, optional
+        Size budget of the cache directory in bytes. The default is data_cache.DEFAULT_CACHE_SIZE_LIMIT.
+    plot : bool, optional
+        If True, save the topo maps of the top components to figures/Top{top_n_components}ICA.png. The default is True.
+    reject : dictionary or None, optional
+        Peak-to-peak ('ptp', 'flat') and 'variance' thresholds of the artifact rejection in volts (see
+        artifact_rejection.find_bad_segments). The default is artifact_rejection.DEFAULT_EEG_REJECT. None fits on the
+        whole recording.
+    reject_segment_duration : float, optional
+        Length in seconds of the segments the rejection checks. The default is 1.
+    n_components : float, int or None, optional
+        Fraction of the variance the kept principal components must explain (float below 1), largest number of
+        components (int) or None for the rank of the data. The default is 0.999.
 
     Returns
     -------
@@ -178,19 +528,242 @@ def perform_ICA(raw_fif_file, channel_names, top_n_components):
     '''
     # use only the eeg channels for fitting ICA
     picks_eeg = mne.pick_types(raw_fif_file.info, meg=False, eeg=True, eog=False, stim=False, exclude='bads')[0:64]
-    # calculate ICA components
-    ica = mne.preprocessing.ICA(n_components=64, random_state=97, max_iter=800)
-    # fit ICA 
-    ica.fit(raw_fif_file, picks=picks_eeg, decim=3, reject=dict(mag=4e-12, grad=4000e-13))
-    mixing_matrix = ica.mixing_matrix_
-    # plot the components topo maps
-    ica.plot_components(picks = np.arange(0,top_n_components))
-    plt.savefig(f'figures/Top{top_n_components}ICA.png')
+    fit_parameters = dict(n_components=n_components, method='fastica', random_state=random_state, max_iter=max_iter,
+                          decim=decim, start=fit_start, stop=fit_stop, reject=reject,
+                          reject_segment_duration=reject_segment_duration if reject is not None else None,
+                          channels=[raw_fif_file.ch_names[pick] for pick in picks_eeg])
+
+    # everything the principal components depend on, a cached fit can only seed a fit in the same basis
+    pca_basis = {field: fit_parameters[field] for field in ('n_components', 'decim', 'start', 'stop', 'reject',
+                                                             'reject_segment_duration', 'channels')}
+
+    ica = None
+    fit_params = None
+    seed_key, seed_metadata = None, None
+    if cache_dir is not None:
+        # hash the eeg data one channel at a time to avoid another full copy of the recording
+        data_hash = hash_arrays(raw_fif_file.get_data(picks=[pick]) for pick in picks_eeg)
+        ica_key = get_cache_key(data_hash, kind='ica', sfreq=raw_fif_file.info['sfreq'], **fit_parameters)
+        _, cache_metadata = load_cache_entry(cache_dir, ica_key)
+        if cache_metadata is None and warm_start:
+            # only cold fits seed, so a seed never depends on which warm fits happen to be cached
+            seed_fits = find_cache_entries(cache_dir, kind='ica', data_hash=data_hash, method='fastica',
+                                           pca_basis=pca_basis, seed_key=None)
+            if len(seed_fits) > 0:
+                seed_key, seed_metadata = seed_fits[0]
+                ica_key = get_cache_key(data_hash, kind='ica', sfreq=raw_fif_file.info['sfreq'], seed_key=seed_key,
+                                        **fit_parameters)
+                _, cache_metadata = load_cache_entry(cache_dir, ica_key)
+        if cache_metadata is not None:
+            print(f'Loading fitted ICA from cache entry {ica_key[:12]}...')
+            ica = mne.preprocessing.read_ica(os.path.join(cache_metadata['entry_dir'], 'solution-ica.fif'))
+
+    if ica is None:
+        # the BAD_amplitude annotations only exist while ICA is fit, raw_fif_file is handed back unchanged
+        original_annotations = raw_fif_file.annotations.copy()
+        try:
+            if reject is not None:
+                with stage('reject', segment_duration=reject_segment_duration, **reject):
+                    rejection_report = annotate_bad_segments(raw_fif_file, picks_eeg, reject_segment_duration, reject)
+                print(f"Rejected {rejection_report['n_rejected']} of {rejection_report['n_segments']} "
+                      f"{reject_segment_duration:g} s segments ({rejection_report['rejected_fraction']*100:.1f}%) "
+                      f"before fitting ICA: {rejection_report['counts']}")
+            # keep only the principal components with signal in them
+            with stage('pca_rank', n_components=n_components, decim=decim):
+                n_fit_components = get_pca_component_count(raw_fif_file, picks_eeg, n_components, fit_start, fit_stop,
+                                                           decim)
+            if seed_metadata is not None and seed_metadata['n_components'] == n_fit_components:
+                print(f'Warm-starting ICA from cache entry {seed_key[:12]}...')
+                previous_ica = mne.preprocessing.read_ica(os.path.join(seed_metadata['entry_dir'], 'solution-ica.fif'))
+                # undo the scaling MNE applies to FastICA's unmixing matrix to get back to the whitened PCA space
+                pca_norms = np.sqrt(previous_ica.pca_explained_variance_[:previous_ica.n_components_])
+                fit_params = dict(w_init=previous_ica.unmixing_matrix_ * pca_norms)
+            # calculate ICA components
+            ica = mne.preprocessing.ICA(n_components=n_fit_components, random_state=random_state, max_iter=max_iter,
+                                        fit_params=fit_params)
+            # fit ICA 
+            with stage('ica_fit', decim=decim, max_iter=max_iter, warm_start=fit_params is not None):
+                # the BAD_amplitude annotations keep the rejected segments out of the fit
+                ica.fit(raw_fif_file, picks=picks_eeg, start=fit_start, stop=fit_stop, decim=decim,
+                        reject_by_annotation=True)
+                record_arrays(unmixing_matrix=ica.unmixing_matrix_)
+        finally:
+            raw_fif_file.set_annotations(original_annotations)
+        print(f'FastICA stopped after {ica.n_iter_} of at most {max_iter} iterations')
+        # the starting matrix is not part of the solution (and cannot be written to the ICA file)
+        ica.fit_params.pop('w_init', None)
+        if cache_dir is not None:
+            cache_metadata = dict(kind='ica', data_hash=data_hash, n_components=n_fit_components, method='fastica',
+                                  pca_basis=pca_basis, seed_key=seed_key)
+            save_cache_entry(cache_dir, ica_key, {}, cache_metadata, size_limit=cache_size_limit,
+                             file_writers={'solution-ica.fif': lambda ica_path: ica.save(ica_path)})
+    # plot the components topo maps (the rendering layer is only imported when figures are asked for)
+    if plot:
+        from render_figures import plot_ica_components
+        plot_ica_components(ica, top_n_components, f'figures/Top{top_n_components}ICA.png')
 
     return ica
 
 
-def plot_component_variance(ica, components, eeg_epochs, is_target_event):
+def perform_group_ICA(subjects, n_components=None, decim=3, max_iter=200, random_state=97, l_freq=1, h_freq=30,
+                      cache_dir=None, memory_budget=None, spool_dir=None):
+    '''
+    Function to fit one ICA decomposition across many subjects (see group_ica.GroupICA). Each subject is loaded with
+    load_data once, streamed into the whitening statistics and spooled to disk decimated, so only one subject is in
+    memory at a time. The component numbers then mean the same thing for every subject, so one component can be picked
+    for all of them.
+
+    Parameters
+    ----------
+    subjects : list of string
+        Subject numbers (two digits) to fit.
+    n_components : int, optional
+        Number of components. The default is None (the rank of the data, 63 for 64 average-referenced channels).
+    decim : int, optional
+        Only every decim-th sample is used to fit. The default is 3.
+    max_iter : int, optional
+        Maximum number of FastICA fixed-point steps. The default is 200.
+    random_state : int, optional
+        Seed of the starting rotation and the minibatch draws. The default is 97.
+    l_freq : float, optional
+        Lower edge of the band-pass filter in Hz, passed on to load_data. The default is 1.
+    h_freq : float, optional
+        Upper edge of the band-pass filter in Hz, passed on to load_data. The default is 30.
+    cache_dir : string, optional
+        Directory of the pre-processed data cache, passed on to load_data. The default is None.
+    memory_budget : int, optional
+        Working memory in bytes for chunked loading, passed on to load_data. The default is None.
+    spool_dir : string, optional
+        Directory for the decimated samples spooled during the fit. The default is None (the temporary directory).
+
+    Returns
+    -------
+    group_ica : GroupICA
+        Fitted group decomposition; group_ica.get_subject_ica(subject) gives a subject's unmixing_matrix_ and
+        mixing_matrix_ to use in place of perform_ICA's result.
+
+    '''
+    def load_subject(subject):
+        return load_data(subject, l_freq, h_freq, cache_dir=cache_dir, memory_budget=memory_budget)[1]
+
+    with stage('group_ica_fit', n_subjects=len(subjects), decim=decim, max_iter=max_iter):
+        group_ica = GroupICA(n_components=n_components, decim=decim, max_iter=max_iter, random_state=random_state)
+        group_ica.fit(subjects, load_subject, spool_dir=spool_dir)
+        record_arrays(unmixing_matrix=group_ica.unmixing_matrix_)
+    return group_ica
+
+
+def get_pca_component_count(raw_fif_file, picks, n_components=0.999, fit_start=None, fit_stop=None, decim=3,
+                            rank_tolerance=1e-10, block_samples=2**16):
+    '''
+    Function to choose how many principal components ICA is fit on. The covariance of the data ICA would see (every
+    decim-th sample of the span, without the BAD annotated segments) is accumulated block by block, its numerical rank
+    is the number of eigenvalues above rank_tolerance times the largest one, and the count is capped at that rank. The
+    chosen count is printed.
+
+    Parameters
+    ----------
+    raw_fif_file : Raw MNE FIF file
+        Recording ICA is fit on.
+    picks : Array of int
+        Channels ICA is fit on.
+    n_components : float, int or None, optional
+        Fraction of the variance the kept components must explain (float below 1), largest number of components (int)
+        or None for the rank of the data. The default is 0.999.
+    fit_start : float, optional
+        First time point (in seconds) used. The default is None (start of the recording).
+    fit_stop : float, optional
+        Last time point (in seconds) used. The default is None (end of the recording).
+    decim : int, optional
+        Only every decim-th sample is used. The default is 3.
+    rank_tolerance : float, optional
+        Eigenvalues below rank_tolerance times the largest eigenvalue count as zero. The default is 1e-10.
+    block_samples : int, optional
+        Number of samples read at a time. The default is 2**16.
+
+    Returns
+    -------
+    n_fit_components : int
+        Number of principal components to fit ICA on.
+
+    '''
+    start = 0 if fit_start is None else raw_fif_file.time_as_index(fit_start)[0]
+    stop = raw_fif_file.n_times if fit_stop is None else raw_fif_file.time_as_index(fit_stop)[0]
+    block_samples = max(block_samples//decim, 1)*decim
+    n_samples = 0
+    data_sum = np.zeros(len(picks))
+    data_outer_sum = np.zeros((len(picks), len(picks)))
+    for block_start in range(start, stop, block_samples):
+        block = raw_fif_file.get_data(picks=picks, start=block_start, stop=min(block_start + block_samples, stop),
+                                      reject_by_annotation='omit')[:, ::decim]
+        n_samples += block.shape[1]
+        data_sum += np.sum(block, axis=1)
+        data_outer_sum += block @ block.T
+    if n_samples < 2:
+        raise ValueError('Too few samples left to choose the number of ICA components')
+    data_mean = data_sum/n_samples
+    covariance = (data_outer_sum - n_samples*np.outer(data_mean, data_mean))/(n_samples - 1)
+
+    eigenvalues = np.clip(np.linalg.eigvalsh(covariance)[::-1], 0, None)
+    rank = int(np.sum(eigenvalues > rank_tolerance*eigenvalues[0]))
+    explained_fractions = np.cumsum(eigenvalues)/np.sum(eigenvalues)
+    if n_components is None:
+        n_fit_components = rank
+    elif isinstance(n_components, float) and 0 < n_components < 1:
+        n_fit_components = min(int(np.searchsorted(explained_fractions, n_components)) + 1, rank)
+    else:
+        n_fit_components = min(int(n_components), rank)
+    print(f'Data rank {rank} of {len(picks)} channels: fitting ICA on {n_fit_components} components explaining '
+          f'{explained_fractions[n_fit_components - 1]*100:.2f}% of the variance')
+    return n_fit_components
+
+
+def get_unmixing_matrix(ica):
+    '''
+    Function to get the unmixing matrix from the eeg channels to the sources of a fitted ICA. For an MNE ICA, FastICA's
+    unmixing matrix acts on the kept principal components, so the PCA projection and the channel scaling are folded into
+    it; other decompositions (e.g. group_ica.SubjectICA) already hold channel matrices.
+
+    Parameters
+    ----------
+    ica : ICA Object of mne.preprocessing.ica module or SubjectICA
+        Fitted decomposition.
+
+    Returns
+    -------
+    unmixing_matrix : Array of float of size (components, channels)
+        Source activations are unmixing_matrix @ eeg data (up to a constant offset per source).
+
+    '''
+    if not hasattr(ica, 'pca_components_'):
+        return ica.unmixing_matrix_
+    pca_components = ica.pca_components_[:ica.n_components_]
+    return ica.unmixing_matrix_ @ pca_components / ica.pre_whitener_[:, 0]
+
+
+def get_mixing_matrix(ica):
+    '''
+    Function to get the mixing matrix from the sources of a fitted ICA back to the eeg channels (the inverse of
+    get_unmixing_matrix on the kept principal component space).
+
+    Parameters
+    ----------
+    ica : ICA Object of mne.preprocessing.ica module or SubjectICA
+        Fitted decomposition.
+
+    Returns
+    -------
+    mixing_matrix : Array of float of size (channels, components)
+        Maps source activations to eeg data.
+
+    '''
+    if not hasattr(ica, 'pca_components_'):
+        return ica.mixing_matrix_
+    pca_components = ica.pca_components_[:ica.n_components_]
+    return ica.pre_whitener_ * (pca_components.T @ ica.mixing_matrix_)
+
+
+def plot_component_variance(ica, components, eeg_epochs, is_target_event, plot=True):
     '''
     Function to plot component variance from ICA results
 
@@ -200,43 +773,33 @@ def plot_component_variance(ica, components, eeg_epochs, is_target_event):
         contains ICA data
     components : Array of int
         Number of components to plot
-    eeg_epochs : 3-D Array of size (trials, channels, time points)
-        3-D array contianing epoched eeg data into the trials seen in the experiment.
+    eeg_epochs : 3-D Array of size (trials, channels, time points) or RaggedEpochs
+        3-D array contianing epoched eeg data into the trials seen in the experiment, or variable-length epochs from
+        get_ragged_eeg_epochs.
     is_target_event : 1-D boolean array 
         Boolean array representing trials the subject perceived music vs imagined music.
+    plot : bool, optional
+        If True, save the variance histograms to figures/TopComponentVariances.png. The default is True.
 
     Returns
     -------
-    source_activations : Array of float
-        Array representing source activation data from each independant component of size (trials, channels, time-course of activation)
+    source_activations : SourceActivations
+        Array-like object representing source activation data from each independant component of size (trials, channels,
+        time-course of activation). Time courses are only computed for the parts that are indexed, and component
+        variances are computed from the epoch covariances without building the full array (np.asarray builds it).
 
     '''
-    # calc mixing and unmixing matrices
-    mixing_matrix = ica.mixing_matrix_
-    unmixing_matrix = ica.unmixing_matrix_
-    # calc source activations from epoched eeg data
-    source_activations = np.matmul(unmixing_matrix, eeg_epochs)
-    plt.figure('variance hists')
+    # calc mixing and unmixing matrices between the eeg channels and the sources
+    mixing_matrix = get_mixing_matrix(ica)
+    unmixing_matrix = get_unmixing_matrix(ica)
+    # source activations are computed lazily - their variances come from the epoch covariances
+    source_activations = SourceActivations(unmixing_matrix, eeg_epochs)
     # for each component, plot the histogram of variances over all trials
-    for component in components:
-        plt.subplot(2,5,component+1)
-        # isolate one components source activity
-        component_activation = source_activations[:, component, :]
-        # calc varaince of source activity
-        component_activation_variances = np.var(component_activation, axis = 1)
-        # break into different trial types
-        target_activation_vars = component_activation_variances[is_target_event]
-        nontarget_activation_vars = component_activation_variances[~is_target_event]
-        nontarget_activation_vars = np.delete(nontarget_activation_vars, 178)
-        
-        # plot each components variances broken up by trials in a subplot
-        plt.hist([target_activation_vars, nontarget_activation_vars], label=['Perception', 'Imagination'])
-        plt.xlabel('Variance')
-        plt.ylabel('Count')
-        plt.legend()
-        plt.title(f'component {component} variance')
-    plt.tight_layout()
-    plt.savefig(f'figures/TopComponentVariances.png')
+    if plot:
+        from render_figures import plot_component_variance_histograms
+        all_component_variances = get_component_variances(source_activations, components)
+        plot_component_variance_histograms(all_component_variances, components, is_target_event,
+                                           'figures/TopComponentVariances.png')
     return source_activations
 
 #%% Classification of Target/Nontarget events
@@ -265,18 +828,10 @@ def make_prediction(source_activations, component, is_target_event, threshold):
         if it was predicted a subject was imagining the music,  predicted_labels[i] = 0
 
     '''
-    component_activation = source_activations[:, component, :]
-    component_activation_variances = np.var(component_activation, axis = 1)
+    component_activation_variances = get_component_variances(source_activations, [component])[:, 0]
     # for each trial, predict weather it is perceived or imagined based on component variance
-    predicted_labels = [] 
-    for variance in component_activation_variances:
-        # if variance above threshold - perceived trial. Else imagined
-        if variance >= threshold:
-            predicted_labels.append(1)
-            
-        else:
-            predicted_labels.append(0)
-            
+    # if variance above threshold - perceived trial. Else imagined
+    predicted_labels = (component_activation_variances >= threshold).astype(int).tolist()
     return predicted_labels
 
 def evaluate_predictions(predictions, truth_labels):
@@ -329,22 +884,176 @@ def calculate_itr(accuracy, duration, truth_labels):
         Float which is the ITR in bits per second for the given accuracy and trial duration.
 
     '''
-    # calculate the number of classes present in our data - it will be the number of unique truth labels
-    n = len(np.unique(truth_labels))
-    p = accuracy
-    # use itr formula given, if accuracy = 1, ITR blows up, set equal to 1
-    if p == 1: 
-        itr_trial=1
-    else:
-        itr_trial = np.log2(n) + p*np.log2(p) + (1-p) * np.log2((1-p)/(n-1))
-    itr_time = itr_trial*(1/duration)
+    with stage('itr'):
+        # calculate the number of classes present in our data - it will be the number of unique truth labels
+        n = len(np.unique(truth_labels))
+        p = accuracy
+        # use itr formula given, if accuracy = 1, ITR blows up, set equal to 1
+        if p == 1: 
+            itr_trial=1
+        else:
+            itr_trial = np.log2(n) + p*np.log2(p) + (1-p) * np.log2((1-p)/(n-1))
+        itr_time = itr_trial*(1/duration)
     return itr_time   
 
-def test_all_components_thresholds(components, source_activations, is_target_event):
+def get_component_variances(source_activations, components):
+    '''
+    Function to compute the variance of each trial's source activation for a set of components.
+
+    Parameters
+    ----------
+    source_activations : Array of float or SourceActivations
+        Array representing source activation data from each independant component of size (trials, channels, time-course of activation)
+    components : Array of int
+        Components to compute variances for.
+
+    Returns
+    -------
+    component_activation_variances : Array of float of size (trials, components)
+        Variance of each trial's source activation for each of the given components.
+
+    '''
+    with stage('source_projection', n_components=len(components)):
+        # lazy source activations answer from their epoch covariances without computing any time courses
+        if isinstance(source_activations, SourceActivations):
+            component_activation_variances = source_activations.component_variances(components)
+        else:
+            component_activation_variances = np.empty((len(source_activations), len(components)))
+            for component_index, component in enumerate(components):
+                component_activation_variances[:, component_index] = np.var(source_activations[:, component, :],
+                                                                            axis=1)
+        record_arrays(component_activation_variances=component_activation_variances)
+    return component_activation_variances
+
+
+def sweep_thresholds(component_activation_variances, is_target_event):
+    '''
+    Function to evaluate every possible threshold of every component at once. Each component's variances are sorted
+    once, and the confusion matrix counts of all thresholds follow from cumulative sums of the sorted truth labels, so the
+    whole sweep costs O(n log n) per component instead of one prediction and confusion matrix per threshold.
+
+    The thresholds are each distinct trial variance (predicting perceived for variances >= threshold, as in
+    make_prediction) plus infinity (every trial predicted imagined), so every achievable labelling is covered.
+
+    Parameters
+    ----------
+    component_activation_variances : Array of float of size (trials, components)
+        Variance of each trial's source activation for each component (see get_component_variances).
+    is_target_event : 1-D boolean array 
+        Boolean array representing trials the subject perceived music vs imagined music.
+
+    Returns
+    -------
+    thresholds : Array of float of size (trials+1, components)
+        Candidate thresholds of each component in increasing order. Tied variances repeat the same threshold.
+    accuracies : Array of float of size (trials+1, components)
+        Accuracy of each threshold.
+    true_positives : Array of int of size (trials+1, components)
+        Number of perceived trials predicted as perceived. true_positives/np.sum(is_target_event) is the ROC true
+        positive rate.
+    false_positives : Array of int of size (trials+1, components)
+        Number of imagined trials predicted as perceived. false_positives/np.sum(~is_target_event) is the ROC false
+        positive rate.
+    true_negatives : Array of int of size (trials+1, components)
+        Number of imagined trials predicted as imagined.
+    false_negatives : Array of int of size (trials+1, components)
+        Number of perceived trials predicted as imagined.
+
+    '''
+    component_activation_variances = np.asarray(component_activation_variances)
+    is_target_event = np.asarray(is_target_event, dtype=bool)
+    n_trials, n_components = component_activation_variances.shape
+    # sort each component's variances and carry the truth labels along
+    sort_order = np.argsort(component_activation_variances, axis=0, kind='stable')
+    sorted_variances = np.take_along_axis(component_activation_variances, sort_order, axis=0)
+    sorted_is_target = is_target_event[sort_order]
+
+    # number of perceived/imagined trials below each sorted position (those are predicted imagined)
+    targets_below = np.zeros((n_trials+1, n_components), dtype=int)
+    targets_below[1:] = np.cumsum(sorted_is_target, axis=0)
+    nontargets_below = np.arange(n_trials+1)[:, np.newaxis] - targets_below
+
+    # a threshold equal to a tied variance predicts all of the tied trials perceived: use the first of each tie
+    first_of_tie = np.ones((n_trials, n_components), dtype=bool)
+    first_of_tie[1:] = sorted_variances[1:] != sorted_variances[:-1]
+    tie_start = np.maximum.accumulate(np.where(first_of_tie, np.arange(n_trials)[:, np.newaxis], 0), axis=0)
+    tie_start = np.concatenate([tie_start, np.full((1, n_components), n_trials)])
+    false_negatives = np.take_along_axis(targets_below, tie_start, axis=0)
+    true_negatives = np.take_along_axis(nontargets_below, tie_start, axis=0)
+    true_positives = np.count_nonzero(is_target_event) - false_negatives
+    false_positives = np.count_nonzero(~is_target_event) - true_negatives
+
+    thresholds = np.concatenate([sorted_variances, np.full((1, n_components), np.inf)])
+    accuracies = (true_positives + true_negatives)/n_trials
+    return thresholds, accuracies, true_positives, false_positives, true_negatives, false_negatives
+
+
+def select_best_component_threshold(components, source_activations, is_target_event):
+    '''
+    Function to find the component and threshold with the highest accuracy, searching every achievable threshold of
+    every component with sweep_thresholds (test_all_components_thresholds only scores a 10-point grid, for its figure).
+
+    Parameters
+    ----------
+    components : Array of int
+        Components to choose from.
+    source_activations : Array of float or SourceActivations
+        Array representing source activation data from each independant component of size (trials, channels, time-course of activation)
+    is_target_event : 1-D boolean array
+        Boolean array representing trials the subject perceived music vs imagined music.
+
+    Returns
+    -------
+    component : int
+        Component with the highest accuracy (the lowest one on ties).
+    threshold : float
+        Its threshold (trials with variance >= threshold are predicted perceived, as in make_prediction).
+    accuracy : float
+        Accuracy of the component and threshold.
+
+    '''
+    component_activation_variances = get_component_variances(source_activations, components)
+    with stage('sweep', n_components=len(components)):
+        thresholds, accuracies = sweep_thresholds(component_activation_variances, is_target_event)[:2]
+        best_row, best_column = np.unravel_index(np.argmax(accuracies), accuracies.shape)
+    threshold = get_centered_threshold(component_activation_variances[:, best_column], thresholds[best_row, best_column])
+    return int(components[best_column]), threshold, float(accuracies[best_row, best_column])
+
+
+def get_centered_threshold(component_activation_variances, threshold):
+    '''
+    Function to move a threshold from sweep_thresholds (a trial variance) halfway down to the next lower trial variance.
+    Every trial is labelled the same, but a trial whose variance equals the threshold is no longer flipped by rounding
+    (e.g. when the same trials are classified in float32).
+
+    Parameters
+    ----------
+    component_activation_variances : 1-D array of float
+        Variance of each trial's source activation for one component.
+    threshold : float
+        Threshold of that component from sweep_thresholds.
+
+    Returns
+    -------
+    centered_threshold : float
+        Threshold between the lowest variance predicted perceived and the highest variance predicted imagined (threshold
+        itself if no trial is predicted imagined, or none perceived).
+
+    '''
+    lower_variances = component_activation_variances[component_activation_variances < threshold]
+    if len(lower_variances) == 0 or not np.isfinite(threshold):
+        return float(threshold)
+    return float((np.max(lower_variances) + threshold)/2)
+
+
+def test_all_components_thresholds(components, source_activations, is_target_event, plot=True):
     '''
     Function to create an array of potential thresholds based on each components range of source activation variances,
     and then test each potential threshold to determine the threshold that gives us the highest predicted accuracy
 
+    Only 10 thresholds per component are scored, for the metrics figure; select_best_component_threshold searches every
+    achievable threshold and is what the pipeline chooses its component and threshold with.
+
     Parameters
     ----------
    components : Array of int
@@ -353,14 +1062,17 @@ def test_all_components_thresholds(components, source_activations, is_target_eve
         Array representing source activation data from each independant component of size (trials, channels, time-course of activation)
    is_target_event : 1-D boolean array 
         Boolean array representing trials the subject perceived music vs imagined music.
+   plot : bool, optional
+        If True, save the metrics of every component/threshold pair to figures/AllMetrics.png. The default is True.
 
     Returns
     -------
-    all_accuracies : Array of float
-        Array of calculated accuracy values with varying threshold values for each component
-    all_thresholds : Array of float
-        contains range of 10 possible threshold values for each selected component (in this case 10 components)
-    all_true_positives : Array of float
+    all_accuracies : Array of float of size (components, thresholds)
+        Array of calculated accuracy values with varying threshold values for each component. Rows run over the
+        components in reverse order (components[::-1]).
+    all_thresholds : Array of float of size (components, thresholds)
+        contains range of 10 possible threshold values for each selected component
+    all_true_positives : Array of float of size (components, thresholds)
         Array of values for when our classifier accurately predicted the subject was actually hearing music
 
     '''
@@ -368,52 +1080,42 @@ def test_all_components_thresholds(components, source_activations, is_target_eve
     all_thresholds = np.array([])
     all_true_positive_percentages = np.array([])
     components = components[::-1]
-    # for each component and threshold pair, calculate the accuracy, and true positives of our classifer 
-    for component in components:
-        component_activation = source_activations[:, component, :]
-        component_activation_variances = np.var(component_activation, axis = 1)
-        # delete 238th variance, very large relatively, outlier
-        component_activation_variances = np.delete(component_activation_variances, 238)
-        # min and max threshold that would be viable on a certain component based on specific components variance values
-        min_threshold = np.min(component_activation_variances)
-        max_threshold = np.max(component_activation_variances)
-        # creates an array of thresholds based on the components range of values
-        thresholds = np.arange(min_threshold, max_threshold, (max_threshold-min_threshold)/10)
-        all_thresholds = np.append(all_thresholds, thresholds)
-        for threshold in thresholds:
-            predicted_labels = make_prediction(source_activations, component, is_target_event, threshold)
-            accuracy, cm, disp = evaluate_predictions(predicted_labels, is_target_event*1)
-            all_accuracies = np.append(all_accuracies, accuracy)
-            tp_percent = cm[1][1]/60
-            all_true_positive_percentages = np.append(all_true_positive_percentages, tp_percent)
-    all_accuracies = np.reshape(all_accuracies, (len(thresholds), len(components)))        
-    all_thresholds = np.reshape(all_thresholds, (len(thresholds), len(components)))
-    all_true_positive_percentages = np.reshape(all_true_positive_percentages, (len(thresholds), len(components)))
+    # compute every component's trial variances once, then score each component's thresholds against the sorted variances
+    all_component_variances = get_component_variances(source_activations, components)
+    n_targets = np.count_nonzero(is_target_event)
+    with stage('sweep', n_components=len(components)):
+        for component_index in range(len(components)):
+            component_activation_variances = all_component_variances[:, component_index]
+            # delete 238th variance, very large relatively, outlier (only recordings with that many trials have it)
+            trimmed_variances = component_activation_variances
+            if len(component_activation_variances) > 238:
+                trimmed_variances = np.delete(component_activation_variances, 238)
+            # min and max threshold that would be viable on a certain component based on specific components variance values
+            min_threshold = np.min(trimmed_variances)
+            max_threshold = np.max(trimmed_variances)
+            # creates an array of thresholds based on the components range of values
+            # (np.arange with a float step can round to 11 values)
+            thresholds = np.linspace(min_threshold, max_threshold, 10, endpoint=False)
+            all_thresholds = np.append(all_thresholds, thresholds)
+            # trials with variance >= threshold are predicted perceived
+            sorted_variances = np.sort(component_activation_variances)
+            sorted_target_variances = np.sort(component_activation_variances[is_target_event])
+            n_predicted_targets = len(sorted_variances) - np.searchsorted(sorted_variances, thresholds, side='left')
+            true_positives = len(sorted_target_variances) - np.searchsorted(sorted_target_variances, thresholds, side='left')
+            true_negatives = (len(sorted_variances) - n_targets) - (n_predicted_targets - true_positives)
+            accuracies = (true_positives + true_negatives)/len(sorted_variances)
+            all_accuracies = np.append(all_accuracies, accuracies)
+            all_true_positive_percentages = np.append(all_true_positive_percentages, true_positives/n_targets)
+        # one row per component (in the reversed order tested), one column per threshold
+        all_accuracies = np.reshape(all_accuracies, (len(components), len(thresholds)))
+        all_thresholds = np.reshape(all_thresholds, (len(components), len(thresholds)))
+        all_true_positive_percentages = np.reshape(all_true_positive_percentages, (len(components), len(thresholds)))
+        record_arrays(all_accuracies=all_accuracies)
     
     # plot metrics for each component/threshold pair on pseudocolor subplots
-    plt.subplot(1, 3, 1)
-    plt.imshow(all_accuracies, extent = (components[-1], components[0], components[-1], components[0]))
-    plt.colorbar(label = 'Accuracy (% Correct)', fraction=0.046, pad=0.04)
-    plt.xlabel('Threshold Index')
-    plt.ylabel('Component')
-    plt.title('All Component/Threshold Accuracies')
-
-    plt.subplot(1, 3, 2)
-    plt.imshow(all_true_positive_percentages, extent = (components[-1], components[0], components[-1], components[0]))
-    plt.colorbar(label = 'TP %', fraction=0.046, pad=0.04)
-    plt.xlabel('Threshold Index')
-    plt.ylabel('Component')
-    plt.title('All Component/Threshold True Positives')
-   
-    plt.subplot(1, 3, 3)
-    plt.imshow(np.mean(np.array([all_accuracies, all_true_positive_percentages]), axis=0 ), extent = (components[-1], components[0], components[-1], components[0]))
-    plt.colorbar(label = 'Average of TP% and Accuracy', fraction=0.046, pad=0.04)
-    plt.xlabel('Threshold Index')
-    plt.ylabel('Component')
-    plt.title('Average of All Component/Threshold Accuracies and True Positives')
-    
-    plt.tight_layout()
-    plt.savefig(f'figures/AllMetrics.png')
+    if plot:
+        from render_figures import plot_threshold_metrics
+        plot_threshold_metrics(components[::-1], all_accuracies, all_true_positive_percentages, 'figures/AllMetrics.png')
 
     return all_accuracies, all_thresholds, all_true_positive_percentages
     
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+artifact_rejection.py
+
+File that defines functions get_segment_amplitudes, find_bad_segments and annotate_bad_segments - amplitude-based
+rejection of artifact segments in continuous EEG before fitting ICA.
+
+The recording is cut into fixed-length segments, and the peak-to-peak amplitude and variance of every channel in every
+segment are computed in one vectorized pass over a strided (channels, segments, samples) view of the data. A segment is
+bad if any channel exceeds the peak-to-peak or variance (RMS) threshold, or is flat. Runs of bad segments are marked as
+BAD_amplitude annotations on the recording, which ICA.fit skips (reject_by_annotation), so FastICA only sees the clean
+spans.
+
+The default thresholds are for band-passed EEG in volts: segments with a peak-to-peak amplitude over 150 uV or an RMS
+over 50 uV on any channel are artifacts (blinks, movement, electrode pops), and a channel with less than 1 uV
+peak-to-peak over a whole segment is disconnected.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import mne
+import numpy as np
+
+# description of the annotations marking rejected segments
+BAD_SEGMENT_DESCRIPTION = 'BAD_amplitude'
+# default rejection thresholds for band-passed EEG (volts, volts squared)
+DEFAULT_EEG_REJECT = dict(ptp=150e-6, variance=(50e-6)**2, flat=1e-6)
+
+
+#%% Segment amplitudes
+def get_segment_amplitudes(data, segment_samples):
+    '''
+    Function to compute the peak-to-peak amplitude and variance of every channel in every non-overlapping segment of a
+    recording, using a strided view of the data (the samples after the last whole segment are ignored).
+
+    Parameters
+    ----------
+    data : Array of float of size (channels, samples)
+        Continuous data.
+    segment_samples : int
+        Length of a segment in samples.
+
+    Returns
+    -------
+    peak_to_peak : Array of float of size (channels, segments)
+        Peak-to-peak amplitude of each channel in each segment.
+    variances : Array of float of size (channels, segments)
+        Variance of each channel in each segment.
+
+    '''
+    n_channels, n_samples = np.shape(data)
+    n_segments = n_samples//segment_samples
+    # (channels, segments, samples) view of the whole segments, no copy
+    segments = np.reshape(np.asarray(data)[:, :n_segments*segment_samples], (n_channels, n_segments, segment_samples))
+    peak_to_peak = np.max(segments, axis=2) - np.min(segments, axis=2)
+    variances = np.var(segments, axis=2, dtype=np.float64)
+    return peak_to_peak, variances
+
+
+def find_bad_segments(data, fs, segment_duration=1.0, reject=None):
+    '''
+    Function to find the segments of a recording with an artifact on any channel.
+
+    Parameters
+    ----------
+    data : Array of float of size (channels, samples)
+        Continuous eeg data in volts.
+    fs : float
+        Sampling frequency in Hz.
+    segment_duration : float, optional
+        Length of a segment in seconds. The default is 1.
+    reject : dictionary, optional
+        Thresholds: 'ptp' (largest allowed peak-to-peak amplitude), 'variance' (largest allowed variance) and 'flat'
+        (smallest allowed peak-to-peak amplitude); leave one out or set it to None to skip it. The default is None
+        (DEFAULT_EEG_REJECT).
+
+    Returns
+    -------
+    is_bad_segment : 1-D boolean array
+        True for each segment with an artifact.
+    segment_samples : int
+        Length of a segment in samples.
+    rejection_counts : dictionary
+        Number of segments exceeding each threshold (a segment can exceed several).
+
+    '''
+    reject = DEFAULT_EEG_REJECT if reject is None else reject
+    segment_samples = max(int(round(segment_duration*fs)), 1)
+    peak_to_peak, variances = get_segment_amplitudes(data, segment_samples)
+    exceeded = {}
+    if reject.get('ptp') is not None:
+        exceeded['ptp'] = np.any(peak_to_peak > reject['ptp'], axis=0)
+    if reject.get('variance') is not None:
+        exceeded['variance'] = np.any(variances > reject['variance'], axis=0)
+    if reject.get('flat') is not None:
+        exceeded['flat'] = np.any(peak_to_peak < reject['flat'], axis=0)
+    is_bad_segment = np.zeros(peak_to_peak.shape[1], dtype=bool)
+    for is_exceeded in exceeded.values():
+        is_bad_segment |= is_exceeded
+    return is_bad_segment, segment_samples, {name: int(np.sum(is_exceeded)) for name, is_exceeded in exceeded.items()}
+
+
+#%% Annotating a recording
+def annotate_bad_segments(raw_fif_file, picks=None, segment_duration=1.0, reject=None):
+    '''
+    Function to mark the artifact segments of a recording as BAD_amplitude annotations (replacing any earlier
+    BAD_amplitude annotations), so ICA.fit and other reject_by_annotation functions skip them.
+
+    Parameters
+    ----------
+    raw_fif_file : Raw MNE FIF file
+        Recording to annotate (changed in place).
+    picks : Array of int, optional
+        Channels to check. The default is None (all eeg channels except bad ones).
+    segment_duration : float, optional
+        Length of a segment in seconds. The default is 1.
+    reject : dictionary, optional
+        Thresholds (see find_bad_segments). The default is None (DEFAULT_EEG_REJECT).
+
+    Returns
+    -------
+    rejection_report : dictionary
+        'n_segments', 'n_rejected', 'rejected_fraction', 'rejected_seconds' and 'counts' (segments exceeding each
+        threshold).
+
+    '''
+    if picks is None:
+        picks = mne.pick_types(raw_fif_file.info, meg=False, eeg=True, exclude='bads')
+    fs = raw_fif_file.info['sfreq']
+    is_bad_segment, segment_samples, rejection_counts = find_bad_segments(raw_fif_file.get_data(picks=picks), fs,
+                                                                          segment_duration, reject)
+
+    # merge runs of bad segments into one annotation each
+    bad_edges = np.diff(np.concatenate([[0], is_bad_segment.astype(int), [0]]))
+    run_starts = np.flatnonzero(bad_edges == 1)
+    run_stops = np.flatnonzero(bad_edges == -1)
+    annotations = raw_fif_file.annotations
+    annotations = annotations[[description != BAD_SEGMENT_DESCRIPTION for description in annotations.description]]
+    # onsets of annotations with an orig_time count from the measurement start, not from the first sample
+    onset_offset = raw_fif_file.first_time if annotations.orig_time is not None else 0
+    annotations += mne.Annotations(onset=run_starts*segment_samples/fs + onset_offset,
+                                   duration=(run_stops - run_starts)*segment_samples/fs,
+                                   description=BAD_SEGMENT_DESCRIPTION, orig_time=annotations.orig_time)
+    raw_fif_file.set_annotations(annotations)
+
+    n_rejected = int(np.sum(is_bad_segment))
+    return dict(n_segments=len(is_bad_segment), n_rejected=n_rejected,
+                rejected_fraction=n_rejected/max(len(is_bad_segment), 1),
+                rejected_seconds=n_rejected*segment_samples/fs, counts=rejection_counts)
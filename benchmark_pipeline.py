@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+benchmark_pipeline.py
+
+File that defines functions generate_benchmark_data, benchmark_recording, compare_to_baseline, and main - the command
+line entry point of the benchmark suite.
+
+Every stage of the Project3 pipeline (load_data, get_eeg_epochs, get_event_truth_labels, perform_ICA,
+plot_component_variance, test_all_components_thresholds, make_prediction, calculate_itr) and of import_ssvep_data
+(load_ssvep_data, epoch_ssvep_data, get_frequency_spectrum, get_ssvep_mean_spectra) is timed on synthetic recordings
+(see synthetic_data) of each requested length. Stage times are the median of several repeats; peak memory is the largest tracemalloc peak of
+the stage, measured in a separate pass so tracing does not slow down the timed runs. Plotting is turned off throughout.
+
+Results are written as JSON and can be compared against an earlier result file (the baseline): any stage that got
+slower or used more memory than the tolerance allows is reported and the exit code is 1.
+
+With --dtype float32 the pipeline runs in single precision. --check-float32 runs the Project3 stages in float64 and
+float32 on the same recording and ICA fit, and fails (exit code 1) if the float32 run classifies any trial differently.
+
+Example:
+    python -m benchmark_pipeline --durations 300 1200 --output benchmarks/new.json --baseline benchmarks/old.json
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import mne
+import numpy as np
+import scipy
+import Project3
+import import_ssvep_data
+from synthetic_data import make_synthetic_recording, make_synthetic_ssvep_data
+
+# subject number the synthetic recordings are written as (data/P{subject}-raw.fif and data/SSVEP_S{subject}.npz)
+BENCHMARK_SUBJECT = 90
+# number of OpenMIIR trials (the threshold sweep expects a full 240-trial session)
+BENCHMARK_TRIALS = 240
+# stages of each pipeline, in the order they run
+PROJECT3_STAGES = ('load_data', 'get_eeg_epochs', 'get_event_truth_labels', 'perform_ICA', 'plot_component_variance',
+                   'test_all_components_thresholds', 'make_prediction', 'calculate_itr')
+SSVEP_STAGES = ('load_ssvep_data', 'epoch_ssvep_data', 'get_frequency_spectrum', 'get_ssvep_mean_spectra')
+
+
+#%% Synthetic data
+def generate_benchmark_data(data_directory, duration, fs=512.0, seed=0):
+    '''
+    Function to write the synthetic OpenMIIR and SSVEP recordings of one benchmark size.
+
+    Parameters
+    ----------
+    data_directory : string
+        Directory to write the files to (ending in a path separator).
+    duration : float
+        Length of the OpenMIIR recording in seconds. Its 240 trials are spread evenly over it, and the SSVEP recording
+        holds as many 20 s trials as fit in the same length.
+    fs : float, optional
+        Sampling frequency of the OpenMIIR recording in Hz. The default is 512.
+    seed : int, optional
+        Seed of the random number generators. The default is 0.
+
+    Returns
+    -------
+    None.
+
+    '''
+    make_synthetic_recording(data_directory + f'P{BENCHMARK_SUBJECT}-raw.fif', n_trials=BENCHMARK_TRIALS,
+                             trial_spacing=duration/BENCHMARK_TRIALS, fs=fs, seed=seed)
+    make_synthetic_ssvep_data(data_directory, subject=BENCHMARK_SUBJECT, n_trials=max(2, int(duration//22)), seed=seed)
+
+
+#%% Running the stages
+def _run_stage(stage, state, settings):
+    '''
+    Function to run one pipeline stage on the results of the stages before it (kept in state).
+    '''
+    subject = f'{BENCHMARK_SUBJECT}'
+    if stage == 'load_data':
+        (state['fif_file'], state['raw_eeg_data'], state['eeg_times'], state['channel_names'],
+         state['fs']) = Project3.load_data(subject, dtype=settings['dtype'])
+    elif stage == 'get_eeg_epochs':
+        state['eeg_epochs'], state['epoch_times'], state['all_trials'] = Project3.get_eeg_epochs(
+            state['fif_file'], state['raw_eeg_data'], settings['start_time'], settings['end_time'], state['fs'])
+    elif stage == 'get_event_truth_labels':
+        state['is_target_event'] = Project3.get_event_truth_labels(state['all_trials'])
+    elif stage == 'perform_ICA':
+        state['ica'] = Project3.perform_ICA(state['fif_file'], state['channel_names'], settings['top_n_components'],
+                                            max_iter=settings['ica_max_iter'], warm_start=False, plot=False)
+    elif stage == 'plot_component_variance':
+        state['components'] = np.arange(0, settings['top_n_components'], 1)
+        state['source_activations'] = Project3.plot_component_variance(state['ica'], state['components'],
+                                                                       state['eeg_epochs'], state['is_target_event'],
+                                                                       plot=False)
+    elif stage == 'test_all_components_thresholds':
+        state['all_accuracies'], state['all_thresholds'], state['all_true_positive_percentages'] = \
+            Project3.test_all_components_thresholds(state['components'], state['source_activations'],
+                                                    state['is_target_event'], plot=False)
+    elif stage == 'make_prediction':
+        state['component'], state['threshold'], state['sweep_accuracy'] = Project3.select_best_component_threshold(
+            state['components'], state['source_activations'], state['is_target_event'])
+        state['predicted_labels'] = Project3.make_prediction(state['source_activations'], state['component'],
+                                                             state['is_target_event'], state['threshold'])
+    elif stage == 'calculate_itr':
+        accuracy, cm, disp = Project3.evaluate_predictions(state['predicted_labels'], state['is_target_event']*1)
+        state['itr_time'] = Project3.calculate_itr(accuracy, settings['end_time']-settings['start_time'],
+                                                   state['is_target_event'])
+    elif stage == 'load_ssvep_data':
+        state['data_dict'] = import_ssvep_data.load_ssvep_data(BENCHMARK_SUBJECT, 'data/')
+    elif stage == 'epoch_ssvep_data':
+        state['ssvep_epochs'], state['ssvep_epoch_times'], state['is_trial_15Hz'] = \
+            import_ssvep_data.epoch_ssvep_data(state['data_dict'], dtype=settings['dtype'])
+    elif stage == 'get_frequency_spectrum':
+        state['eeg_epochs_fft'], state['fft_frequencies'] = import_ssvep_data.get_frequency_spectrum(
+            state['ssvep_epochs'], state['data_dict']['fs'])
+    elif stage == 'get_ssvep_mean_spectra':
+        state['mean_spectra'], state['mean_spectra_frequencies'] = import_ssvep_data.get_ssvep_mean_spectra(
+            state['data_dict'], dtype=settings['dtype'])
+    else:
+        raise ValueError(f'Unknown benchmark stage {stage!r}')
+
+
+def _run_stages(stages, settings, trace_memory=False):
+    '''
+    Function to run stages in order and return the wall time (s) of each, or its tracemalloc peak (bytes) if
+    trace_memory is True.
+    '''
+    state = {}
+    measurements = {}
+    for stage in stages:
+        if trace_memory:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+            _run_stage(stage, state, settings)
+            measurements[stage] = tracemalloc.get_traced_memory()[1] - start_memory
+        else:
+            stage_start = time.perf_counter()
+            _run_stage(stage, state, settings)
+            measurements[stage] = time.perf_counter() - stage_start
+    return measurements
+
+
+def benchmark_recording(stages, settings, repeats=3, measure_memory=True):
+    '''
+    Function to time and memory-profile pipeline stages on the recordings in data/ of the working directory.
+
+    Parameters
+    ----------
+    stages : tuple of string
+        Stages to run, in order (see PROJECT3_STAGES and SSVEP_STAGES).
+    settings : dictionary
+        Pipeline settings: start_time, end_time, top_n_components, ica_max_iter and dtype.
+    repeats : int, optional
+        Number of timed runs of the stages. The default is 3.
+    measure_memory : bool, optional
+        If True, run the stages once more under tracemalloc to measure their peak memory. The default is True.
+
+    Returns
+    -------
+    stage_results : dictionary
+        For each stage: 'time_s' (median wall time), 'times_s' (wall time of every run) and, if measure_memory is True,
+        'peak_memory_mb' (memory allocated at the stage's peak above what was allocated before it).
+
+    '''
+    stage_times = [_run_stages(stages, settings) for repeat in range(repeats)]
+    stage_results = {stage: {'time_s': statistics.median(times[stage] for times in stage_times),
+                             'times_s': [times[stage] for times in stage_times]}
+                     for stage in stages}
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            stage_peaks = _run_stages(stages, settings, trace_memory=True)
+        finally:
+            tracemalloc.stop()
+        for stage in stages:
+            stage_results[stage]['peak_memory_mb'] = stage_peaks[stage]/2**20
+    return stage_results
+
+
+def check_float32_accuracy(settings):
+    '''
+    Function to check that running the Project3 stages in float32 classifies the recording in data/ exactly like float64.
+    Both runs use the same ICA fit.
+
+    Parameters
+    ----------
+    settings : dictionary
+        Pipeline settings: start_time, end_time, top_n_components and ica_max_iter (dtype is ignored).
+
+    Returns
+    -------
+    float32_check : dictionary
+        'float64_accuracy' and 'float32_accuracy' (best accuracy of the threshold sweep), 'predictions_equal' (whether
+        the float32 run predicts the same label for every trial at the float64 run's best component and threshold),
+        'max_relative_variance_difference' and 'passed'.
+
+    '''
+    states = {}
+    for dtype in ('float64', 'float32'):
+        state = {} if dtype == 'float64' else {'ica': states['float64']['ica']}
+        for stage in PROJECT3_STAGES:
+            if stage != 'perform_ICA' or 'ica' not in state:
+                _run_stage(stage, state, dict(settings, dtype=dtype))
+        states[dtype] = state
+
+    float64_state, float32_state = states['float64'], states['float32']
+    # predictions of the float32 run at the component and threshold the float64 run picked
+    component, threshold = float64_state['component'], float64_state['threshold']
+    float32_labels = Project3.make_prediction(float32_state['source_activations'], component,
+                                              float32_state['is_target_event'], threshold)
+    float64_variances = Project3.get_component_variances(float64_state['source_activations'],
+                                                          float64_state['components'])
+    float32_variances = Project3.get_component_variances(float32_state['source_activations'],
+                                                          float32_state['components'])
+    float32_check = {'float64_accuracy': float64_state['sweep_accuracy'],
+                     'float32_accuracy': float32_state['sweep_accuracy'],
+                     'predictions_equal': float32_labels == float64_state['predicted_labels'],
+                     'max_relative_variance_difference': float(np.max(np.abs(float32_variances - float64_variances)
+                                                                      / np.abs(float64_variances)))}
+    float32_check['passed'] = (float32_check['predictions_equal']
+                               and float32_check['float32_accuracy'] == float32_check['float64_accuracy'])
+    return float32_check
+
+
+def get_environment():
+    '''
+    Function to describe the machine and library versions a benchmark ran with, stored alongside its results.
+
+    Returns
+    -------
+    environment : dictionary
+        Python, numpy, scipy and mne versions, platform and CPU count.
+
+    '''
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'mne': mne.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+#%% Comparing against a baseline
+def compare_to_baseline(results, baseline, tolerance=0.2, min_time_difference=0.05, min_memory_difference=1.0):
+    '''
+    Function to find the stages that got slower or used more memory than in a baseline result file. Small absolute
+    differences are ignored, so stages that take a few milliseconds do not flag timer noise.
+
+    Parameters
+    ----------
+    results : dictionary
+        Benchmark results (as written by main).
+    baseline : dictionary
+        Earlier benchmark results to compare against.
+    tolerance : float, optional
+        Allowed relative increase (0.2 = 20 % slower or larger). The default is 0.2.
+    min_time_difference : float, optional
+        Smallest increase in seconds that counts as a regression. The default is 0.05.
+    min_memory_difference : float, optional
+        Smallest increase in MiB that counts as a regression. The default is 1.
+
+    Returns
+    -------
+    regressions : list of string
+        One line per regression. Empty if nothing regressed.
+
+    '''
+    regressions = []
+    for duration, stage_results in results['results'].items():
+        baseline_stages = baseline.get('results', {}).get(duration, {})
+        for stage, stage_result in stage_results.items():
+            if stage not in baseline_stages:
+                continue
+            for measure, unit, min_difference in (('time_s', 's', min_time_difference),
+                                                  ('peak_memory_mb', 'MiB', min_memory_difference)):
+                if measure not in stage_result or measure not in baseline_stages[stage]:
+                    continue
+                new_value = stage_result[measure]
+                old_value = baseline_stages[stage][measure]
+                if new_value > old_value*(1+tolerance) and new_value - old_value > min_difference:
+                    regressions.append(f'{duration} s recording, {stage}: {measure} {old_value:.3f} -> '
+                                       f'{new_value:.3f} {unit} ({new_value/old_value-1:+.0%})')
+    return regressions
+
+
+def format_results_table(results):
+    '''
+    Function to format benchmark results as a plain-text table with one row per recording length and stage.
+
+    Parameters
+    ----------
+    results : dictionary
+        Benchmark results (as written by main).
+
+    Returns
+    -------
+    table : string
+        Results table.
+
+    '''
+    lines = [f"{'duration_s':>10}  {'stage':<32}  {'time_s':>8}  {'peak_mb':>8}"]
+    lines.append('-' * len(lines[0]))
+    for duration, stage_results in results['results'].items():
+        for stage, stage_result in stage_results.items():
+            peak_memory = stage_result.get('peak_memory_mb')
+            peak_memory = '-' if peak_memory is None else f'{peak_memory:.1f}'
+            lines.append(f"{duration:>10}  {stage:<32}  {stage_result['time_s']:>8.3f}  {peak_memory:>8}")
+    return '\n'.join(lines)
+
+
+#%% Command line entry point
+def main(argv=None):
+    '''
+    Function that parses command line arguments, runs the benchmarks, prints and saves the results and compares them
+    against a baseline.
+
+    Parameters
+    ----------
+    argv : list of string, optional
+        Command line arguments. The default is None (use sys.argv).
+
+    Returns
+    -------
+    exit_code : int
+        1 if any stage regressed against the baseline, 0 otherwise.
+
+    '''
+    parser = argparse.ArgumentParser(prog='python -m benchmark_pipeline', description='Time and memory-profile the '
+                                     'Project3 and import_ssvep_data stages on synthetic recordings.')
+    parser.add_argument('--durations', type=float, nargs='+', default=[300, 1200],
+                        help='recording lengths in seconds (default 300 1200)')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per recording length (default 3)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--skip-ssvep', action='store_true', help='only benchmark the Project3 stages')
+    parser.add_argument('--top-n-components', type=int, default=10, help='components to test (default 10)')
+    parser.add_argument('--ica-max-iter', type=int, default=200, help='ICA iterations (default 200)')
+    parser.add_argument('--dtype', choices=('float64', 'float32'), default='float64',
+                        help='precision of the pipeline (default float64)')
+    parser.add_argument('--check-float32', action='store_true',
+                        help='check that float32 classifies every recording exactly like float64')
+    parser.add_argument('--work-dir', default=None,
+                        help='directory for the synthetic recordings (default: a temporary directory)')
+    parser.add_argument('--output', default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative increase before a stage counts as a regression (default 0.2)')
+    args = parser.parse_args(argv)
+
+    settings = {'start_time': 0, 'end_time': 7.6, 'top_n_components': args.top_n_components,
+                'ica_max_iter': args.ica_max_iter, 'dtype': args.dtype}
+    stages = PROJECT3_STAGES if args.skip_ssvep else PROJECT3_STAGES + SSVEP_STAGES
+    results = {'environment': get_environment(), 'settings': dict(settings, repeats=args.repeats), 'results': {}}
+
+    # the pipeline reads data/ relative to the working directory
+    original_directory = os.getcwd()
+    output_file = None if args.output is None else os.path.abspath(args.output)
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        work_dir = temporary_directory if args.work_dir is None else args.work_dir
+        os.makedirs(os.path.join(work_dir, 'data'), exist_ok=True)
+        try:
+            os.chdir(work_dir)
+            for duration in args.durations:
+                print(f'Benchmarking a {duration:g} s recording...', file=sys.stderr)
+                generate_benchmark_data('data/', duration)
+                results['results'][f'{duration:g}'] = benchmark_recording(stages, settings, repeats=args.repeats,
+                                                                          measure_memory=not args.no_memory)
+                if args.check_float32:
+                    results.setdefault('float32_checks', {})[f'{duration:g}'] = check_float32_accuracy(settings)
+        finally:
+            os.chdir(original_directory)
+
+    print(format_results_table(results))
+    if output_file is not None:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        with open(output_file, 'w') as result_file:
+            json.dump(results, result_file, indent=2)
+    float32_failed = False
+    for duration, float32_check in results.get('float32_checks', {}).items():
+        print(f"float32 check, {duration} s recording: accuracy {float32_check['float64_accuracy']:.4f} (float64) vs "
+              f"{float32_check['float32_accuracy']:.4f} (float32), same predictions: "
+              f"{float32_check['predictions_equal']}, largest relative variance difference "
+              f"{float32_check['max_relative_variance_difference']:.2e}")
+        float32_failed = float32_failed or not float32_check['passed']
+    if args.baseline is None:
+        return 1 if float32_failed else 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare_to_baseline(results, baseline, tolerance=args.tolerance)
+    for regression in regressions:
+        print(f'Regression: {regression}')
+    if not regressions:
+        print(f'No regressions against {args.baseline}.')
+    return 1 if regressions or float32_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
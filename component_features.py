@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+component_features.py
+
+File that defines functions get_epoch_covariances and get_source_variances, and the SourceActivations class.
+
+The classifier only uses the per-trial variance of ICA source activations. Since the variance of w·x is w·Cov(x)·wᵀ,
+the 64 x 64 channel covariance of every epoch is computed once, and the source variances of any unmixing matrix (or any
+subset of its rows) follow from it without building the (trials, components, time points) source activation array.
+SourceActivations stands in for that array: it computes time courses only for the trials, components and samples that
+are indexed, and answers variance queries from the epoch covariances.
+
+float32 epochs give float32 time courses, but covariances (and so variances) are always accumulated in float64.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import numpy as np
+from epoching import RaggedEpochs, _get_float_dtype
+
+
+#%% Covariance features
+def get_epoch_covariances(eeg_epochs, batch_size=16):
+    '''
+    Function to compute the channel covariance matrix of every epoch (normalized by the number of samples, like np.var).
+    Epochs are centered a batch at a time, so the extra memory is one batch of epochs.
+
+    Parameters
+    ----------
+    eeg_epochs : 3-D Array of size (trials, channels, time points) or RaggedEpochs
+        3-D array contianing epoched eeg data into the trials seen in the experiment.
+    batch_size : int, optional
+        Number of epochs centered at a time. The default is 16.
+
+    Returns
+    -------
+    epoch_covariances : 3-D Array of size (trials, channels, channels)
+        Channel covariance matrix of each epoch.
+
+    '''
+    # variable-length epochs compute their covariances from views into their flat buffer
+    if isinstance(eeg_epochs, RaggedEpochs):
+        return eeg_epochs.covariances()
+    n_trials, n_channels, n_samples = np.shape(eeg_epochs)
+    epoch_covariances = np.empty((n_trials, n_channels, n_channels))
+    for batch_start in range(0, n_trials, batch_size):
+        batch_epochs = np.asarray(eeg_epochs[batch_start:batch_start+batch_size], dtype=np.float64)
+        centered_epochs = batch_epochs - np.mean(batch_epochs, axis=2, keepdims=True)
+        epoch_covariances[batch_start:batch_start+batch_size] = (np.matmul(centered_epochs,
+                                                                           centered_epochs.transpose(0, 2, 1))
+                                                                 / n_samples)
+    return epoch_covariances
+
+
+def get_source_variances(epoch_covariances, unmixing_matrix, components=None):
+    '''
+    Function to compute the variance of each trial's source activation from the epoch covariances.
+
+    Parameters
+    ----------
+    epoch_covariances : 3-D Array of size (trials, channels, channels)
+        Channel covariance matrix of each epoch (see get_epoch_covariances).
+    unmixing_matrix : Array of size (components, channels)
+        ICA unmixing matrix.
+    components : Array of int, optional
+        Components (rows of unmixing_matrix) to compute variances for. The default is None (all components).
+
+    Returns
+    -------
+    source_variances : Array of float of size (trials, components)
+        Variance of each trial's source activation for each requested component.
+
+    '''
+    unmixing_rows = np.asarray(unmixing_matrix) if components is None else np.asarray(unmixing_matrix)[components]
+    # w·C·wᵀ for every trial and row: (trials, channels, rows) then sum over channels
+    covariance_times_rows = np.matmul(epoch_covariances, unmixing_rows.T)
+    source_variances = np.sum(covariance_times_rows * unmixing_rows.T[np.newaxis], axis=1)
+    return source_variances
+
+
+#%% Lazy source activations
+class SourceActivations:
+    '''
+    Class that behaves like the (trials, components, time points) array np.matmul(unmixing_matrix, eeg_epochs) without
+    building it. Indexing with source_activations[trials, components, samples] (each an int, slice or list) computes only
+    the requested part, component_variances answers variance queries from the epoch covariances, and np.asarray
+    builds the full array if it is really needed.
+
+    eeg_epochs can also be a RaggedEpochs container of variable-length epochs. Then the trial index must be a single int
+    (time courses differ in length) and shape reports the longest epoch.
+
+    Parameters
+    ----------
+    unmixing_matrix : Array of size (components, channels)
+        ICA unmixing matrix.
+    eeg_epochs : 3-D Array of size (trials, channels, time points) or RaggedEpochs
+        Epoched eeg data.
+    epoch_covariances : 3-D Array of size (trials, channels, channels), optional
+        Precomputed epoch covariances. The default is None (computed on the first variance query).
+
+    '''
+    def __init__(self, unmixing_matrix, eeg_epochs, epoch_covariances=None):
+        self.unmixing_matrix = np.asarray(unmixing_matrix)
+        self.eeg_epochs = eeg_epochs
+        self._epoch_covariances = epoch_covariances
+
+    @property
+    def shape(self):
+        if isinstance(self.eeg_epochs, RaggedEpochs):
+            return (len(self.eeg_epochs), self.unmixing_matrix.shape[0], int(np.max(self.eeg_epochs.lengths)))
+        return (np.shape(self.eeg_epochs)[0], self.unmixing_matrix.shape[0], np.shape(self.eeg_epochs)[2])
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def dtype(self):
+        # time courses are computed in the precision of the epochs
+        if isinstance(self.eeg_epochs, RaggedEpochs):
+            return np.dtype(_get_float_dtype(self.eeg_epochs.data))
+        return np.dtype(_get_float_dtype(self.eeg_epochs))
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def epoch_covariances(self):
+        '''
+        Channel covariance matrix of each epoch, computed on first use.
+        '''
+        if self._epoch_covariances is None:
+            self._epoch_covariances = get_epoch_covariances(self.eeg_epochs)
+        return self._epoch_covariances
+
+    def component_variances(self, components=None):
+        '''
+        Method to compute the variance of each trial's source activation for the given components.
+
+        Parameters
+        ----------
+        components : Array of int, optional
+            Components to compute variances for. The default is None (all components).
+
+        Returns
+        -------
+        source_variances : Array of float of size (trials, components)
+            Variance of each trial's source activation for each requested component.
+
+        '''
+        return get_source_variances(self.epoch_covariances, self.unmixing_matrix, components)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(index is Ellipsis for index in key) or len(key) > 3:
+            raise IndexError('SourceActivations supports indexing with up to 3 ints, slices or lists, not Ellipsis')
+        trial_key, component_key, sample_key = key + (slice(None),) * (3 - len(key))
+        # a single sample is taken as a length-1 slice so the matmul below keeps its shape, then dropped
+        is_single_sample = isinstance(sample_key, (int, np.integer))
+        if is_single_sample:
+            sample_key = slice(sample_key, sample_key + 1 if sample_key != -1 else None)
+        if isinstance(self.eeg_epochs, RaggedEpochs) and not isinstance(trial_key, (int, np.integer)):
+            raise IndexError('Variable-length source activations can only be indexed one trial at a time')
+        # select trials and samples first so only the requested time courses are computed
+        selected_epochs = np.asarray(self.eeg_epochs[trial_key])[..., sample_key]
+        source_activations = np.matmul(self.unmixing_matrix[component_key].astype(self.dtype, copy=False),
+                                       selected_epochs)
+        return source_activations[..., 0] if is_single_sample else source_activations
+
+    def __array__(self, dtype=None, copy=None):
+        if isinstance(self.eeg_epochs, RaggedEpochs):
+            raise TypeError('Variable-length source activations cannot be converted to one array')
+        source_activations = np.matmul(self.unmixing_matrix.astype(self.dtype, copy=False), self.eeg_epochs)
+        return source_activations if dtype is None else source_activations.astype(dtype)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+cross_validation.py
+
+File that defines functions get_stratified_folds, select_component_threshold, select_component_nested, and
+cross_validate_subject.
+
+Choosing the component and threshold with the highest accuracy on the same trials they are scored on overfits. These
+functions estimate the accuracy of the variance classifier on held-out trials instead: the trials are split into
+stratified folds (each fold keeps the perception/imagination ratio), the component and threshold are chosen on the
+training trials of each fold with Project3.sweep_thresholds and centred with Project3.get_centered_threshold (the same
+choice as Project3.select_best_component_threshold), and the held-out trials are predicted with the same rule as
+Project3.make_prediction and scored with Project3.evaluate_predictions and Project3.calculate_itr.
+
+The per-trial component variances are computed once (see Project3.get_component_variances) and every fold only indexes
+rows of that (trials, components) matrix, so nothing is recomputed per fold. With nested cross-validation the
+component is chosen by an inner cross-validation on each outer training set, and only the threshold is fit on the whole
+outer training set. Each fold only takes microseconds, so the folds run in this process.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+from Project3 import calculate_itr, evaluate_predictions, get_centered_threshold, sweep_thresholds
+
+
+#%% Folds
+def get_stratified_folds(is_target_event, n_folds=5, seed=0):
+    '''
+    Function to split the trials into stratified folds: every fold holds out about 1/n_folds of the perception trials
+    and of the imagination trials.
+
+    Parameters
+    ----------
+    is_target_event : 1-D boolean array
+        Boolean array representing trials the subject perceived music vs imagined music.
+    n_folds : int, optional
+        Number of folds. The default is 5.
+    seed : int, optional
+        Seed of the shuffle before splitting. The default is 0.
+
+    Returns
+    -------
+    folds : list of (1-D array of int, 1-D array of int)
+        Training and held-out trial indices of each fold.
+
+    '''
+    is_target_event = np.asarray(is_target_event, dtype=bool)
+    splitter = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed)
+    return list(splitter.split(np.zeros((len(is_target_event), 1)), is_target_event))
+
+
+#%% Selecting a component and threshold on training trials
+def select_component_threshold(component_activation_variances, is_target_event, train_indices, component_indices=None):
+    '''
+    Function to find the component and threshold with the highest accuracy on a set of training trials.
+
+    Parameters
+    ----------
+    component_activation_variances : Array of float of size (trials, components)
+        Variance of each trial's source activation for each component (see Project3.get_component_variances).
+    is_target_event : 1-D boolean array
+        Boolean array representing trials the subject perceived music vs imagined music.
+    train_indices : 1-D array of int
+        Trials to choose on.
+    component_indices : 1-D array of int, optional
+        Columns of component_activation_variances to choose from. The default is None (all columns).
+
+    Returns
+    -------
+    component_index : int
+        Column of component_activation_variances of the chosen component.
+    threshold : float
+        Chosen threshold, centred between the training variances on either side of it (trials with variance >=
+        threshold are predicted perceived).
+    train_accuracy : float
+        Accuracy of the choice on the training trials.
+
+    '''
+    if component_indices is None:
+        component_indices = np.arange(np.shape(component_activation_variances)[1])
+    train_variances = np.asarray(component_activation_variances)[np.ix_(train_indices, component_indices)]
+    thresholds, accuracies = sweep_thresholds(train_variances, np.asarray(is_target_event)[train_indices])[:2]
+    best_row, best_column = np.unravel_index(np.argmax(accuracies), accuracies.shape)
+    threshold = get_centered_threshold(train_variances[:, best_column], thresholds[best_row, best_column])
+    return int(component_indices[best_column]), threshold, float(accuracies[best_row, best_column])
+
+
+def select_component_nested(component_activation_variances, is_target_event, train_indices, n_inner_folds=5, seed=0):
+    '''
+    Function to choose a component by an inner cross-validation on the training trials, then fit its threshold on all
+    of them. Each component is scored by its held-out accuracy over the inner folds, where each inner fold fits that
+    component's threshold on its own training trials.
+
+    Parameters
+    ----------
+    component_activation_variances : Array of float of size (trials, components)
+        Variance of each trial's source activation for each component.
+    is_target_event : 1-D boolean array
+        Boolean array representing trials the subject perceived music vs imagined music.
+    train_indices : 1-D array of int
+        Trials to choose on.
+    n_inner_folds : int, optional
+        Number of inner folds. The default is 5.
+    seed : int, optional
+        Seed of the inner fold shuffle. The default is 0.
+
+    Returns
+    -------
+    component_index : int
+        Column of component_activation_variances of the chosen component.
+    threshold : float
+        Threshold of the chosen component fit on all training trials.
+    inner_accuracy : float
+        Inner cross-validated accuracy of the chosen component.
+
+    '''
+    component_activation_variances = np.asarray(component_activation_variances)
+    is_target_event = np.asarray(is_target_event, dtype=bool)
+    train_indices = np.asarray(train_indices)
+    n_components = component_activation_variances.shape[1]
+    n_correct = np.zeros(n_components)
+    for inner_train, inner_test in get_stratified_folds(is_target_event[train_indices], n_inner_folds, seed):
+        inner_train_indices = train_indices[inner_train]
+        inner_test_indices = train_indices[inner_test]
+        # best threshold of every component at once on the inner training trials
+        thresholds, accuracies = sweep_thresholds(component_activation_variances[inner_train_indices],
+                                                  is_target_event[inner_train_indices])[:2]
+        inner_train_variances = component_activation_variances[inner_train_indices]
+        best_thresholds = [get_centered_threshold(inner_train_variances[:, component_index], threshold)
+                           for component_index, threshold in
+                           enumerate(thresholds[np.argmax(accuracies, axis=0), np.arange(n_components)])]
+        predictions = component_activation_variances[inner_test_indices] >= best_thresholds
+        n_correct += np.sum(predictions == is_target_event[inner_test_indices, np.newaxis], axis=0)
+    inner_accuracies = n_correct/len(train_indices)
+    component_index = int(np.argmax(inner_accuracies))
+    component_index, threshold, train_accuracy = select_component_threshold(
+        component_activation_variances, is_target_event, train_indices, component_indices=np.array([component_index]))
+    return component_index, threshold, float(inner_accuracies[component_index])
+
+
+#%% Cross-validation
+def _evaluate_fold(component_activation_variances, is_target_event, train_indices, test_indices, nested, n_inner_folds,
+                   seed):
+    '''
+    Function to choose a component and threshold on one fold's training trials and predict its held-out trials.
+    '''
+    if nested:
+        component_index, threshold, train_accuracy = select_component_nested(
+            component_activation_variances, is_target_event, train_indices, n_inner_folds, seed)
+    else:
+        component_index, threshold, train_accuracy = select_component_threshold(
+            component_activation_variances, is_target_event, train_indices)
+    # same rule as Project3.make_prediction: variance >= threshold is predicted perceived
+    predicted_labels = (component_activation_variances[test_indices, component_index] >= threshold).astype(int)
+    return {'component_index': component_index, 'threshold': threshold, 'train_accuracy': train_accuracy,
+            'test_indices': test_indices, 'predicted_labels': predicted_labels}
+
+
+def cross_validate_subject(component_activation_variances, is_target_event, duration, components=None, n_folds=5,
+                           nested=False, n_inner_folds=5, seed=0):
+    '''
+    Function to estimate the held-out accuracy and ITR of the variance classifier for one subject by stratified k-fold
+    (or nested) cross-validation over the component x threshold grid.
+
+    Parameters
+    ----------
+    component_activation_variances : Array of float of size (trials, components)
+        Variance of each trial's source activation for each candidate component, computed once for all folds (see
+        Project3.get_component_variances).
+    is_target_event : 1-D boolean array
+        Boolean array representing trials the subject perceived music vs imagined music.
+    duration : float
+        Epoch length in seconds (for the ITR).
+    components : Array of int, optional
+        Component number of each column of component_activation_variances. The default is None (0, 1, 2, ...).
+    n_folds : int, optional
+        Number of outer folds. The default is 5.
+    nested : bool, optional
+        If True, choose the component of each outer fold by an inner cross-validation. The default is False.
+    n_inner_folds : int, optional
+        Number of inner folds when nested is True. The default is 5.
+    seed : int, optional
+        Seed of the fold shuffles. The default is 0.
+
+    Returns
+    -------
+    cv_results : dictionary
+        'accuracy' (held-out accuracy over all trials), 'itr' (ITR in bits per second of that accuracy), 'cm' (confusion
+        matrix of the held-out predictions), 'fold_accuracies', 'fold_components', 'fold_thresholds',
+        'fold_train_accuracies' (one value per fold; the inner cross-validated accuracy when nested) and
+        'predicted_labels' (held-out prediction of every trial).
+
+    '''
+    component_activation_variances = np.asarray(component_activation_variances)
+    is_target_event = np.asarray(is_target_event, dtype=bool)
+    if components is None:
+        components = np.arange(component_activation_variances.shape[1])
+    folds = get_stratified_folds(is_target_event, n_folds, seed)
+    fold_results = [_evaluate_fold(component_activation_variances, is_target_event, train_indices, test_indices, nested,
+                                   n_inner_folds, seed) for train_indices, test_indices in folds]
+
+    # pool the held-out predictions of all folds, so every trial is predicted exactly once
+    predicted_labels = np.empty(len(is_target_event), dtype=int)
+    fold_accuracies = []
+    for fold_result in fold_results:
+        predicted_labels[fold_result['test_indices']] = fold_result['predicted_labels']
+        fold_accuracies.append(float(np.mean(fold_result['predicted_labels']
+                                             == is_target_event[fold_result['test_indices']])))
+    accuracy, cm, disp = evaluate_predictions(predicted_labels, is_target_event*1)
+    return {'accuracy': float(accuracy), 'itr': float(calculate_itr(accuracy, duration, is_target_event)), 'cm': cm,
+            'fold_accuracies': fold_accuracies,
+            'fold_components': [int(components[fold_result['component_index']]) for fold_result in fold_results],
+            'fold_thresholds': [fold_result['threshold'] for fold_result in fold_results],
+            'fold_train_accuracies': [fold_result['train_accuracy'] for fold_result in fold_results],
+            'predicted_labels': predicted_labels}
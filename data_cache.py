@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+data_cache.py
+
+File that defines functions hash_file, hash_arrays, get_cache_key, load_cache_entry, save_cache_entry,
+find_cache_entries, and evict_cache.
+
+These functions keep a content-addressed on-disk cache of preprocessed recordings. An entry is keyed on the hash of the
+source .fif file plus the preprocessing parameters, and holds every field as a plain .npy file so that repeat runs can
+memory-map the data (np.load(mmap_mode='r')) instead of reading, filtering and re-referencing the recording again.
+Entries are evicted least-recently-used first once the cache grows past a size budget.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# default size budget of the cache directory (bytes)
+DEFAULT_CACHE_SIZE_LIMIT = 20 * 1024**3
+# name of the file holding the non-array fields of an entry - its modification time marks the last use of the entry
+METADATA_FILE_NAME = 'metadata.json'
+# name of the file remembering source file hashes so unchanged files are not re-hashed on every run
+FILE_HASHES_NAME = 'file_hashes.json'
+# hashes computed in this process, by path, size and modification time (used with or without a cache directory)
+_file_hashes = {}
+
+
+#%% Cache keys
+def hash_file(file_path, cache_dir=None, block_size=2**22):
+    '''
+    Function to compute the SHA-256 hash of a file. Hashes are remembered in memory by path, size and modification time
+    so an unchanged file is only read once per process, and also in cache_dir if it is given so it is only read once
+    across runs.
+
+    Parameters
+    ----------
+    file_path : string
+        Path of the file to hash.
+    cache_dir : string, optional
+        Cache directory to remember hashes in across runs. The default is None (only remember them in memory).
+    block_size : int, optional
+        Number of bytes read at a time. The default is 4 MiB.
+
+    Returns
+    -------
+    file_hash : string
+        Hexadecimal SHA-256 digest of the file contents.
+
+    '''
+    file_stat = os.stat(file_path)
+    stat_key = f'{os.path.abspath(file_path)}:{file_stat.st_size}:{file_stat.st_mtime_ns}'
+    if stat_key in _file_hashes:
+        return _file_hashes[stat_key]
+    known_hashes = {}
+    if cache_dir is not None:
+        known_hashes_path = os.path.join(cache_dir, FILE_HASHES_NAME)
+        if os.path.exists(known_hashes_path):
+            with open(known_hashes_path) as known_hashes_file:
+                known_hashes = json.load(known_hashes_file)
+        if stat_key in known_hashes:
+            _file_hashes[stat_key] = known_hashes[stat_key]
+            return known_hashes[stat_key]
+
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(block_size), b''):
+            sha.update(block)
+    file_hash = sha.hexdigest()
+    _file_hashes[stat_key] = file_hash
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        known_hashes[stat_key] = file_hash
+        _write_json_atomic(os.path.join(cache_dir, FILE_HASHES_NAME), known_hashes)
+    return file_hash
+
+
+def hash_arrays(arrays):
+    '''
+    Function to compute the hash of the contents of a sequence of arrays. Passing a generator lets large data be hashed
+    piece by piece (e.g. one channel at a time) without holding a full copy in memory.
+
+    Parameters
+    ----------
+    arrays : iterable of arrays
+        Arrays to hash, in order. Shapes and dtypes are part of the hash.
+
+    Returns
+    -------
+    array_hash : string
+        Hexadecimal BLAKE2b digest of the array contents.
+
+    '''
+    blake = hashlib.blake2b(digest_size=32)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        blake.update(f'{array.dtype.str}{array.shape}'.encode())
+        blake.update(array.data)
+    return blake.hexdigest()
+
+
+def get_cache_key(source_hash, **parameters):
+    '''
+    Function to build the key of a cache entry from the source data hash and the parameters used to process it.
+
+    Parameters
+    ----------
+    source_hash : string
+        Hash of the source data (see hash_file).
+    **parameters : JSON-serializable values
+        Every parameter that changes the cached result (e.g. filter band, reference).
+
+    Returns
+    -------
+    cache_key : string
+        Hexadecimal key naming the cache entry.
+
+    '''
+    key_text = json.dumps({'source': source_hash, 'parameters': parameters}, sort_keys=True)
+    return hashlib.sha256(key_text.encode()).hexdigest()
+
+
+#%% Reading and writing entries
+def load_cache_entry(cache_dir, cache_key, mmap_mode='r'):
+    '''
+    Function to load a cache entry. Arrays are memory-mapped, so only the bytes that are used get read from disk.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache directory.
+    cache_key : string
+        Key of the entry (see get_cache_key).
+    mmap_mode : string or None, optional
+        Mode passed on to np.load. The default is 'r' (read-only memory map).
+
+    Returns
+    -------
+    arrays : dictionary or None
+        Dictionary of the arrays in the entry, None if the entry does not exist.
+    metadata : dictionary or None
+        Dictionary of the non-array fields of the entry, plus 'entry_dir' holding the entry directory. None if the entry
+        does not exist.
+
+    '''
+    entry_dir = os.path.join(cache_dir, cache_key)
+    metadata_path = os.path.join(entry_dir, METADATA_FILE_NAME)
+    if not os.path.exists(metadata_path):
+        return None, None
+    with open(metadata_path) as metadata_file:
+        metadata = json.load(metadata_file)
+    arrays = {}
+    for array_name in metadata['arrays']:
+        arrays[array_name] = np.load(os.path.join(entry_dir, f'{array_name}.npy'), mmap_mode=mmap_mode)
+    metadata['entry_dir'] = entry_dir
+    # mark the entry as recently used
+    os.utime(metadata_path)
+    return arrays, metadata
+
+
+def save_cache_entry(cache_dir, cache_key, arrays, metadata=None, size_limit=DEFAULT_CACHE_SIZE_LIMIT,
+                     file_writers=None):
+    '''
+    Function to write a cache entry and then evict old entries until the cache fits in its size budget. The entry is
+    written to a temporary directory first and moved into place, so a crash never leaves a half-written entry behind.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache directory.
+    cache_key : string
+        Key of the entry (see get_cache_key).
+    arrays : dictionary
+        Dictionary of arrays to store, one .npy file per array (object arrays are not allowed).
+    metadata : dictionary, optional
+        JSON-serializable non-array fields to store with the entry. The default is None.
+    size_limit : int, optional
+        Size budget of the cache directory in bytes. The default is DEFAULT_CACHE_SIZE_LIMIT.
+    file_writers : dictionary, optional
+        Extra files to store with the entry, mapping file name to a function that writes the file given its path. The
+        default is None.
+
+    Returns
+    -------
+    entry_dir : string
+        Directory holding the new entry.
+
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, cache_key)
+    temp_dir = tempfile.mkdtemp(prefix=f'.{cache_key}-', dir=cache_dir)
+    try:
+        for array_name, array in arrays.items():
+            np.save(os.path.join(temp_dir, f'{array_name}.npy'), np.asarray(array), allow_pickle=False)
+        for file_name, write_file in (file_writers or {}).items():
+            write_file(os.path.join(temp_dir, file_name))
+        metadata = dict(metadata or {}, arrays=list(arrays))
+        with open(os.path.join(temp_dir, METADATA_FILE_NAME), 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        if os.path.exists(entry_dir):
+            # another run already stored the same entry
+            shutil.rmtree(temp_dir)
+        else:
+            os.replace(temp_dir, entry_dir)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    evict_cache(cache_dir, size_limit, keep=(cache_key,))
+    return entry_dir
+
+
+def find_cache_entries(cache_dir, **metadata_values):
+    '''
+    Function to find the cache entries whose metadata match the given values, most recently used first.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache directory.
+    **metadata_values : JSON-serializable values
+        Metadata fields an entry must have, with these values.
+
+    Returns
+    -------
+    matching_entries : list of (string, dictionary)
+        Key and metadata of every matching entry (metadata includes 'entry_dir').
+
+    '''
+    if not os.path.isdir(cache_dir):
+        return []
+    matching_entries = []
+    for cache_key in os.listdir(cache_dir):
+        metadata_path = os.path.join(cache_dir, cache_key, METADATA_FILE_NAME)
+        if not os.path.exists(metadata_path):
+            continue
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        if all(metadata.get(field) == value for field, value in metadata_values.items()):
+            metadata['entry_dir'] = os.path.join(cache_dir, cache_key)
+            matching_entries.append((os.stat(metadata_path).st_mtime, cache_key, metadata))
+    matching_entries.sort(key=lambda entry: entry[0], reverse=True)
+    return [(cache_key, metadata) for _, cache_key, metadata in matching_entries]
+
+
+def evict_cache(cache_dir, size_limit=DEFAULT_CACHE_SIZE_LIMIT, keep=()):
+    '''
+    Function to delete the least recently used cache entries until the cache directory fits in its size budget.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache directory.
+    size_limit : int, optional
+        Size budget of the cache directory in bytes. The default is DEFAULT_CACHE_SIZE_LIMIT.
+    keep : tuple of string, optional
+        Keys of entries that must not be evicted. The default is ().
+
+    Returns
+    -------
+    evicted_keys : list of string
+        Keys of the entries that were deleted.
+
+    '''
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for cache_key in os.listdir(cache_dir):
+        metadata_path = os.path.join(cache_dir, cache_key, METADATA_FILE_NAME)
+        if not os.path.exists(metadata_path):
+            continue
+        entry_dir = os.path.join(cache_dir, cache_key)
+        entry_size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+        entries.append((os.stat(metadata_path).st_mtime, cache_key, entry_size))
+
+    total_size = sum(entry_size for _, _, entry_size in entries)
+    evicted_keys = []
+    # oldest entries first
+    for _, cache_key, entry_size in sorted(entries):
+        if total_size <= size_limit:
+            break
+        if cache_key in keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, cache_key), ignore_errors=True)
+        total_size -= entry_size
+        evicted_keys.append(cache_key)
+    return evicted_keys
+
+
+def _write_json_atomic(file_path, contents):
+    '''
+    Function to write a JSON file through a temporary file so readers never see a partly written file.
+
+    Parameters
+    ----------
+    file_path : string
+        Path of the JSON file.
+    contents : JSON-serializable object
+        Contents to write.
+
+    Returns
+    -------
+    None.
+
+    '''
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', suffix='.json')
+    with os.fdopen(file_descriptor, 'w') as temp_file:
+        json.dump(contents, temp_file)
+    os.replace(temp_path, file_path)
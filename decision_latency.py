@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+decision_latency.py
+
+File that defines functions get_window_variances, sweep_window_durations and main - accuracy and ITR of the variance
+classifier as a function of how much of each trial it waits for.
+
+The ITR of a decision depends on how early it is made, but trying another window length used to mean re-epoching,
+re-projecting and re-sweeping the whole pipeline. Here each trial's source activations are projected once, and the
+cumulative sums of each activation and of its square along time are computed once per trial. The variance of any
+window [start, stop) is then (S2[stop] - S2[start])/n - ((S1[stop] - S1[start])/n)**2, one subtraction per sum, so every
+window length and offset costs O(1) per trial and component. Only the prefix sums at the window edges are kept.
+
+The variances of each window go through Project3.sweep_thresholds, which gives the best accuracy of every component,
+and through Project3.calculate_itr with the decision latency (the time from the trial onset to the end of the window).
+The result is an accuracy and ITR curve over the window length for all components in one pass. As with
+test_all_components_thresholds, the thresholds are chosen on the trials they are scored on, so the accuracies are
+optimistic; cross_validation gives held-out estimates for a chosen window.
+
+    python -m decision_latency 09 --end-time 7.6 --step 0.1 --cache-dir cache
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import argparse
+import sys
+import numpy as np
+from Project3 import calculate_itr, sweep_thresholds
+
+
+#%% Window variances from prefix sums
+def get_window_variances(source_activations, components, fs, window_durations, window_starts=(0,), batch_size=16):
+    '''
+    Function to compute the variance of each trial's source activation in every window, from cumulative sums of the
+    activation and of its square computed once per trial.
+
+    Parameters
+    ----------
+    source_activations : Array of float or SourceActivations of size (trials, components, time points)
+        Source activations of equal-length epochs (e.g. from Project3.plot_component_variance). Only one batch of
+        trials is projected at a time.
+    components : Array of int
+        Components to compute variances for.
+    fs : float
+        Sampling frequency in Hz.
+    window_durations : Array of float
+        Window lengths in seconds.
+    window_starts : Array of float, optional
+        Window offsets in seconds from the start of the epoch. The default is (0,).
+    batch_size : int, optional
+        Number of trials projected at a time. The default is 16.
+
+    Returns
+    -------
+    window_variances : Array of float64 of size (starts, durations, trials, components)
+        Variance (normalized by the number of samples, like np.var) of each window of each trial's activation.
+
+    '''
+    components = list(components)
+    n_trials, n_total_components, n_samples = np.shape(source_activations)
+    window_start_samples = np.round(np.asarray(window_starts, dtype=float)*fs).astype(int)
+    window_samples = np.round(np.asarray(window_durations, dtype=float)*fs).astype(int)
+    window_stop_samples = window_start_samples[:, np.newaxis] + window_samples[np.newaxis, :]
+    if np.any(window_samples < 1):
+        raise ValueError('Every window must contain at least one sample')
+    if np.any(window_start_samples < 0) or np.any(window_stop_samples > n_samples):
+        raise ValueError(f'Windows must lie within the {n_samples/fs:g} s epochs')
+
+    # prefix sums are only needed at the window edges
+    edge_samples = np.unique(np.concatenate([window_start_samples, window_stop_samples.ravel()]))
+    activation_sums = np.empty((n_trials, len(components), len(edge_samples)))
+    square_sums = np.empty((n_trials, len(components), len(edge_samples)))
+    for batch_start in range(0, n_trials, batch_size):
+        batch_stop = min(batch_start + batch_size, n_trials)
+        batch_activations = np.asarray(source_activations[batch_start:batch_stop, components], dtype=np.float64)
+        # centre each time course so the sums of squares do not lose the variance to cancellation
+        batch_activations = batch_activations - np.mean(batch_activations, axis=2, keepdims=True)
+        prefix_sums = np.zeros(batch_activations.shape[:2] + (n_samples + 1,))
+        np.cumsum(batch_activations, axis=2, out=prefix_sums[..., 1:])
+        activation_sums[batch_start:batch_stop] = prefix_sums[..., edge_samples]
+        np.cumsum(batch_activations**2, axis=2, out=prefix_sums[..., 1:])
+        square_sums[batch_start:batch_stop] = prefix_sums[..., edge_samples]
+
+    # (trials, components, starts, durations) sums over each window
+    start_columns = np.searchsorted(edge_samples, window_start_samples)[:, np.newaxis]
+    stop_columns = np.searchsorted(edge_samples, window_stop_samples)
+    window_means = (activation_sums[..., stop_columns] - activation_sums[..., start_columns])/window_samples
+    window_square_means = (square_sums[..., stop_columns] - square_sums[..., start_columns])/window_samples
+    window_variances = np.maximum(window_square_means - window_means**2, 0)
+    return np.moveaxis(window_variances, (0, 1), (2, 3))
+
+
+#%% Accuracy and ITR against the window length
+def sweep_window_durations(source_activations, components, is_target_event, fs, window_durations=None,
+                           window_starts=(0,), epoch_start_time=0, batch_size=16):
+    '''
+    Function to find the best threshold accuracy and the ITR of every component for every window length and offset.
+
+    Parameters
+    ----------
+    source_activations : Array of float or SourceActivations of size (trials, components, time points)
+        Source activations of equal-length epochs.
+    components : Array of int
+        Components to test.
+    is_target_event : 1-D boolean array
+        Boolean array representing trials the subject perceived music vs imagined music.
+    fs : float
+        Sampling frequency in Hz.
+    window_durations : Array of float, optional
+        Window lengths in seconds. The default is None (every 0.1 s up to the longest window that fits after the last
+        offset).
+    window_starts : Array of float, optional
+        Window offsets in seconds from the start of the epoch. The default is (0,).
+    epoch_start_time : float, optional
+        Start of the epochs relative to the trial onset in seconds (the start_time they were epoched with), so the
+        decision latency counts from the onset. The default is 0.
+    batch_size : int, optional
+        Number of trials projected at a time. The default is 16.
+
+    Returns
+    -------
+    latency_results : dictionary
+        'window_starts' and 'window_durations' (seconds), 'decision_latencies' (starts, durations) in seconds from the
+        onset, and 'accuracies', 'thresholds' and 'itrs' of size (starts, durations, components): the best accuracy of
+        each component, its threshold and its ITR in bits per second. 'best' holds the window_start, window_duration,
+        decision_latency, component, threshold, accuracy and itr with the highest ITR.
+
+    '''
+    components = np.asarray(components)
+    is_target_event = np.asarray(is_target_event, dtype=bool)
+    window_starts = np.asarray(window_starts, dtype=float)
+    if window_durations is None:
+        longest_duration = np.shape(source_activations)[2]/fs - np.max(window_starts)
+        window_durations = np.arange(1, int(np.floor(longest_duration*10 + 1e-9)) + 1)/10
+    window_durations = np.asarray(window_durations, dtype=float)
+    decision_latencies = epoch_start_time + window_starts[:, np.newaxis] + window_durations[np.newaxis, :]
+    if np.any(decision_latencies <= 0):
+        raise ValueError('Every window must end after the trial onset')
+
+    window_variances = get_window_variances(source_activations, components, fs, window_durations, window_starts,
+                                            batch_size)
+    accuracies = np.empty(window_variances.shape[:2] + (len(components),))
+    thresholds = np.empty_like(accuracies)
+    itrs = np.empty_like(accuracies)
+    component_indices = np.arange(len(components))
+    for start_index, duration_index in np.ndindex(*window_variances.shape[:2]):
+        window_thresholds, window_accuracies = sweep_thresholds(window_variances[start_index, duration_index],
+                                                                is_target_event)[:2]
+        best_rows = np.argmax(window_accuracies, axis=0)
+        accuracies[start_index, duration_index] = window_accuracies[best_rows, component_indices]
+        thresholds[start_index, duration_index] = window_thresholds[best_rows, component_indices]
+        itrs[start_index, duration_index] = [calculate_itr(accuracy, decision_latencies[start_index, duration_index],
+                                                           is_target_event)
+                                             for accuracy in accuracies[start_index, duration_index]]
+
+    best_start, best_duration, best_component = np.unravel_index(np.argmax(itrs), itrs.shape)
+    best = dict(window_start=float(window_starts[best_start]), window_duration=float(window_durations[best_duration]),
+                decision_latency=float(decision_latencies[best_start, best_duration]),
+                component=int(components[best_component]),
+                threshold=float(thresholds[best_start, best_duration, best_component]),
+                accuracy=float(accuracies[best_start, best_duration, best_component]),
+                itr=float(itrs[best_start, best_duration, best_component]))
+    return dict(window_starts=window_starts, window_durations=window_durations, decision_latencies=decision_latencies,
+                accuracies=accuracies, thresholds=thresholds, itrs=itrs, best=best)
+
+
+#%% Command line
+def main(argv=None):
+    '''
+    Function that parses command line arguments, computes the accuracy and ITR curves of each subject and prints the
+    best component of every window length and the window with the highest ITR.
+
+    Parameters
+    ----------
+    argv : list of string, optional
+        Command line arguments. The default is None (use sys.argv).
+
+    Returns
+    -------
+    exit_code : int
+        0 when every subject finished.
+
+    '''
+    parser = argparse.ArgumentParser(prog='python -m decision_latency', description='Accuracy and ITR of the variance '
+                                     'classifier against the window length, from one projection per trial.')
+    parser.add_argument('subjects', nargs='+', help="subject numbers, e.g. 09 11 13 (a leading 'P' is allowed)")
+    parser.add_argument('--start-time', type=float, default=0, help='epoch start after the onset in s (default 0)')
+    parser.add_argument('--end-time', type=float, default=7.6, help='longest window end after the onset in s '
+                        '(default 7.6)')
+    parser.add_argument('--step', type=float, default=0.1, help='window length step in s (default 0.1)')
+    parser.add_argument('--window-starts', type=float, nargs='+', default=[0],
+                        help='window offsets from the epoch start in s (default 0)')
+    parser.add_argument('--top-n-components', type=int, default=10, help='components to test (default 10)')
+    parser.add_argument('--cache-dir', default=None, help='directory of the pre-processed data and ICA cache')
+    parser.add_argument('--figure', default=None, help='save the curves of the best component to this file')
+    args = parser.parse_args(argv)
+
+    import Project3
+    components = np.arange(args.top_n_components)
+    for subject in [subject[1:] if subject.upper().startswith('P') else subject for subject in args.subjects]:
+        fif_file, raw_eeg_data, eeg_times, channel_names, fs = Project3.load_data(subject, cache_dir=args.cache_dir)
+        eeg_epochs, epoch_times, all_trials = Project3.get_eeg_epochs(fif_file, raw_eeg_data, args.start_time,
+                                                                      args.end_time, fs)
+        is_target_event = Project3.get_event_truth_labels(all_trials)
+        ica = Project3.perform_ICA(fif_file, channel_names, args.top_n_components, cache_dir=args.cache_dir,
+                                   plot=False)
+        source_activations = Project3.plot_component_variance(ica, components, eeg_epochs, is_target_event,
+                                                              plot=False)
+        longest_duration = (args.end_time - args.start_time) - max(args.window_starts)
+        window_durations = np.arange(1, int(np.floor(longest_duration/args.step + 1e-9)) + 1)*args.step
+        latency_results = sweep_window_durations(source_activations, components, is_target_event, fs,
+                                                 window_durations, args.window_starts, args.start_time)
+
+        print(f'P{subject}: best component per window length (window offset {args.window_starts[0]:g} s)')
+        print('latency_s  component  accuracy  itr_bits_per_s')
+        for duration_index, decision_latency in enumerate(latency_results['decision_latencies'][0]):
+            best_component = np.argmax(latency_results['itrs'][0, duration_index])
+            print(f"{decision_latency:9.2f}  {components[best_component]:9d}  "
+                  f"{latency_results['accuracies'][0, duration_index, best_component]:8.3f}  "
+                  f"{latency_results['itrs'][0, duration_index, best_component]:14.4f}")
+        best = latency_results['best']
+        print(f"P{subject}: highest ITR {best['itr']:.4f} bits/s (accuracy {best['accuracy']:.3f}) with component "
+              f"{best['component']}, deciding {best['decision_latency']:.2f} s after the onset "
+              f"(window {best['window_start']:g}-{best['window_start'] + best['window_duration']:g} s of the epoch)")
+        if args.figure is not None:
+            from render_figures import plot_decision_latency
+            plot_decision_latency(latency_results, args.figure.replace('.png', f'_P{subject}.png')
+                                  if len(args.subjects) > 1 else args.figure)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+epoching.py
+
+File that defines the functions extract_epochs and extract_ragged_epochs and the RaggedEpochs class. extract_epochs is
+the shared epoching engine used by Project3.get_eeg_epochs and import_ssvep_data.epoch_ssvep_data.
+
+The epoched array of size (trials, channels, time points) is built in one step instead of appending every trial to a
+flat array. When every window has the same spacing and no scaling is asked for, the result is a read-only strided view
+into the continuous recording (no data is copied). Otherwise the output array is preallocated once and each trial is
+written into it.
+
+extract_ragged_epochs cuts epochs of different lengths (e.g. each OpenMIIR trial for the full length of its stimulus)
+into a RaggedEpochs container: one contiguous (channels, total samples) buffer plus an offsets index, gathered in a single
+np.take call. Per-trial reductions run on the flat buffer at once (or in batches of equal-length trials for FFTs), so
+trials never have to be padded to the longest one. When nearly every trial has its own length (e.g. trials that run
+until the next onset), the FFT batches can instead be bucketed by zero-padding each trial to the next fast FFT length.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.fft import next_fast_len
+
+
+#%% Epoch extraction
+def extract_epochs(data, window_starts, n_samples, scale=None, allow_view=True, dtype=None, channels=None):
+    '''
+    Function to cut a continuous (channels, samples) recording into a 3-D array of epochs.
+
+    Parameters
+    ----------
+    data : Array of size (channels, samples)
+        Continuous recording to epoch.
+    window_starts : 1-D array of int
+        Sample index where each epoch starts.
+    n_samples : int
+        Number of samples in every epoch.
+    scale : float, optional
+        Factor every sample is multiplied by (e.g. 1e6 for V -> µV). Only the epoched samples are scaled. The default is
+        None (no scaling).
+    allow_view : bool, optional
+        If True and the windows are evenly spaced and scale is None, return a read-only strided view into data instead of
+        a copy. The default is True.
+    dtype : data-type, optional
+        Data type of the epochs (e.g. np.float32). Samples are converted as they are copied. The default is None (the
+        data type of data, or of data times scale).
+    channels : 1-D array of int, optional
+        Rows of data to epoch. Only the samples of these channels inside the windows are read, so data can be a memory
+        map of which only a few channels are needed. The default is None (all channels).
+
+    Returns
+    -------
+    eeg_epochs : 3-D Array of size (trials, channels, time points)
+        Epoched data. Either a read-only view into data or a newly allocated array.
+
+    '''
+    window_starts = np.asarray(window_starts, dtype=np.int64)
+    n_samples = int(n_samples)
+    n_channels, n_total_samples = np.shape(data)
+    channel_rows = slice(None)
+    if channels is not None:
+        channel_rows = np.asarray(channels, dtype=np.int64)
+        n_channels = len(channel_rows)
+    if n_samples <= 0:
+        raise ValueError(f'Epochs must contain at least one sample, got n_samples={n_samples}.')
+
+    # bounds check every window before touching the data
+    out_of_bounds = (window_starts < 0) | (window_starts + n_samples > n_total_samples)
+    if np.any(out_of_bounds):
+        first_bad = np.flatnonzero(out_of_bounds)[0]
+        raise ValueError(f'{np.count_nonzero(out_of_bounds)} epoch window(s) fall outside the recording of '
+                         f'{n_total_samples} samples (trial {first_bad} spans samples {window_starts[first_bad]} to '
+                         f'{window_starts[first_bad] + n_samples}).')
+
+    if dtype is None:
+        dtype = np.result_type(data, scale or 1.0)
+    n_trials = len(window_starts)
+    window_steps = np.diff(window_starts)
+    is_evenly_spaced = n_trials > 0 and np.all(window_steps == (window_steps[0] if n_trials > 1 else 0))
+    is_same_dtype = np.dtype(dtype) == np.asarray(data[:, :0]).dtype
+    if allow_view and scale is None and channels is None and is_evenly_spaced and is_same_dtype:
+        # zero-copy: step from one trial to the next by a fixed number of samples
+        step = int(window_steps[0]) if n_trials > 1 else 0
+        first_window = data[:, window_starts[0]:]
+        channel_stride, sample_stride = first_window.strides
+        return as_strided(first_window, shape=(n_trials, n_channels, n_samples),
+                          strides=(step * sample_stride, channel_stride, sample_stride), writeable=False)
+
+    # preallocate the output once and fill it trial by trial
+    eeg_epochs = np.empty((n_trials, n_channels, n_samples), dtype=dtype)
+    for trial_index, window_start in enumerate(window_starts):
+        eeg_epochs[trial_index] = data[channel_rows, window_start:window_start + n_samples]
+    if scale is not None:
+        eeg_epochs *= scale
+    return eeg_epochs
+
+
+def _get_float_dtype(data):
+    '''
+    Function to get the floating point type computations on data are done in: float32 data stays float32, anything
+    else is computed in float64.
+    '''
+    return np.float32 if np.asarray(data[:0]).dtype == np.float32 else np.float64
+
+
+#%% Variable-length epochs
+class RaggedEpochs:
+    '''
+    Class that holds epochs of different lengths in one flat buffer. Trial i is data[:, offsets[i]:offsets[i+1]].
+
+    Parameters
+    ----------
+    data : Array of size (channels, total samples)
+        All epochs one after the other along the sample axis.
+    offsets : 1-D array of int of length trials+1
+        Start of each epoch in data, followed by the total number of samples.
+
+    '''
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @property
+    def lengths(self):
+        '''
+        Number of samples of each epoch.
+        '''
+        return np.diff(self.offsets)
+
+    @property
+    def n_channels(self):
+        return self.data.shape[0]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, trial_index):
+        '''
+        View of one epoch, of size (channels, epoch samples).
+        '''
+        trial_index = range(len(self))[trial_index]
+        return self.data[:, self.offsets[trial_index]:self.offsets[trial_index+1]]
+
+    def project(self, unmixing_rows):
+        '''
+        Method to apply a spatial matrix (e.g. ICA unmixing rows) to every epoch with one matrix product over the flat
+        buffer.
+
+        Parameters
+        ----------
+        unmixing_rows : Array of size (components, channels)
+            Spatial matrix to apply.
+
+        Returns
+        -------
+        projected_epochs : RaggedEpochs
+            Epochs of size (components, epoch samples) sharing this container's offsets.
+
+        '''
+        # project in the epochs' precision (float32 epochs give float32 time courses)
+        unmixing_rows = np.asarray(unmixing_rows).astype(_get_float_dtype(self.data), copy=False)
+        return RaggedEpochs(np.matmul(unmixing_rows, self.data), self.offsets)
+
+    def variance(self):
+        '''
+        Method to compute the variance of every epoch and channel from per-epoch sums of the flat buffer.
+
+        Returns
+        -------
+        epoch_variances : Array of float of size (trials, channels)
+            Variance of each epoch along time, for each channel.
+
+        '''
+        lengths = self.lengths[:, np.newaxis]
+        epoch_sums = np.add.reduceat(self.data, self.offsets[:-1], axis=1, dtype=np.float64).T
+        epoch_sums_of_squares = np.add.reduceat(np.square(self.data, dtype=np.float64), self.offsets[:-1], axis=1).T
+        epoch_means = epoch_sums/lengths
+        return np.maximum(epoch_sums_of_squares/lengths - epoch_means**2, 0)
+
+    def covariances(self):
+        '''
+        Method to compute the channel covariance matrix of every epoch (normalized by the epoch length) from views into
+        the flat buffer.
+
+        Returns
+        -------
+        epoch_covariances : 3-D Array of size (trials, channels, channels)
+            Channel covariance matrix of each epoch.
+
+        '''
+        epoch_covariances = np.empty((len(self), self.n_channels, self.n_channels))
+        for trial_index in range(len(self)):
+            # accumulate in float64 even for float32 epochs
+            epoch = np.asarray(self[trial_index], dtype=np.float64)
+            epoch_mean = np.mean(epoch, axis=1, dtype=np.float64)
+            epoch_covariances[trial_index] = (np.matmul(epoch, epoch.T)/epoch.shape[1]
+                                              - np.outer(epoch_mean, epoch_mean))
+        return epoch_covariances
+
+    def power_spectra(self, fs, channels=None, pad_to_fast_length=False):
+        '''
+        Method to compute the FFT power of every epoch, one batch per distinct epoch length. If every epoch has its own
+        length (as with the default epochs of Project3.get_ragged_eeg_epochs), each batch holds a single trial unless
+        pad_to_fast_length is set.
+
+        Parameters
+        ----------
+        fs : float
+            Sampling frequency in Hz.
+        channels : Array of int, optional
+            Channels to compute spectra for. The default is None (all channels).
+        pad_to_fast_length : bool, optional
+            If True, zero-pad each epoch to the next fast real FFT length (scipy.fft.next_fast_len), so epochs of nearby
+            lengths share one batch. Their spectra are then on the padded frequency grid. The default is False.
+
+        Returns
+        -------
+        spectra_by_length : list of (Array of int, Array of float, 3-D Array of float)
+            For each distinct FFT length: the trial indices, the FFT frequencies, and the power of size
+            (trials, channels, frequencies).
+
+        '''
+        channel_data = self.data if channels is None else self.data[channels]
+        fft_lengths = self.lengths
+        if pad_to_fast_length:
+            fft_lengths = np.array([next_fast_len(int(epoch_length), real=True) for epoch_length in self.lengths])
+        spectra_by_length = []
+        for fft_length in np.unique(fft_lengths):
+            trial_indices = np.flatnonzero(fft_lengths == fft_length)
+            trial_lengths = self.lengths[trial_indices]
+            # gather the epochs into one (trials, channels, samples) batch, zero past the end of the shorter ones
+            sample_positions = np.arange(np.max(trial_lengths))
+            sample_indices = np.minimum(self.offsets[trial_indices][:, np.newaxis] + sample_positions,
+                                        self.offsets[-1] - 1)
+            batch_epochs = np.take(channel_data, sample_indices, axis=1).transpose(1, 0, 2)
+            batch_epochs *= (sample_positions < trial_lengths[:, np.newaxis])[:, np.newaxis, :]
+            batch_power = np.abs(np.fft.rfft(batch_epochs, n=fft_length))**2
+            spectra_by_length.append((trial_indices, np.fft.rfftfreq(fft_length, d=1/fs), batch_power))
+        return spectra_by_length
+
+
+def extract_ragged_epochs(data, window_starts, window_lengths):
+    '''
+    Function to cut a continuous (channels, samples) recording into epochs of different lengths, stored in a
+    RaggedEpochs container. All epochs are gathered into the flat buffer with one np.take call.
+
+    Parameters
+    ----------
+    data : Array of size (channels, samples)
+        Continuous recording to epoch.
+    window_starts : 1-D array of int
+        Sample index where each epoch starts.
+    window_lengths : 1-D array of int
+        Number of samples of each epoch.
+
+    Returns
+    -------
+    ragged_epochs : RaggedEpochs
+        Epoched data.
+
+    '''
+    window_starts = np.asarray(window_starts, dtype=np.int64)
+    window_lengths = np.asarray(window_lengths, dtype=np.int64)
+    n_total_samples = np.shape(data)[1]
+    if np.any(window_lengths <= 0):
+        raise ValueError('Epochs must contain at least one sample.')
+    out_of_bounds = (window_starts < 0) | (window_starts + window_lengths > n_total_samples)
+    if np.any(out_of_bounds):
+        first_bad = np.flatnonzero(out_of_bounds)[0]
+        raise ValueError(f'{np.count_nonzero(out_of_bounds)} epoch window(s) fall outside the recording of '
+                         f'{n_total_samples} samples (trial {first_bad} spans samples {window_starts[first_bad]} to '
+                         f'{window_starts[first_bad] + window_lengths[first_bad]}).')
+
+    offsets = np.zeros(len(window_lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(window_lengths)
+    # sample of the recording that goes to each position of the flat buffer
+    sample_indices = np.repeat(window_starts - offsets[:-1], window_lengths) + np.arange(offsets[-1])
+    flat_data = np.take(data, sample_indices, axis=1)
+    return RaggedEpochs(flat_data, offsets)
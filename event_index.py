@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+event_index.py
+
+File that defines functions build_event_index, get_event_index, set_event_index, select_trials, get_events_array and
+get_truth_labels.
+
+OpenMIIR trial event ids are stimulus id * 10 + condition (condition 1 is perception, 2 - 4 are imagination). Instead of
+running mne.find_events over the whole stim channel every time a recording is epoched, the trials are decoded once per
+recording into an event index: a structured array with one row per trial holding its onset, stimulus id, condition and
+trial index (its row in the full index, so subsets keep their position). Decoding is vectorized integer arithmetic.
+
+The index is remembered per Raw object and, when load_data caches the pre-processed data, stored in the same cache
+entry. It is keyed on id(raw), not on the Raw itself (hashing a Raw hashes its whole data array), and dropped when the
+recording is garbage collected. Subsets such as all imagination trials of stimulus 23 are then boolean masks over the
+index:
+
+    event_index = get_event_index(fif_file)
+    trials = select_trials(event_index, stimulus_ids=23, conditions=IMAGINATION_CONDITIONS)
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import weakref
+import mne
+import numpy as np
+
+# one row per trial; previous_value is the stim value before the onset (the middle column of mne.find_events)
+EVENT_INDEX_DTYPE = np.dtype([('onset', np.int64), ('previous_value', np.int32), ('event_id', np.int32),
+                              ('stimulus_id', np.int32), ('condition', np.int8), ('trial_index', np.int32)])
+# OpenMIIR conditions: 1 = perception, 2 - 4 = imagination
+PERCEPTION_CONDITIONS = (1,)
+IMAGINATION_CONDITIONS = (2, 3, 4)
+
+# event index of each Raw object it has been built for, keyed on id(raw)
+_event_indexes = {}
+
+
+#%% Building the index
+def build_event_index(events):
+    '''
+    Function to decode the trial events of a recording into an event index. Only event ids under 1000 are trials.
+
+    Parameters
+    ----------
+    events : array of int of size (events, 3)
+        Events as mne.find_events returns them (onset sample, previous stim value, event id).
+
+    Returns
+    -------
+    event_index : structured array of EVENT_INDEX_DTYPE
+        One row per trial, in onset order.
+
+    '''
+    events = np.asarray(events).reshape(-1, 3)
+    trials = events[events[:, 2] < 1000]
+    event_index = np.empty(len(trials), dtype=EVENT_INDEX_DTYPE)
+    event_index['onset'] = trials[:, 0]
+    event_index['previous_value'] = trials[:, 1]
+    event_index['event_id'] = trials[:, 2]
+    event_index['stimulus_id'], event_index['condition'] = np.divmod(trials[:, 2], 10)
+    event_index['trial_index'] = np.arange(len(trials))
+    return event_index
+
+
+def get_event_index(fif_file):
+    '''
+    Function to get the event index of a recording. The stim channel is only scanned (with mne.find_events) the first
+    time; later calls with the same Raw object return the same index.
+
+    Parameters
+    ----------
+    fif_file : Raw MNE FIF file
+        Recording holding the stim channel.
+
+    Returns
+    -------
+    event_index : structured array of EVENT_INDEX_DTYPE
+        One row per trial, in onset order.
+
+    '''
+    event_index = _event_indexes.get(id(fif_file))
+    if event_index is None:
+        event_index = build_event_index(mne.find_events(fif_file))
+        set_event_index(fif_file, event_index)
+    return event_index
+
+
+def set_event_index(fif_file, event_index):
+    '''
+    Function to remember an already built event index (e.g. one read from the cache) for a recording, so
+    get_event_index does not scan its stim channel.
+
+    Parameters
+    ----------
+    fif_file : Raw MNE FIF file
+        Recording the index belongs to.
+    event_index : structured array of EVENT_INDEX_DTYPE
+        Event index of the recording.
+
+    Returns
+    -------
+    None.
+
+    '''
+    raw_id = id(fif_file)
+    if raw_id not in _event_indexes:
+        # forget the index when the recording is garbage collected (its id can then be reused)
+        weakref.finalize(fif_file, _event_indexes.pop, raw_id, None)
+    _event_indexes[raw_id] = event_index
+
+
+#%% Querying the index
+def select_trials(event_index, stimulus_ids=None, conditions=None):
+    '''
+    Function to select the trials of an event index with the given stimuli and conditions.
+
+    Parameters
+    ----------
+    event_index : structured array of EVENT_INDEX_DTYPE
+        Event index (or a subset of one).
+    stimulus_ids : int or list of int, optional
+        Stimulus ids to keep. The default is None (all stimuli).
+    conditions : int or list of int, optional
+        Conditions to keep, e.g. IMAGINATION_CONDITIONS. The default is None (all conditions).
+
+    Returns
+    -------
+    trials : structured array of EVENT_INDEX_DTYPE
+        Rows of event_index of the selected trials (their trial_index still refers to the full index).
+
+    '''
+    is_selected = np.ones(len(event_index), dtype=bool)
+    if stimulus_ids is not None:
+        is_selected &= np.isin(event_index['stimulus_id'], stimulus_ids)
+    if conditions is not None:
+        is_selected &= np.isin(event_index['condition'], conditions)
+    return event_index[is_selected]
+
+
+def get_events_array(event_index):
+    '''
+    Function to convert an event index back into the (onset, previous stim value, event id) array mne.find_events
+    returns.
+
+    Parameters
+    ----------
+    event_index : structured array of EVENT_INDEX_DTYPE
+        Event index (or a subset of one).
+
+    Returns
+    -------
+    events : array of int of size (trials, 3)
+        Events of the trials.
+
+    '''
+    return np.column_stack([event_index['onset'], event_index['previous_value'], event_index['event_id']])
+
+
+def get_truth_labels(event_index):
+    '''
+    Function to label each trial as perception (True) or imagination (False). Trials with any other condition are left
+    out, as in Project3.get_event_truth_labels.
+
+    Parameters
+    ----------
+    event_index : structured array of EVENT_INDEX_DTYPE
+        Event index (or a subset of one).
+
+    Returns
+    -------
+    is_target_event : boolean array
+        True for perception trials, False for imagination trials.
+
+    '''
+    conditions = event_index['condition']
+    conditions = conditions[np.isin(conditions, PERCEPTION_CONDITIONS + IMAGINATION_CONDITIONS)]
+    return np.isin(conditions, PERCEPTION_CONDITIONS)
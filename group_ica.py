@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+group_ica.py
+
+File that defines the GroupICA class and the SubjectICA class - one ICA decomposition fit across all subjects.
+
+perform_ICA fits a separate ICA to every subject, and the auditory component lands at a different index each time.
+GroupICA fits one set of components to the (temporally concatenated) recordings of all subjects without ever holding
+more than one block of samples in memory:
+
+1. Whitening: each subject is streamed once, block by block (every decim-th sample, as ICA.fit's decim does), to
+   accumulate its mean and covariance. Each subject is centered on its own mean and scaled to unit average channel
+   variance so no subject dominates, and the group covariance is the sample-weighted average of the scaled subject
+   covariances. Its leading eigenvectors give the whitening matrix (components past the numerical rank of the data,
+   e.g. the one lost to the average reference, are dropped). The decimated samples are spooled to disk on this pass,
+   so later passes do not load or filter the recordings again.
+2. Rotation: symmetric FastICA with the logcosh contrast (what perform_ICA's method='fastica' runs). Each fixed-point
+   step estimates its expectations from a random minibatch of spooled blocks; the minibatch doubles every step, so the
+   early steps are cheap and the last ones (where convergence is checked) use all the data.
+3. Back-projection: each subject's mixing matrix is the least-squares regression of its channels on the group sources,
+   computed from the subject covariance alone, and its unmixing matrix is the pseudo-inverse of that mixing matrix.
+
+get_subject_ica returns a SubjectICA with channel-space unmixing_matrix_ and mixing_matrix_, which
+Project3.plot_component_variance, make_prediction and test_all_components_thresholds accept in place of a fitted ICA.
+Component i is the same group component for every subject.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import os
+import tempfile
+import numpy as np
+
+
+#%% Per-subject view of a group decomposition
+class SubjectICA:
+    '''
+    Class holding one subject's back-projected group ICA decomposition.
+
+    Parameters
+    ----------
+    subject : string
+        Subject the matrices belong to.
+    unmixing_matrix : Array of float of size (components, channels)
+        Maps the subject's eeg channels to the group sources.
+    mixing_matrix : Array of float of size (channels, components)
+        Maps the group sources to the subject's eeg channels.
+
+    '''
+    def __init__(self, subject, unmixing_matrix, mixing_matrix):
+        self.subject = subject
+        self.unmixing_matrix_ = unmixing_matrix
+        self.mixing_matrix_ = mixing_matrix
+        self.n_components_ = unmixing_matrix.shape[0]
+
+
+#%% Group decomposition
+class GroupICA:
+    '''
+    Class that fits one ICA decomposition across many subjects by streaming their data (see the module docstring).
+
+    Parameters
+    ----------
+    n_components : int, optional
+        Number of components. The default is None (the numerical rank of the group covariance).
+    decim : int, optional
+        Only every decim-th sample is used to fit. The default is 3 (as in Project3.perform_ICA).
+    max_iter : int, optional
+        Maximum number of fixed-point steps (at least 1). The default is 200.
+    tol : float, optional
+        The fit has converged when no component direction changes by more than tol in a step on all the data. The
+        default is 1e-4.
+    batch_size : int, optional
+        Number of samples in the first minibatch (rounded up to whole blocks); the minibatch doubles every step. The
+        default is 2**16.
+    block_size : int, optional
+        Number of (decimated) samples read from a recording at a time. The default is 2**15.
+    rank_tolerance : float, optional
+        Eigenvalues of the group covariance below rank_tolerance times the largest one are dropped. The default is 1e-7.
+    random_state : int, optional
+        Seed of the starting rotation and the minibatch draws. The default is 97.
+
+    '''
+    def __init__(self, n_components=None, decim=3, max_iter=200, tol=1e-4, batch_size=2**16, block_size=2**15,
+                 rank_tolerance=1e-7, random_state=97):
+        self.n_components = n_components
+        self.decim = decim
+        self.max_iter = max_iter
+        self.tol = tol
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.rank_tolerance = rank_tolerance
+        self.random_state = random_state
+        self.subjects_ = []
+        self.subject_means_ = {}
+        self.subject_covariances_ = {}
+        self.subject_scales_ = {}
+        self.subject_n_samples_ = {}
+
+    def _iter_blocks(self, eeg_data):
+        '''
+        Method to yield the decimated samples of a recording as float64 blocks of (channels, block samples).
+        '''
+        n_decimated = -(-np.shape(eeg_data)[1]//self.decim)
+        for block_start in range(0, n_decimated, self.block_size):
+            block_stop = min(block_start + self.block_size, n_decimated)
+            yield np.asarray(eeg_data[:, block_start*self.decim:block_stop*self.decim:self.decim], dtype=np.float64)
+
+    def partial_fit_whitening(self, subject, eeg_data, spool_file=None):
+        '''
+        Method to accumulate one subject's mean and covariance for the whitening (pass 1), block by block.
+
+        Parameters
+        ----------
+        subject : string
+            Subject the data belongs to.
+        eeg_data : Array of float of size (channels, samples)
+            Pre-processed eeg data of the subject (e.g. a memory map from load_data's cache).
+        spool_file : file object, optional
+            If given, the decimated samples are also written to it (as float32), so they can be streamed again without
+            eeg_data. The default is None.
+
+        Returns
+        -------
+        n_samples : int
+            Number of decimated samples of the subject.
+
+        '''
+        n_channels = np.shape(eeg_data)[0]
+        sample_sum = np.zeros(n_channels)
+        outer_sum = np.zeros((n_channels, n_channels))
+        n_samples = 0
+        for block in self._iter_blocks(eeg_data):
+            sample_sum += np.sum(block, axis=1)
+            outer_sum += block @ block.T
+            n_samples += block.shape[1]
+            if spool_file is not None:
+                spool_file.write(np.ascontiguousarray(block.T, dtype=np.float32).tobytes())
+        mean = sample_sum/n_samples
+        covariance = outer_sum/n_samples - np.outer(mean, mean)
+        if subject not in self.subjects_:
+            self.subjects_.append(subject)
+        self.subject_means_[subject] = mean
+        self.subject_covariances_[subject] = covariance
+        # scale each subject to unit average channel variance
+        self.subject_scales_[subject] = np.sqrt(np.trace(covariance)/n_channels)
+        self.subject_n_samples_[subject] = n_samples
+        return n_samples
+
+    def fit_whitening(self):
+        '''
+        Method to compute the whitening matrix from the accumulated subject covariances.
+
+        Returns
+        -------
+        self : GroupICA
+            The decomposition, with whitening_matrix_ (components, channels) and n_components_ set.
+
+        '''
+        n_total = sum(self.subject_n_samples_.values())
+        group_covariance = sum(self.subject_n_samples_[subject]*self.subject_covariances_[subject]
+                               / self.subject_scales_[subject]**2 for subject in self.subjects_)/n_total
+        eigenvalues, eigenvectors = np.linalg.eigh(group_covariance)
+        eigenvalues, eigenvectors = eigenvalues[::-1], eigenvectors[:, ::-1]
+        rank = int(np.sum(eigenvalues > self.rank_tolerance*eigenvalues[0]))
+        n_components = rank if self.n_components is None else min(self.n_components, rank)
+        if self.n_components is not None and self.n_components > rank:
+            print(f'The group data has rank {rank}, fitting {rank} components instead of {self.n_components}')
+        self.n_components_ = n_components
+        self.pca_explained_variance_ = eigenvalues[:n_components]
+        self.whitening_matrix_ = eigenvectors[:, :n_components].T/np.sqrt(eigenvalues[:n_components, np.newaxis])
+        return self
+
+    def _whiten(self, subject, block):
+        '''
+        Method to center, scale and whiten a block of one subject's decimated samples.
+        '''
+        return self.whitening_matrix_ @ ((block - self.subject_means_[subject][:, np.newaxis])
+                                         / self.subject_scales_[subject])
+
+    def partial_fit(self, whitened_blocks):
+        '''
+        Method to take one symmetric FastICA fixed-point step (logcosh contrast, as perform_ICA's method='fastica') with
+        the expectations estimated from a minibatch of whitened blocks.
+
+        Parameters
+        ----------
+        whitened_blocks : list of Array of float of size (components, block samples)
+            Whitened samples (see fit_whitening) of the minibatch.
+
+        Returns
+        -------
+        change : float
+            Largest change of a component's direction (1 - |cos| of the angle between its old and new unmixing rows).
+
+        '''
+        source_products = np.zeros((self.n_components_, self.n_components_))
+        derivative_sum = np.zeros(self.n_components_)
+        n_samples = 0
+        for whitened_block in whitened_blocks:
+            tanh_sources = np.tanh(self.rotation_ @ whitened_block)
+            source_products += tanh_sources @ whitened_block.T
+            derivative_sum += np.sum(1 - tanh_sources**2, axis=1)
+            n_samples += whitened_block.shape[1]
+        new_rotation = _symmetric_decorrelation(source_products/n_samples
+                                                - (derivative_sum/n_samples)[:, np.newaxis]*self.rotation_)
+        change = float(np.max(np.abs(np.abs(np.sum(new_rotation*self.rotation_, axis=1)) - 1)))
+        self.rotation_ = new_rotation
+        return change
+
+    def fit(self, subjects, load_subject, spool_dir=None):
+        '''
+        Method to fit the decomposition to many subjects, loading one subject at a time.
+
+        Parameters
+        ----------
+        subjects : list of string
+            Subjects to fit.
+        load_subject : function
+            Function that takes a subject and returns its pre-processed eeg data of size (channels, samples). It is
+            called once per subject.
+        spool_dir : string, optional
+            Directory for the decimated samples spooled to disk during fitting (deleted afterwards). The default is
+            None (the system temporary directory).
+
+        Returns
+        -------
+        self : GroupICA
+            The fitted decomposition.
+
+        '''
+        subjects = list(subjects)
+        # check up front rather than failing after every subject has been loaded and spooled
+        if len(subjects) == 0:
+            raise ValueError('Group ICA needs at least one subject to fit.')
+        if self.max_iter < 1:
+            raise ValueError(f'Group ICA needs at least one iteration, got max_iter={self.max_iter}.')
+        rng = np.random.default_rng(self.random_state)
+        with tempfile.TemporaryDirectory(prefix='group-ica-', dir=spool_dir) as spool_directory:
+            spool_paths = {}
+            for subject in subjects:
+                print(f'Accumulating group ICA whitening statistics of subject {subject}...')
+                spool_paths[subject] = os.path.join(spool_directory, f'P{subject}.f32')
+                eeg_data = load_subject(subject)
+                with open(spool_paths[subject], 'wb') as spool_file:
+                    self.partial_fit_whitening(subject, eeg_data, spool_file=spool_file)
+                n_channels = np.shape(eeg_data)[0]
+                del eeg_data
+            self.fit_whitening()
+            self.rotation_ = _symmetric_decorrelation(rng.standard_normal((self.n_components_, self.n_components_)))
+
+            spooled_samples = {subject: np.memmap(spool_paths[subject], dtype=np.float32, mode='r',
+                                                  shape=(self.subject_n_samples_[subject], n_channels))
+                               for subject in subjects}
+            blocks = [(subject, block_start) for subject in subjects
+                      for block_start in range(0, self.subject_n_samples_[subject], self.block_size)]
+            # the minibatch starts at batch_size samples and doubles every step until it holds all the blocks
+            n_batch_blocks = max(1, -(-self.batch_size//self.block_size))
+            print(f'Fitting {self.n_components_} group ICA components to {sum(self.subject_n_samples_.values())} '
+                  f'samples of {len(subjects)} subjects...')
+            self.n_iter_ = 0
+            while self.n_iter_ < self.max_iter:
+                if n_batch_blocks < len(blocks):
+                    batch_blocks = [blocks[block_index] for block_index in
+                                    np.sort(rng.choice(len(blocks), n_batch_blocks, replace=False))]
+                else:
+                    batch_blocks = blocks
+                whitened_blocks = (self._whiten(subject, np.asarray(spooled_samples[subject][
+                    block_start:block_start+self.block_size].T, dtype=np.float64))
+                    for subject, block_start in batch_blocks)
+                change = self.partial_fit(whitened_blocks)
+                self.n_iter_ += 1
+                # only a step on all the data can tell that the fit converged
+                if batch_blocks is blocks and change < self.tol:
+                    break
+                n_batch_blocks *= 2
+            else:
+                print(f'Group ICA did not converge in {self.max_iter} iterations (last change {change:.2g})')
+            del spooled_samples
+        self._set_group_matrices()
+        return self
+
+    def _set_group_matrices(self):
+        '''
+        Method to compute the channel-space group matrices, ordering the components by the variance they explain.
+        '''
+        unmixing_matrix = self.rotation_ @ self.whitening_matrix_
+        mixing_matrix = np.linalg.pinv(unmixing_matrix)
+        component_order = np.argsort(-np.sum(mixing_matrix**2, axis=0))
+        self.rotation_ = self.rotation_[component_order]
+        # unmixing_matrix_ maps centered data scaled to unit average channel variance to the group sources
+        self.unmixing_matrix_ = unmixing_matrix[component_order]
+        self.mixing_matrix_ = mixing_matrix[:, component_order]
+
+    def get_subject_ica(self, subject):
+        '''
+        Method to back-project the group components onto one subject.
+
+        Parameters
+        ----------
+        subject : string
+            One of the fitted subjects.
+
+        Returns
+        -------
+        subject_ica : SubjectICA
+            The subject's unmixing_matrix_ (components, channels) and mixing_matrix_ (channels, components), in the
+            units of its eeg data.
+
+        '''
+        covariance = self.subject_covariances_[subject]
+        # group unmixing in the subject's units
+        unmixing_matrix = self.unmixing_matrix_/self.subject_scales_[subject]
+        # least-squares regression of the channels on the group sources: A = C W' (W C W')^-1
+        mixing_matrix = covariance @ unmixing_matrix.T @ np.linalg.pinv(unmixing_matrix @ covariance @ unmixing_matrix.T)
+        return SubjectICA(subject, np.linalg.pinv(mixing_matrix), mixing_matrix)
+
+
+def _symmetric_decorrelation(rotation):
+    '''
+    Function to make the rows of a matrix orthonormal symmetrically: (W W')^(-1/2) W.
+    '''
+    eigenvalues, eigenvectors = np.linalg.eigh(rotation @ rotation.T)
+    return (eigenvectors/np.sqrt(np.maximum(eigenvalues, np.finfo(float).tiny))) @ eigenvectors.T @ rotation
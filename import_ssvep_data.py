@@ -7,6 +7,7 @@ Lab 3: Frequency Space
 - Plots specified raw electrode data
 - Epochs EEG data
 - Converts EEG data into frequency domain
+- Accumulates per-class mean spectra batch by batch (SpectrumAccumulator)
 - Plots power spectra for specified channels
 
 Created on Thu Oct 14 12:21:20 2021
@@ -16,36 +17,128 @@ Created on Thu Oct 14 12:21:20 2021
 # %% Import Packages
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import scipy.fft as fft
+import scipy.signal
+from epoching import extract_epochs
+from ssvep_dataset import SSVEPDataset, convert_ssvep_archive, get_channel_indices
 
 
 # %% Part 1: Load the Data
-def load_ssvep_data(subject, data_directory):
+def load_ssvep_data(subject, data_directory, lazy=False):
     '''
     Function that loads the SSVEP data and returns the data as a dictionary with each field holding data
 
+    With lazy=True the archive is unpacked once into a directory of .npy files (see ssvep_dataset) and an SSVEPDataset
+    is returned instead: it has the same keys, but each field is memory-mapped when first used, so only the parts of
+    eeg that are actually read are loaded.
+
     Parameters
     ----------
     subject : int
         Specifies which subject we are looking at.
     data_directory : string
         string holding the path to where the data is stored.
+    lazy : bool, optional
+        If True, return a memory-mapped SSVEPDataset instead of a dictionary. The default is False.
 
     Returns
     -------
-    data_dict : dictionary
+    data_dict : dictionary or SSVEPDataset
         Dictionary with 6 fields each holding an array of data.
 
     '''
+    if lazy:
+        return SSVEPDataset(convert_ssvep_archive(subject, data_directory))
     # Load data and convert into dictionary
     data_dict = dict(np.load(data_directory+f'SSVEP_S{subject}.npz', allow_pickle=True))
     return data_dict
 
 # %% Part 2: Plot the Data
+def get_min_max_envelope(signal, start_sample, stop_sample, n_bins):
+    '''
+    Function that decimates part of a trace to the minimum and maximum of each of n_bins equal bins, so a line through
+    the points (drawn at one bin per pixel) looks the same as the full trace. Short ranges are returned undecimated.
+
+    Parameters
+    ----------
+    signal : 1-D array
+        Full trace (e.g. one row of a memory-mapped eeg field - only the requested range is read).
+    start_sample : int
+        First sample of the range.
+    stop_sample : int
+        Sample after the last one of the range.
+    n_bins : int
+        Number of bins (the width of the plot in pixels).
+
+    Returns
+    -------
+    sample_indices : 1-D array of int
+        Sample index of each point: the start of each bin, twice.
+    envelope : 1-D array
+        Minimum and maximum of each bin, interleaved.
+
+    '''
+    segment = np.asarray(signal[start_sample:stop_sample])
+    n_samples = len(segment)
+    if n_samples <= 2*n_bins:
+        return np.arange(start_sample, stop_sample), segment
+    bin_starts = (np.arange(n_bins)*n_samples)//n_bins
+    envelope = np.empty(2*n_bins, dtype=segment.dtype)
+    envelope[0::2] = np.minimum.reduceat(segment, bin_starts)
+    envelope[1::2] = np.maximum.reduceat(segment, bin_starts)
+    return np.repeat(start_sample + bin_starts, 2), envelope
+
+
+def plot_envelope(axis, signal, fs, scale=1, **line_kwargs):
+    '''
+    Function that plots a long trace as its per-pixel min/max envelope and recomputes the envelope for the visible range
+    whenever the x limits change (zooming or panning), so the plot stays fast and detailed at any zoom level.
+
+    Parameters
+    ----------
+    axis : matplotlib Axes
+        Axes to plot on.
+    signal : 1-D array
+        Full trace.
+    fs : float
+        Sampling frequency in Hz (the x axis is in seconds).
+    scale : float, optional
+        Factor the plotted values are multiplied by (e.g. 1e6 for V -> µV). The default is 1.
+    **line_kwargs :
+        Keyword arguments passed on to axis.plot (e.g. label).
+
+    Returns
+    -------
+    line : matplotlib Line2D
+        The plotted line.
+
+    '''
+    n_samples = len(signal)
+
+    def get_visible_points(start_time, stop_time):
+        start_sample = int(np.clip(np.floor(start_time*fs), 0, n_samples))
+        stop_sample = int(np.clip(np.ceil(stop_time*fs) + 1, start_sample, n_samples))
+        n_bins = max(int(axis.get_window_extent().width), 1)
+        sample_indices, envelope = get_min_max_envelope(signal, start_sample, stop_sample, n_bins)
+        return sample_indices/fs, envelope*scale
+
+    line, = axis.plot(*get_visible_points(0, n_samples/fs), **line_kwargs)
+
+    def on_xlim_changed(changed_axis):
+        line.set_data(*get_visible_points(*changed_axis.get_xlim()))
+
+    axis.callbacks.connect('xlim_changed', on_xlim_changed)
+    return line
+
+
 def plot_raw_data(data_dict, subject, channels_to_plot):
     '''
     Function that plots the raw eeg data for a ceratin subject on channels the user specifies
 
+    Each trace is drawn as its per-pixel min/max envelope (recomputed for the visible range when zooming), and all
+    events are drawn as one line collection and one scatter, so full-length recordings plot quickly.
+
     Parameters
     ----------
     data_dict : dictionary
@@ -62,37 +155,41 @@ def plot_raw_data(data_dict, subject, channels_to_plot):
     '''
     # Select channel data
     channels = data_dict['channels']
+    fs = data_dict['fs']
+
+    # Plot frequency data: one segment per event from its start to its end, at the height of its flash frequency
+    ax1=plt.subplot(2, 1, 1)
+    event_start_times = data_dict['event_samples']/fs
+    event_end_times = (data_dict['event_samples']+data_dict['event_durations'])/fs
+    event_type_names, event_type_levels = np.unique(data_dict['event_types'], return_inverse=True)
+    event_segments = np.stack([np.column_stack([event_start_times, event_type_levels]),
+                               np.column_stack([event_end_times, event_type_levels])], axis=1)
+    ax1.add_collection(LineCollection(event_segments, colors='blue'))
+    ax1.scatter(np.concatenate([event_start_times, event_end_times]), np.tile(event_type_levels, 2), color='blue')
+    ax1.set_yticks(np.arange(len(event_type_names)), event_type_names)
+    ax1.set_ylim(-0.5, len(event_type_names)-0.5)
+    ax1.set_title(f'SSVEP Subject {subject} Raw Data')
+    ax1.set_xlabel('Time (s)')
+    ax1.set_ylabel('Flash Frequency')
+    ax1.grid(True)
+
+    # Plot voltage data
+    ax2=plt.subplot(2, 1, 2, sharex=ax1)
     for channel in channels_to_plot:
         index_to_plot = np.where(channels==channel)[0][0]
-        
-        # Plot frequency data
-        ax1=plt.subplot(2, 1, 1)
-        for i in range(len(data_dict['event_types'])):
-            start_time = data_dict['event_samples'][i]/data_dict['fs']
-            end_time = (data_dict['event_samples'][i]+data_dict['event_durations'][i])/data_dict['fs']
-            plt.scatter(start_time, data_dict['event_types'][i], color='blue')
-            plt.scatter(end_time, data_dict['event_types'][i], color='blue')
-            plt.plot([start_time, end_time],[data_dict['event_types'][i],data_dict['event_types'][i]], color='blue', markevery=10)
-            plt.title(f'SSVEP Subject {subject} Raw Data')
-            plt.xlabel('Time (s)')
-            plt.ylabel('Flash Frequency')
-            plt.grid()
-        
-        # Plot voltage data
-        times = np.arange(0, np.size(data_dict['eeg'], axis=1)/int(data_dict['fs']), step=1/int(data_dict['fs']))
-        ax2=plt.subplot(2, 1, 2, sharex=ax1)
-        plt.plot(times,data_dict['eeg'][index_to_plot]*1000000, label = f'{channel}')
-        plt.legend()
-        plt.xlabel('Time (s)')
-        plt.ylabel('Voltage (µV)')
-        plt.savefig(f'SSVEP_S{subject}.png')
-        plt.grid()
-        plt.tight_layout()
+        plot_envelope(ax2, data_dict['eeg'][index_to_plot], fs, scale=1000000, label = f'{channel}')
+    ax2.set_xlim(0, np.size(data_dict['eeg'], axis=1)/fs)
+    ax2.legend()
+    ax2.set_xlabel('Time (s)')
+    ax2.set_ylabel('Voltage (µV)')
+    ax2.grid(True)
+    plt.tight_layout()
+    plt.savefig(f'SSVEP_S{subject}.png')
     plt.clf()
 
 
 # %% Part 3: Extract the Epochs
-def epoch_ssvep_data(data_dict, epoch_start_time=0, epoch_end_time=20):
+def epoch_ssvep_data(data_dict, epoch_start_time=0, epoch_end_time=20, dtype=None, channels=None):
     '''
     Function that epochs ssvep data based on an epoch start and end time. Epochs data into 'trials' based on when events occur to create 3-D epoched array
 
@@ -104,6 +201,12 @@ def epoch_ssvep_data(data_dict, epoch_start_time=0, epoch_end_time=20):
         Integer representing the start time in seconds we want to start epoching at. The default is 0.
     epoch_end_time : int
         Integer representing the end time in seconds we want to end epoching at. The default is 20.
+    dtype : data-type, optional
+        Data type of the epochs, e.g. np.float32 to run the rest of the analysis in single precision. The default is
+        None (float64).
+    channels : list of str or int, optional
+        Channels to epoch, by name or index. Only these channels are read from data_dict['eeg']. The default is None
+        (all channels).
 
     Returns
     -------
@@ -115,20 +218,16 @@ def epoch_ssvep_data(data_dict, epoch_start_time=0, epoch_end_time=20):
         Boolean array representing trials in which flashing at 15 Hz occurred.
 
     '''
-    eeg_data = data_dict['eeg'] * 1000000
-    event_durations = data_dict['event_durations']
+    eeg_data = data_dict['eeg']
     event_samples = data_dict['event_samples']
     event_type = data_dict['event_types']
     fs = data_dict['fs']
-    # event_start_times = event_samples/fs
-    eeg_epochs = np.array([])
-    for sample_index in event_samples:
-        start_epoch = int(sample_index+(epoch_start_time*fs))
-        end_epoch = int(start_epoch+(epoch_end_time-epoch_start_time)*fs)
-        epoch_data = eeg_data[:, start_epoch:end_epoch]
-        # append the epoch to the eeg_epochs array from before
-        eeg_epochs = np.append(eeg_epochs, epoch_data)    
-    eeg_epochs = np.reshape(eeg_epochs, [len(event_samples),len(data_dict['channels']), int((epoch_end_time-epoch_start_time)*fs)])
+    # epoch start samples for every event, then cut all epochs at once and convert to µV
+    start_epochs = (event_samples + epoch_start_time*fs).astype(int)
+    n_epoch_samples = int((epoch_end_time-epoch_start_time)*fs)
+    channel_indices = None if channels is None else get_channel_indices(data_dict['channels'], channels)
+    eeg_epochs = extract_epochs(eeg_data, start_epochs, n_epoch_samples, scale=1000000, dtype=dtype,
+                                channels=channel_indices)
     epoch_times = np.arange(epoch_start_time, epoch_end_time, step = 1/fs)
     
     
@@ -153,23 +252,229 @@ def get_frequency_spectrum(eeg_epochs, fs):
     Returns
     -------
     eeg_epochs_fft : Array of complex128
-        3-D array holding epoched data in the frequency domain for each trial.
+        3-D array holding epoched data in the frequency domain for each trial (complex64 for float32 epochs).
     fft_frequencies : Array of float64
         Array containing the frequency corresponding to each column of the Fourier transform data.
 
     '''
-    # Take fast fourier transform
-    eeg_epochs_fft = np.fft.rfft(eeg_epochs)
+    # (get_mean_spectra and get_ssvep_mean_spectra give the per-class means without keeping every trial's spectrum)
+    # Take fast fourier transform (scipy keeps float32 epochs in single precision)
+    eeg_epochs_fft = fft.rfft(eeg_epochs)
     
     # Calculate corresponding frequencies
     fft_frequencies = np.fft.rfftfreq(np.size(eeg_epochs, axis=2), d=1/fs) 
     
     return eeg_epochs_fft, fft_frequencies
 
+
+
+class SpectrumAccumulator:
+    '''
+    Class that accumulates the mean spectrum of each class of trials from batches of epochs, so the complex spectrum of
+    all trials is never held at once: each batch is transformed with scipy.fft (on several workers) and only its
+    magnitude or Welch power is added to a per-class sum in float64.
+
+    Parameters
+    ----------
+    fs : float
+        Sampling frequency in Hz.
+    n_samples : int
+        Number of samples in every epoch.
+    n_classes : int, optional
+        Number of trial classes; the classes of a batch are given as ints 0 ... n_classes-1. The default is 2.
+    method : string, optional
+        'magnitude' for the mean FFT magnitude of whole epochs (as plot_power_spectrum averages it), or 'welch' for the
+        mean Welch power spectral density (Hann windowed segments overlapping by half). The default is 'magnitude'.
+    segment_duration : float, optional
+        Length of the Welch segments in seconds (ignored for 'magnitude'). The default is 1.
+    fast_length : bool, optional
+        If True, zero-pad each transform to the next fast FFT length (scipy.fft.next_fast_len), which changes the
+        frequency spacing slightly. The default is True.
+    workers : int, optional
+        Number of scipy.fft workers (-1 for all cores). The default is -1.
+
+    '''
+    def __init__(self, fs, n_samples, n_classes=2, method='magnitude', segment_duration=1.0, fast_length=True,
+                 workers=-1):
+        if method not in ('magnitude', 'welch'):
+            raise ValueError(f"Unknown spectrum method {method!r}, expected 'magnitude' or 'welch'")
+        self.fs = fs
+        self.method = method
+        self.workers = workers
+        if method == 'welch':
+            self.segment_samples = min(max(int(round(segment_duration*fs)), 1), n_samples)
+            self.segment_step = max(self.segment_samples//2, 1)
+            transform_samples = self.segment_samples
+            # periodic Hann window and density scaling, as scipy.signal.welch uses them
+            self.window = scipy.signal.get_window('hann', self.segment_samples)
+            self.power_scale = 1/(fs*np.sum(self.window**2))
+        else:
+            transform_samples = n_samples
+        self.n_fft = fft.next_fast_len(transform_samples, real=True) if fast_length else transform_samples
+        self.frequencies = fft.rfftfreq(self.n_fft, d=1/fs)
+        self.spectrum_sums = None
+        self.class_counts = np.zeros(n_classes, dtype=np.int64)
+
+    def add(self, batch_epochs, batch_classes):
+        '''
+        Method to add a batch of epochs to the per-class sums.
+
+        Parameters
+        ----------
+        batch_epochs : 3-D Array of float of size (trials, channels, time points)
+            Epochs of the batch.
+        batch_classes : 1-D array of int
+            Class of each trial of the batch.
+
+        Returns
+        -------
+        None.
+
+        '''
+        batch_classes = np.asarray(batch_classes, dtype=np.int64)
+        batch_spectra = self._get_batch_spectra(np.asarray(batch_epochs))
+        if self.spectrum_sums is None:
+            self.spectrum_sums = np.zeros((len(self.class_counts),) + batch_spectra.shape[1:])
+        # unbuffered sum over the trials of each class
+        np.add.at(self.spectrum_sums, batch_classes, batch_spectra)
+        self.class_counts += np.bincount(batch_classes, minlength=len(self.class_counts))
+
+    def _get_batch_spectra(self, batch_epochs):
+        '''
+        Method to compute the magnitude or Welch power of each trial of a batch, of size (trials, channels, frequencies).
+        '''
+        if self.method == 'magnitude':
+            # scipy keeps float32 epochs in single precision, the sums are float64
+            return np.abs(fft.rfft(batch_epochs, n=self.n_fft, workers=self.workers))
+        segments = np.lib.stride_tricks.sliding_window_view(batch_epochs, self.segment_samples,
+                                                            axis=-1)[..., ::self.segment_step, :]
+        segments = (segments - np.mean(segments, axis=-1, keepdims=True))*self.window
+        segment_power = np.abs(fft.rfft(segments, n=self.n_fft, workers=self.workers))**2*self.power_scale
+        # one-sided density: every bin but DC (and Nyquist for an even length) holds the power of two frequencies
+        segment_power[..., 1:(self.n_fft + 1)//2] *= 2
+        return np.mean(segment_power, axis=-2, dtype=np.float64)
+
+    def get_mean_spectra(self):
+        '''
+        Method to get the mean spectrum of each class of the trials added so far.
+
+        Returns
+        -------
+        mean_spectra : 3-D Array of float64 of size (classes, channels, frequencies)
+            Mean magnitude or Welch power of each class (NaN for a class without trials).
+        frequencies : Array of float64
+            Frequency of each column of the spectra.
+
+        '''
+        if self.spectrum_sums is None:
+            raise ValueError('No epochs have been added')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_spectra = self.spectrum_sums/self.class_counts[:, np.newaxis, np.newaxis]
+        return mean_spectra, self.frequencies
+
+
+def get_mean_spectra(eeg_epochs, fs, is_trial_15Hz, channels=None, method='magnitude', batch_size=16,
+                     segment_duration=1.0, fast_length=True, workers=-1):
+    '''
+    Function that computes the mean spectrum of the 12 Hz and of the 15 Hz trials batch by batch with a
+    SpectrumAccumulator, instead of transforming every trial at once like get_frequency_spectrum.
+
+    Parameters
+    ----------
+    eeg_epochs : 3-D Array of float of size (trials, channels, time points)
+        Array holding the epoched data (it can be a memory map; only one batch is read at a time).
+    fs : float
+        Sampling frequency.
+    is_trial_15Hz : 1-D boolean array
+        Boolean array representing trials in which flashing at 15 Hz occurred.
+    channels : 1-D array of int, optional
+        Channel indices to compute spectra for. The default is None (all channels).
+    method : string, optional
+        'magnitude' or 'welch' (see SpectrumAccumulator). The default is 'magnitude'.
+    batch_size : int, optional
+        Number of trials transformed at a time. The default is 16.
+    segment_duration : float, optional
+        Length of the Welch segments in seconds. The default is 1.
+    fast_length : bool, optional
+        If True, zero-pad to the next fast FFT length. The default is True.
+    workers : int, optional
+        Number of scipy.fft workers (-1 for all cores). The default is -1.
+
+    Returns
+    -------
+    mean_spectra : 3-D Array of float64 of size (2, channels, frequencies)
+        Mean spectrum of the 12 Hz trials (row 0) and of the 15 Hz trials (row 1).
+    frequencies : Array of float64
+        Frequency of each column of the spectra.
+
+    '''
+    trial_classes = np.asarray(is_trial_15Hz, dtype=np.int64)
+    accumulator = SpectrumAccumulator(fs, np.shape(eeg_epochs)[2], method=method, segment_duration=segment_duration,
+                                      fast_length=fast_length, workers=workers)
+    for batch_start in range(0, len(trial_classes), batch_size):
+        batch_epochs = eeg_epochs[batch_start:batch_start + batch_size]
+        if channels is not None:
+            batch_epochs = np.asarray(batch_epochs)[:, channels]
+        accumulator.add(batch_epochs, trial_classes[batch_start:batch_start + batch_size])
+    return accumulator.get_mean_spectra()
+
+
+def get_ssvep_mean_spectra(data_dict, epoch_start_time=0, epoch_end_time=20, channels=None, method='magnitude',
+                           batch_size=16, segment_duration=1.0, fast_length=True, workers=-1, dtype=None):
+    '''
+    Function that epochs the ssvep data (as epoch_ssvep_data does) and computes the mean spectrum of the 12 Hz and of the
+    15 Hz trials one batch of trials at a time, so memory use does not grow with the number of trials. Only the
+    requested channels are read.
+
+    Parameters
+    ----------
+    data_dict : dictionary or SSVEPDataset
+        Dictionary with 6 fields each holding an array of data.
+    epoch_start_time : int
+        Integer representing the start time in seconds we want to start epoching at. The default is 0.
+    epoch_end_time : int
+        Integer representing the end time in seconds we want to end epoching at. The default is 20.
+    channels : list of str or int, optional
+        Channels to compute spectra for, by name or index. The default is None (all channels).
+    method : string, optional
+        'magnitude' or 'welch' (see SpectrumAccumulator). The default is 'magnitude'.
+    batch_size : int, optional
+        Number of trials epoched and transformed at a time. The default is 16.
+    segment_duration : float, optional
+        Length of the Welch segments in seconds. The default is 1.
+    fast_length : bool, optional
+        If True, zero-pad to the next fast FFT length. The default is True.
+    workers : int, optional
+        Number of scipy.fft workers (-1 for all cores). The default is -1.
+    dtype : data-type, optional
+        Data type of the epochs (e.g. np.float32). The default is None (float64).
+
+    Returns
+    -------
+    mean_spectra : 3-D Array of float64 of size (2, channels, frequencies)
+        Mean spectrum (of the epochs in µV) of the 12 Hz trials (row 0) and of the 15 Hz trials (row 1).
+    frequencies : Array of float64
+        Frequency of each column of the spectra.
+
+    '''
+    fs = data_dict['fs']
+    start_epochs = (data_dict['event_samples'] + epoch_start_time*fs).astype(int)
+    n_epoch_samples = int((epoch_end_time-epoch_start_time)*fs)
+    trial_classes = (data_dict['event_types'][:] == '15hz').astype(np.int64)
+    channel_indices = None if channels is None else get_channel_indices(data_dict['channels'], channels)
+    accumulator = SpectrumAccumulator(fs, n_epoch_samples, method=method, segment_duration=segment_duration,
+                                      fast_length=fast_length, workers=workers)
+    for batch_start in range(0, len(start_epochs), batch_size):
+        batch_epochs = extract_epochs(data_dict['eeg'], start_epochs[batch_start:batch_start + batch_size],
+                                      n_epoch_samples, scale=1000000, dtype=dtype, channels=channel_indices)
+        accumulator.add(batch_epochs, trial_classes[batch_start:batch_start + batch_size])
+    return accumulator.get_mean_spectra()
+
 # %% Part 5: Plot the Power Spectra   
 def plot_power_spectrum(eeg_epochs_fft, fft_frequencies, is_trial_15Hz, channels_to_plot, channels):
     '''
-    
+    Function that plots the mean power spectrum of the 12 Hz and 15 Hz trials for the channels the user specifies. Only
+    the plotted channels of eeg_epochs_fft are used.
 
     Parameters
     ----------
@@ -189,28 +494,50 @@ def plot_power_spectrum(eeg_epochs_fft, fft_frequencies, is_trial_15Hz, channels
     None.
 
     '''
-    # Differentiate 12 Hz and 15 Hz trials
-    eeg_trials_12Hz = eeg_epochs_fft[~is_trial_15Hz]
-    eeg_trials_15Hz = eeg_epochs_fft[is_trial_15Hz]
-    
+    # Select the plotted channels before taking magnitudes
+    channel_indices = get_channel_indices(channels, channels_to_plot)
+    eeg_trials_fft = eeg_epochs_fft[:, channel_indices]
+
+    # Differentiate 12 Hz and 15 Hz trials and calculate mean magnitude spectra
+    mean_spectra = np.stack([np.mean(abs(eeg_trials_fft[~is_trial_15Hz]), axis=0, dtype=np.float64),
+                             np.mean(abs(eeg_trials_fft[is_trial_15Hz]), axis=0, dtype=np.float64)])
+    plot_mean_spectra(mean_spectra, fft_frequencies, channels_to_plot)
+
+
+def plot_mean_spectra(mean_spectra, frequencies, channels_to_plot, method='magnitude'):
+    '''
+    Function that plots mean spectra of the 12 Hz and 15 Hz trials (e.g. from get_ssvep_mean_spectra) in dB, each
+    normalized to its peak.
+
+    Parameters
+    ----------
+    mean_spectra : 3-D Array of float64 of size (2, channels, frequencies)
+        Mean spectrum of the 12 Hz trials (row 0) and of the 15 Hz trials (row 1), one channel per channel to plot.
+    frequencies : Array of float64
+        Frequency of each column of the spectra.
+    channels_to_plot : list
+        Names of the channels of mean_spectra.
+    method : string, optional
+        'magnitude' if the spectra are mean magnitudes (they are squared into power) or 'welch' if they are already
+        power. The default is 'magnitude'.
+
+    Returns
+    -------
+    None.
+
+    '''
     # Calculate mean power spectra
-    mean_power_spectrum_12Hz = np.mean(abs(eeg_trials_12Hz), axis=0)**2
-    mean_power_spectrum_15Hz = np.mean(abs(eeg_trials_15Hz), axis=0)**2
-    
-    # Normalize spectrum
-    mean_power_spectrum_12Hz_norm = mean_power_spectrum_12Hz/mean_power_spectrum_12Hz.max(axis=1, keepdims=True)
-    mean_power_spectrum_15Hz_norm = mean_power_spectrum_15Hz/mean_power_spectrum_15Hz.max(axis=1, keepdims=True)
+    mean_power_spectra = mean_spectra**2 if method == 'magnitude' else mean_spectra
 
-    # Convert to decibels
-    power_in_db_12Hz = 10*np.log10(mean_power_spectrum_12Hz_norm)
-    power_in_db_15Hz = 10*np.log10(mean_power_spectrum_15Hz_norm)
+    # Normalize spectrum and convert to decibels
+    mean_power_spectra_norm = mean_power_spectra/mean_power_spectra.max(axis=2, keepdims=True)
+    power_in_db_12Hz, power_in_db_15Hz = 10*np.log10(mean_power_spectra_norm)
 
     # Plot mean power spectrum of 12 and 15 Hz trials
     for channel_index, channel in enumerate(channels_to_plot):
-        index_to_plot = np.where(channels==channel)[0][0]
         ax1=plt.subplot(len(channels_to_plot), 1, channel_index+1)
-        plt.plot(fft_frequencies,power_in_db_12Hz[index_to_plot], label='12Hz', color='red')
-        plt.plot(fft_frequencies,power_in_db_15Hz[index_to_plot], label='15Hz', color='green')
+        plt.plot(frequencies,power_in_db_12Hz[channel_index], label='12Hz', color='red')
+        plt.plot(frequencies,power_in_db_15Hz[channel_index], label='15Hz', color='green')
         plt.legend()
         plt.title(f'Mean {channel} Frequency Content for SSVEP Data')
         plt.xlabel('Frequency (Hz)')
@@ -219,22 +546,3 @@ def plot_power_spectrum(eeg_epochs_fft, fft_frequencies, is_trial_15Hz, channels
         plt.vlines(12,-100,0,colors='red',linestyles='dotted')
         plt.vlines(15,-100,0,colors='green',linestyles='dotted')
         plt.grid()
-
-    
-    
-
-
-
-
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+online_classifier.py
+
+File that defines the StreamingClassifier class and the function replay_fif.
+
+StreamingClassifier classifies perception/imagination trials while EEG arrives in small chunks (e.g. 32 samples at
+512 Hz). It applies the same processing as Project3.load_data - the 1 - 30 Hz FIR band-pass MNE uses and the average
+reference - followed by the ICA unmixing row of the selected component, keeps the component time course of the current
+epoch in a ring buffer and emits the threshold decision of Project3.make_prediction as soon as an epoch is complete.
+The ring buffer keeps running sums of its samples and their squares, so the variance of a decision costs O(1) however
+long the epoch is; the sums are recomputed from the buffer once per epoch length so rounding cannot build up.
+
+Because the band-pass filter, the average reference and the unmixing row are all linear, the two spatial steps are
+folded into one weight vector that is applied before filtering, so only one time course has to be filtered. The
+filter is MNE's linear-phase FIR run causally with its state kept between chunks: its output is the zero-phase
+(offline) output delayed by half the filter length, so each decision is emitted that many samples after the epoch
+ends and matches the offline decision except for trials within one filter length of the start of the recording.
+At the end of the stream, flush pushes the last half filter length out of the filter so the final trial is decided.
+
+replay_fif streams a .fif recording through the classifier and compares the online decisions to the offline pipeline.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import time
+import mne
+import numpy as np
+from scipy.signal import lfilter
+
+
+#%% Streaming classifier
+class StreamingClassifier:
+    '''
+    Class that classifies trials online from chunks of raw EEG and stim channel data.
+
+    Parameters
+    ----------
+    unmixing_matrix : Array of size (components, channels)
+        ICA unmixing matrix from the eeg channels (Project3.get_unmixing_matrix), as used by
+        Project3.plot_component_variance.
+    component : int
+        Component whose source activation variance is compared to the threshold.
+    threshold : float
+        Trials with a variance >= threshold are predicted as perceived (1), others as imagined (0).
+    fs : float
+        Sampling frequency in Hz.
+    start_time : float
+        Epoch start time relative to event start in seconds.
+    end_time : float
+        Epoch end time relative to event start in seconds.
+    l_freq : float, optional
+        Lower edge of the band-pass filter in Hz. The default is 1.
+    h_freq : float, optional
+        Upper edge of the band-pass filter in Hz. The default is 30.
+
+    Attributes
+    ----------
+    decisions : list of dictionary
+        One dictionary per classified trial: trial_index, onset (sample), event_id, variance, prediction, and
+        emitted_at (stream sample at which the decision was made).
+    chunk_latencies : list of float
+        Processing time of each chunk in seconds.
+
+    '''
+    def __init__(self, unmixing_matrix, component, threshold, fs, start_time, end_time, l_freq=1, h_freq=30):
+        self.component = component
+        self.threshold = threshold
+        self.fs = fs
+        # average reference followed by the unmixing row, as one weight vector over the raw channels
+        unmixing_row = np.asarray(unmixing_matrix)[component]
+        self.spatial_weights = unmixing_row - np.mean(unmixing_row)
+        # same FIR filter Raw.filter designs with its default settings
+        self.filter_taps = mne.filter.create_filter(None, fs, l_freq, h_freq, verbose=False)
+        self.filter_delay = (len(self.filter_taps) - 1) // 2
+        self.filter_state = np.zeros(len(self.filter_taps) - 1)
+        # epoch window relative to the event onset, in samples
+        self.start_offset = int(start_time*fs)
+        self.n_epoch_samples = int(end_time*fs) - int(start_time*fs)
+        # ring buffer holding the last n_epoch_samples samples of the (delay-corrected) component time course
+        self.ring_buffer = np.zeros(self.n_epoch_samples)
+        self.ring_position = 0
+        self.running_sum = 0.0
+        self.running_sum_of_squares = 0.0
+        self.n_samples_since_resync = 0
+        # number of raw samples received and number of filtered samples aligned with the offline time axis
+        self.n_samples_received = 0
+        self.n_samples_aligned = 0
+        self.previous_stim_value = 0
+        self.pending_trials = []
+        self.n_trials_seen = 0
+        self.decisions = []
+        self.chunk_latencies = []
+
+    @property
+    def current_variance(self):
+        '''
+        Running variance of the component over the last n_epoch_samples samples, from the ring buffer sums.
+        '''
+        n_filled = min(self.n_samples_aligned, self.n_epoch_samples)
+        if n_filled == 0:
+            return 0.0
+        mean = self.running_sum / n_filled
+        return max(self.running_sum_of_squares / n_filled - mean**2, 0.0)
+
+    def process_chunk(self, eeg_chunk, stim_chunk):
+        '''
+        Method to process one chunk of raw data and return the decisions that became available.
+
+        Parameters
+        ----------
+        eeg_chunk : Array of size (channels, chunk samples)
+            Raw (unfiltered, unreferenced) EEG of the channels the ICA was fitted on.
+        stim_chunk : 1-D array of length chunk samples
+            Stim channel values of the same samples.
+
+        Returns
+        -------
+        new_decisions : list of dictionary
+            Decisions for the trials whose epochs were completed by this chunk (see the decisions attribute).
+
+        '''
+        chunk_start_time = time.perf_counter()
+        chunk_start = self.n_samples_received
+        self._find_onsets(np.asarray(stim_chunk), chunk_start)
+
+        # spatial projection then causal band-pass, keeping the filter state for the next chunk
+        component_chunk = self.spatial_weights @ eeg_chunk
+        filtered_chunk, self.filter_state = lfilter(self.filter_taps, 1.0, component_chunk, zi=self.filter_state)
+        self.n_samples_received += len(component_chunk)
+
+        # drop the samples that precede offline sample 0, the rest line up with the offline time axis
+        n_unaligned = max(self.filter_delay - chunk_start, 0)
+        new_decisions = self._push_and_decide(filtered_chunk[n_unaligned:])
+        self.decisions.extend(new_decisions)
+        self.chunk_latencies.append(time.perf_counter() - chunk_start_time)
+        return new_decisions
+
+    def flush(self):
+        '''
+        Method to end the stream: the filter output still held back by the filter delay is pushed out (with zeros as
+        the input after the last sample) and the trials whose epochs it completes are decided. Trials whose epochs run
+        past the end of the recording are left undecided, as get_eeg_epochs cannot epoch them either.
+
+        Returns
+        -------
+        new_decisions : list of dictionary
+            Decisions for the trials completed by the flushed samples (see the decisions attribute).
+
+        '''
+        filtered_tail, self.filter_state = lfilter(self.filter_taps, 1.0, np.zeros(self.filter_delay),
+                                                   zi=self.filter_state)
+        # only the samples that line up with received input (fewer if the stream was shorter than the delay)
+        n_held_back = self.n_samples_received - self.n_samples_aligned
+        new_decisions = self._push_and_decide(filtered_tail[len(filtered_tail) - n_held_back:])
+        self.decisions.extend(new_decisions)
+        return new_decisions
+
+    def _push_and_decide(self, aligned_samples):
+        '''
+        Method to push aligned filtered samples into the ring buffer, deciding each epoch as soon as it is complete.
+        '''
+        new_decisions = []
+        while len(aligned_samples) > 0:
+            # push samples up to the end of the next pending epoch (or the whole chunk)
+            n_to_push = len(aligned_samples)
+            if len(self.pending_trials) > 0:
+                next_epoch_end = self.pending_trials[0]['window_start'] + self.n_epoch_samples
+                n_to_push = min(n_to_push, max(next_epoch_end - self.n_samples_aligned, 0))
+            self._push(aligned_samples[:n_to_push])
+            aligned_samples = aligned_samples[n_to_push:]
+            # decide every epoch that is now complete
+            while (len(self.pending_trials) > 0 and
+                   self.pending_trials[0]['window_start'] + self.n_epoch_samples <= self.n_samples_aligned):
+                new_decisions.append(self._decide(self.pending_trials.pop(0)))
+        return new_decisions
+
+    def _find_onsets(self, stim_chunk, chunk_start):
+        '''
+        Method to find trial onsets in a chunk of the stim channel (increases of the stim value, as mne.find_events
+        finds them) and queue them. Only event ids under 1000 are trials, as in Project3.get_eeg_epochs.
+        '''
+        previous_values = np.concatenate([[self.previous_stim_value], stim_chunk[:-1]])
+        onset_indices = np.flatnonzero((stim_chunk > previous_values) & (stim_chunk > 0))
+        for onset_index in onset_indices:
+            event_id = int(stim_chunk[onset_index])
+            if event_id < 1000:
+                onset = chunk_start + onset_index
+                self.pending_trials.append(dict(trial_index=self.n_trials_seen, onset=onset, event_id=event_id,
+                                                window_start=onset + self.start_offset))
+                self.n_trials_seen += 1
+        if len(stim_chunk) > 0:
+            self.previous_stim_value = stim_chunk[-1]
+
+    def _push(self, samples):
+        '''
+        Method to write samples into the ring buffer, updating the running sums.
+        '''
+        # only the last n_epoch_samples samples can stay in the buffer
+        if len(samples) > self.n_epoch_samples:
+            self.n_samples_aligned += len(samples) - self.n_epoch_samples
+            samples = samples[-self.n_epoch_samples:]
+        buffer_indices = (self.ring_position + np.arange(len(samples))) % self.n_epoch_samples
+        outgoing_samples = self.ring_buffer[buffer_indices]
+        self.running_sum += np.sum(samples) - np.sum(outgoing_samples)
+        self.running_sum_of_squares += np.sum(samples**2) - np.sum(outgoing_samples**2)
+        self.ring_buffer[buffer_indices] = samples
+        self.ring_position = (self.ring_position + len(samples)) % self.n_epoch_samples
+        self.n_samples_aligned += len(samples)
+        # recompute the sums exactly once per buffer length (amortized O(1) per sample) so they cannot drift
+        self.n_samples_since_resync += len(samples)
+        if self.n_samples_since_resync >= self.n_epoch_samples:
+            self.running_sum = float(np.sum(self.ring_buffer))
+            self.running_sum_of_squares = float(np.sum(self.ring_buffer**2))
+            self.n_samples_since_resync = 0
+
+    def _decide(self, trial):
+        '''
+        Method to classify a trial whose epoch fills the ring buffer.
+        '''
+        # the epoch fills the ring buffer, so its variance is the running variance
+        variance = self.current_variance
+        prediction = 1 if variance >= self.threshold else 0
+        return dict(trial_index=trial['trial_index'], onset=trial['onset'], event_id=trial['event_id'],
+                    variance=variance, prediction=prediction, emitted_at=self.n_samples_received)
+
+
+#%% Replay harness
+def replay_fif(subject, ica, component, threshold, start_time=0, end_time=7.6, chunk_size=32, check_offline=True):
+    '''
+    Function to stream a subject's raw .fif recording through a StreamingClassifier chunk by chunk and, optionally,
+    compare the online decisions to the offline pipeline (load_data, get_eeg_epochs, make_prediction).
+
+    Parameters
+    ----------
+    subject : string of subject number (two digits)
+        String denoting which subject we are analyzing.
+    ica : ICA Object of mne.preprocessing.ica module
+        Fitted ICA (e.g. from Project3.perform_ICA) whose channel unmixing matrix (Project3.get_unmixing_matrix) is
+        used.
+    component : int
+        Component used to make predictions.
+    threshold : float
+        Variance threshold used to make predictions.
+    start_time : float, optional
+        Epoch start time relative to event start in seconds. The default is 0.
+    end_time : float, optional
+        Epoch end time relative to event start in seconds. The default is 7.6.
+    chunk_size : int, optional
+        Number of samples per chunk. The default is 32.
+    check_offline : bool, optional
+        If True, also run the offline pipeline and compare predictions. The default is True.
+
+    Returns
+    -------
+    replay_results : dictionary
+        online_predictions (array of int), latencies (array of per-chunk processing times in seconds), and if
+        check_offline: offline_predictions (array of int), mismatched_trials (array of trial indices) and
+        match_fraction (float).
+
+    '''
+    import Project3
+
+    fif_file = mne.io.read_raw_fif(f'data/P{subject}-raw.fif', preload=False)
+    fs = fif_file.info['sfreq']
+    eeg_picks = np.arange(64)
+    stim_picks = mne.pick_types(fif_file.info, meg=False, stim=True)
+    unmixing_matrix = Project3.get_unmixing_matrix(ica)
+    classifier = StreamingClassifier(unmixing_matrix, component, threshold, fs, start_time, end_time)
+
+    for chunk_start in range(0, fif_file.n_times, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, fif_file.n_times)
+        chunk = fif_file.get_data(picks=np.concatenate([eeg_picks, stim_picks[:1]]), start=chunk_start,
+                                  stop=chunk_stop)
+        classifier.process_chunk(chunk[:64], chunk[64])
+    classifier.flush()
+
+    latencies = np.array(classifier.chunk_latencies)
+    online_predictions = np.array([decision['prediction'] for decision in classifier.decisions])
+    print(f'Classified {len(online_predictions)} trials online; per-chunk latency median '
+          f'{np.median(latencies)*1e3:.3f} ms, max {np.max(latencies)*1e3:.3f} ms '
+          f'({chunk_size/fs*1e3:.1f} ms of data per chunk)')
+    replay_results = dict(online_predictions=online_predictions, latencies=latencies)
+
+    if check_offline:
+        offline_file, raw_eeg_data, eeg_times, channel_names, fs = Project3.load_data(subject)
+        eeg_epochs, epoch_times, all_trials = Project3.get_eeg_epochs(offline_file, raw_eeg_data, start_time, end_time,
+                                                                      fs)
+        is_target_event = Project3.get_event_truth_labels(all_trials)
+        # only the selected component's source activation is needed
+        component_activations = np.matmul(unmixing_matrix[[component]], eeg_epochs)
+        offline_predictions = np.array(Project3.make_prediction(component_activations, 0, is_target_event, threshold))
+        n_compared = min(len(offline_predictions), len(online_predictions))
+        mismatched_trials = np.flatnonzero(offline_predictions[:n_compared] != online_predictions[:n_compared])
+        match_fraction = 1 - len(mismatched_trials)/max(n_compared, 1)
+        print(f'Online decisions match offline make_prediction on {match_fraction*100:.1f}% of {n_compared} trials')
+        replay_results.update(offline_predictions=offline_predictions, mismatched_trials=mismatched_trials,
+                              match_fraction=match_fraction)
+    return replay_results
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+pipeline_trace.py
+
+File that defines the PipelineTrace class and the functions stage and record_arrays - opt-in instrumentation of the
+pipeline stages.
+
+The pipeline functions mark their stages with `with stage('filter'):` (load, filter, reference, resample, epoch, label,
+reject, pca_rank, ica_fit, source_projection, sweep, itr) and report the arrays they produce with record_arrays. Nothing is measured
+unless a PipelineTrace is active:
+
+    with PipelineTrace(subject='09') as trace:
+        ...run the pipeline...
+    trace.save_json('traces/P09.json')
+    trace.save_chrome_trace('traces/P09.chrome.json')   # open in chrome://tracing or https://ui.perfetto.dev
+
+For each stage the trace records the wall time, CPU time, the process's peak RSS (and how much the stage raised it), the
+peak of the bytes allocated during the stage (tracemalloc) and the shapes and dtypes of the recorded arrays. Stages can
+be nested; each stage's allocation peak includes its nested stages. Without an active trace, stage returns a shared
+do-nothing context manager and record_arrays returns immediately.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is not recorded there
+    resource = None
+
+# the trace stages are currently recorded in, or None when tracing is off
+_active_trace = None
+# context manager returned by stage when tracing is off
+_NO_TRACE = contextlib.nullcontext()
+
+
+#%% Marking stages
+def stage(name, **details):
+    '''
+    Function to mark a pipeline stage: `with stage('filter', l_freq=1):`. Does nothing unless a PipelineTrace is active.
+
+    Parameters
+    ----------
+    name : string
+        Name of the stage.
+    **details :
+        JSON-serializable values stored with the stage (e.g. filter settings).
+
+    Returns
+    -------
+    stage_context : context manager
+        Context manager measuring the stage.
+
+    '''
+    if _active_trace is None:
+        return _NO_TRACE
+    return _active_trace._stage(name, details)
+
+
+def record_arrays(**arrays):
+    '''
+    Function to record the shapes and dtypes of arrays (anything with shape and dtype) in the innermost running stage.
+    Does nothing unless a PipelineTrace is active.
+
+    Parameters
+    ----------
+    **arrays :
+        Arrays to describe, by name.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if _active_trace is None or len(_active_trace._open_stages) == 0:
+        return
+    array_descriptions = _active_trace._open_stages[-1]['record']['arrays']
+    for array_name, array in arrays.items():
+        array_descriptions[array_name] = {'shape': [int(size) for size in getattr(array, 'shape', ())],
+                                          'dtype': str(getattr(array, 'dtype', type(array).__name__))}
+
+
+def _get_peak_rss():
+    '''
+    Function to get the peak resident set size of this process in bytes (None where the resource module is missing).
+    '''
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak_rss if sys.platform == 'darwin' else peak_rss*1024
+
+
+#%% Traces
+class PipelineTrace:
+    '''
+    Class that records the pipeline stages run while it is active (used as a context manager). Only one trace can be
+    active at a time.
+
+    Parameters
+    ----------
+    trace_allocations : bool, optional
+        If True, trace memory allocations with tracemalloc (which slows down Python-heavy code) to record each stage's
+        allocation peak. The default is True.
+    **metadata :
+        JSON-serializable values stored with the trace (e.g. subject).
+
+    '''
+    def __init__(self, trace_allocations=True, **metadata):
+        self.trace_allocations = trace_allocations
+        self.metadata = metadata
+        self.stages = []
+        self._open_stages = []
+        self._start_time = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        '''
+        Method to make this the active trace (what entering the with block does).
+        '''
+        global _active_trace
+        if _active_trace is not None:
+            raise RuntimeError('Another PipelineTrace is already active')
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._start_time = time.perf_counter()
+        _active_trace = self
+        return self
+
+    def stop(self):
+        '''
+        Method to stop recording stages (what leaving the with block does).
+        '''
+        global _active_trace
+        if _active_trace is self:
+            _active_trace = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    @contextlib.contextmanager
+    def _stage(self, name, details):
+        parent = self._open_stages[-1] if len(self._open_stages) > 0 else None
+        record = {'name': name, 'parent': None if parent is None else parent['record']['name'],
+                  'depth': len(self._open_stages), 'details': details, 'arrays': {}}
+        open_stage = {'record': record, 'peak_allocated': 0}
+        if tracemalloc.is_tracing():
+            # hand the peak reached so far to the parent stage before resetting it for this one
+            current_allocated, peak_allocated = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent['peak_allocated'] = max(parent['peak_allocated'], peak_allocated)
+            tracemalloc.reset_peak()
+            open_stage['start_allocated'] = current_allocated
+        start_peak_rss = _get_peak_rss()
+        self._open_stages.append(open_stage)
+        start_cpu_time = time.process_time()
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            wall_time = time.perf_counter() - start_time
+            cpu_time = time.process_time() - start_cpu_time
+            self._open_stages.pop()
+            record['start_s'] = start_time - self._start_time
+            record['wall_s'] = wall_time
+            record['cpu_s'] = cpu_time
+            peak_rss = _get_peak_rss()
+            if peak_rss is not None:
+                record['peak_rss_mb'] = peak_rss/2**20
+                record['peak_rss_increase_mb'] = (peak_rss - start_peak_rss)/2**20
+            if tracemalloc.is_tracing() and 'start_allocated' in open_stage:
+                peak_allocated = max(open_stage['peak_allocated'], tracemalloc.get_traced_memory()[1])
+                if parent is not None:
+                    parent['peak_allocated'] = max(parent['peak_allocated'], peak_allocated)
+                record['allocated_peak_mb'] = (peak_allocated - open_stage['start_allocated'])/2**20
+            self.stages.append(record)
+
+    def to_dict(self):
+        '''
+        Method to get the trace as a JSON-serializable dictionary.
+
+        Returns
+        -------
+        trace : dictionary
+            'metadata' and 'stages' (one dictionary per stage, in the order the stages started).
+
+        '''
+        return {'metadata': self.metadata, 'stages': sorted(self.stages, key=lambda record: record['start_s'])}
+
+    def save_json(self, file_name):
+        '''
+        Method to save the trace as JSON.
+
+        Parameters
+        ----------
+        file_name : string
+            Path of the JSON file.
+
+        Returns
+        -------
+        None.
+
+        '''
+        with open(file_name, 'w') as trace_file:
+            json.dump(self.to_dict(), trace_file, indent=2, default=str)
+
+    def save_chrome_trace(self, file_name):
+        '''
+        Method to save the trace in the Chrome trace event format (one complete event per stage), which
+        chrome://tracing and Perfetto display as a timeline.
+
+        Parameters
+        ----------
+        file_name : string
+            Path of the JSON file.
+
+        Returns
+        -------
+        None.
+
+        '''
+        trace_events = []
+        for record in self.stages:
+            event_args = {key: value for key, value in record.items()
+                          if key not in ('name', 'parent', 'depth', 'start_s', 'wall_s')}
+            trace_events.append({'name': record['name'], 'cat': 'pipeline', 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                                 'ts': record['start_s']*1e6, 'dur': record['wall_s']*1e6, 'args': event_args})
+        with open(file_name, 'w') as trace_file:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms', 'otherData': self.metadata}, trace_file,
+                      default=str)
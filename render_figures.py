@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+render_figures.py
+
+File that defines functions plot_ica_components, plot_component_variance_histograms, plot_threshold_metrics,
+plot_confusion_matrix, plot_decision_latency, and render_figure_jobs.
+
+This is the rendering layer of the pipeline: the analysis functions in Project3 return plain results, and the
+functions here turn those results into the figures saved in figures/. Every figure is drawn on its own matplotlib
+Figure (not through pyplot's global state), saved, and closed, so rendering works headless and does not leak figure
+memory. render_figure_jobs renders a list of figures - e.g. for many subjects - with the non-interactive Agg backend,
+in this process or in parallel worker processes.
+
+Nothing here is imported unless figures are asked for, so a pipeline run with plotting turned off does no matplotlib
+work at all.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+from matplotlib.figure import Figure
+import numpy as np
+
+# size of every figure, in inches
+FIGURE_SIZE = (14, 8)
+
+
+#%% Figures
+def plot_ica_components(ica, top_n_components, file_name):
+    '''
+    Function to plot the topographic maps of the first ICA components and save the figure.
+
+    Parameters
+    ----------
+    ica : ICA Object of mne.preprocessing.ica module
+        contains ICA data
+    top_n_components : int
+        the number of top components to plot.
+    file_name : string
+        Path the figure is saved to.
+
+    Returns
+    -------
+    None.
+
+    '''
+    # MNE draws its topomaps through pyplot, so close the figure explicitly once it is saved
+    import matplotlib.pyplot as plt
+    figure = ica.plot_components(picks=np.arange(0, top_n_components), show=False)
+    figure.savefig(file_name)
+    plt.close(figure)
+
+
+def plot_component_variance_histograms(component_activation_variances, components, is_target_event, file_name):
+    '''
+    Function to plot, for each component, the histogram of trial variances broken up by perception and imagination
+    trials, and save the figure.
+
+    Parameters
+    ----------
+    component_activation_variances : Array of float of size (trials, components)
+        Variance of each trial's source activation for each of the given components.
+    components : Array of int
+        Components the variance columns belong to (at most 10, laid out on a 2 x 5 grid by component number).
+    is_target_event : 1-D boolean array
+        Boolean array representing trials the subject perceived music vs imagined music.
+    file_name : string
+        Path the figure is saved to.
+
+    Returns
+    -------
+    None.
+
+    '''
+    figure = Figure(figsize=FIGURE_SIZE)
+    for component_index, component in enumerate(components):
+        axis = figure.add_subplot(2, 5, component+1)
+        variances = component_activation_variances[:, component_index]
+        # break into different trial types
+        target_activation_vars = variances[is_target_event]
+        nontarget_activation_vars = variances[~is_target_event]
+        # drop the 178th imagination variance, an outlier (only recordings with that many imagination trials have it)
+        if len(nontarget_activation_vars) > 178:
+            nontarget_activation_vars = np.delete(nontarget_activation_vars, 178)
+        axis.hist([target_activation_vars, nontarget_activation_vars], label=['Perception', 'Imagination'])
+        axis.set_xlabel('Variance')
+        axis.set_ylabel('Count')
+        axis.legend()
+        axis.set_title(f'component {component} variance')
+    figure.tight_layout()
+    figure.savefig(file_name)
+
+
+def plot_threshold_metrics(components, all_accuracies, all_true_positive_percentages, file_name):
+    '''
+    Function to plot the accuracy, true positive percentage and their average for every component/threshold pair on
+    pseudocolor subplots, and save the figure.
+
+    Parameters
+    ----------
+    components : Array of int
+        Components that were tested (as passed to Project3.test_all_components_thresholds).
+    all_accuracies : Array of float
+        Accuracy of each component/threshold pair (from Project3.test_all_components_thresholds).
+    all_true_positive_percentages : Array of float
+        True positive percentage of each component/threshold pair.
+    file_name : string
+        Path the figure is saved to.
+
+    Returns
+    -------
+    None.
+
+    '''
+    # the sweep results have one row per component, in reverse order, and one column per threshold
+    components = components[::-1]
+    extent = (0, np.shape(all_accuracies)[1] - 1, components[-1], components[0])
+    metrics = [(all_accuracies, 'Accuracy (% Correct)', 'All Component/Threshold Accuracies'),
+               (all_true_positive_percentages, 'TP %', 'All Component/Threshold True Positives'),
+               (np.mean(np.array([all_accuracies, all_true_positive_percentages]), axis=0),
+                'Average of TP% and Accuracy', 'Average of All Component/Threshold Accuracies and True Positives')]
+    figure = Figure(figsize=FIGURE_SIZE)
+    for metric_index, (metric, label, title) in enumerate(metrics):
+        axis = figure.add_subplot(1, 3, metric_index+1)
+        image = axis.imshow(metric, extent=extent)
+        figure.colorbar(image, ax=axis, label=label, fraction=0.046, pad=0.04)
+        axis.set_xlabel('Threshold Index')
+        axis.set_ylabel('Component')
+        axis.set_title(title)
+    figure.tight_layout()
+    figure.savefig(file_name)
+
+
+def plot_confusion_matrix(cm, component, file_name):
+    '''
+    Function to plot a confusion matrix and save the figure.
+
+    Parameters
+    ----------
+    cm : Confusion Matrix
+        Confusion matrix from Project3.evaluate_predictions.
+    component : int
+        Component the predictions were made with (used in the title).
+    file_name : string
+        Path the figure is saved to.
+
+    Returns
+    -------
+    None.
+
+    '''
+    from sklearn.metrics import ConfusionMatrixDisplay
+    figure = Figure(figsize=FIGURE_SIZE)
+    axis = figure.add_subplot(1, 1, 1)
+    ConfusionMatrixDisplay(confusion_matrix=cm).plot(ax=axis)
+    axis.set_title(f'Confusion Matrix Using Component {component}')
+    figure.savefig(file_name)
+
+
+def plot_decision_latency(latency_results, file_name):
+    '''
+    Function to plot the best accuracy and the ITR of every component against the decision latency (for the first
+    window offset), and save the figure.
+
+    Parameters
+    ----------
+    latency_results : dictionary
+        Results of decision_latency.sweep_window_durations.
+    file_name : string
+        Path the figure is saved to.
+
+    Returns
+    -------
+    None.
+
+    '''
+    decision_latencies = latency_results['decision_latencies'][0]
+    best = latency_results['best']
+    figure = Figure(figsize=FIGURE_SIZE)
+    for metric_index, (metric, label) in enumerate([('accuracies', 'Accuracy (% Correct)'),
+                                                    ('itrs', 'ITR (bits/s)')]):
+        axis = figure.add_subplot(2, 1, metric_index+1)
+        axis.plot(decision_latencies, latency_results[metric][0], linewidth=1)
+        axis.axvline(best['decision_latency'], color='black', linestyle='dotted',
+                     label=f"highest ITR: component {best['component']} at {best['decision_latency']:.2f} s")
+        axis.set_xlabel('Decision Latency (s)')
+        axis.set_ylabel(label)
+        axis.legend()
+        axis.grid(True)
+    figure.axes[0].set_title('Accuracy and ITR of Every Component Against the Window Length')
+    figure.tight_layout()
+    figure.savefig(file_name)
+
+
+#%% Rendering many figures
+# figures that can be rendered by name in render_figure_jobs
+RENDER_FUNCTIONS = {
+    'ica_components': plot_ica_components,
+    'component_variance_histograms': plot_component_variance_histograms,
+    'threshold_metrics': plot_threshold_metrics,
+    'confusion_matrix': plot_confusion_matrix,
+    'decision_latency': plot_decision_latency,
+}
+
+
+def _render_figure_job(figure_job):
+    '''
+    Function to render one (figure name, keyword arguments) job and return the saved file name.
+    '''
+    figure_name, figure_kwargs = figure_job
+    RENDER_FUNCTIONS[figure_name](**figure_kwargs)
+    return figure_kwargs['file_name']
+
+
+def _use_headless_backend():
+    '''
+    Function run at the start of every rendering worker (and around in-process rendering) to select the
+    non-interactive Agg backend.
+    '''
+    matplotlib.use('Agg')
+
+
+def render_figure_jobs(figure_jobs, workers=1):
+    '''
+    Function to render a list of figures with the Agg backend, in parallel worker processes if workers > 1. When
+    rendering in this process, the previous backend is restored afterwards.
+
+    Parameters
+    ----------
+    figure_jobs : list of (string, dictionary)
+        Figures to render: the name of a function in RENDER_FUNCTIONS and its keyword arguments (including file_name).
+    workers : int, optional
+        Number of worker processes. The default is 1 (render in this process).
+
+    Returns
+    -------
+    file_names : list of string
+        Paths of the saved figures, in the order of figure_jobs.
+
+    '''
+    if workers <= 1:
+        previous_backend = matplotlib.get_backend()
+        _use_headless_backend()
+        try:
+            return [_render_figure_job(figure_job) for figure_job in figure_jobs]
+        finally:
+            matplotlib.use(previous_backend)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_use_headless_backend) as executor:
+        return list(executor.map(_render_figure_job, figure_jobs))
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+results_store.py
+
+File that defines the ResultsStore class and the functions run_sweep and main - a local SQLite store of classification
+results and a parameter sweep driver that only computes what the store does not hold yet.
+
+The store keeps one record per subject, epoch window, filter band, ICA parameters, component and threshold, holding the
+threshold's accuracy, confusion matrix, true positive rate, ITR (from Project3.calculate_itr) and the time each stage of
+its configuration took. The thresholds of a component are the 10 that Project3.test_all_components_thresholds spreads
+over the range of its trial variances, plus the component's most accurate threshold out of every achievable one (from
+Project3.sweep_thresholds), so records are keyed on the threshold's index (0 - 9 for the grid, -1 for the best) and
+store its value.
+
+run_sweep walks a grid of configurations, asks the store which (component, threshold) records each one is missing, and
+runs the pipeline only for configurations with missing records. Each configuration's records are committed together,
+so a sweep that crashes or gains a parameter value is resumed by running it again:
+
+    python -m results_store 09 11 12 13 14 --windows 0:7.6 0:5 --bands 1:30 1:15 --db results.sqlite --cache-dir cache
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import argparse
+import inspect
+import json
+import sqlite3
+import sys
+import time
+
+# number of thresholds test_all_components_thresholds tests per component
+N_THRESHOLDS = 10
+# threshold_index of the record holding a component's most accurate threshold (from Project3.sweep_thresholds), outside
+# the grid's 0 ... N_THRESHOLDS-1 so the two can never share a key
+BEST_THRESHOLD_INDEX = -1
+# columns identifying a configuration (one pipeline run) and a record within it
+CONFIGURATION_COLUMNS = ('subject', 'start_time', 'end_time', 'l_freq', 'h_freq', 'ica_params')
+RECORD_COLUMNS = CONFIGURATION_COLUMNS + ('component', 'threshold_index')
+# perform_ICA arguments that do not change the fitted decomposition, left out of the ica_params column
+ICA_OUTPUT_PARAMETERS = ('cache_dir', 'cache_size_limit', 'plot')
+# columns of the results of a record
+RESULT_COLUMNS = ('threshold', 'accuracy', 'true_positive_rate', 'itr', 'cm', 'timing', 'created_at')
+
+
+#%% Results store
+class ResultsStore:
+    '''
+    Class that stores classification results in a SQLite database file (created if it does not exist).
+
+    Parameters
+    ----------
+    database_path : string
+        Path of the SQLite database file.
+
+    '''
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.connection = sqlite3.connect(database_path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (subject TEXT, start_time REAL, end_time REAL, '
+                                'l_freq REAL, h_freq REAL, ica_params TEXT, component INTEGER, '
+                                'threshold_index INTEGER, threshold REAL, accuracy REAL, true_positive_rate REAL, '
+                                'itr REAL, cm TEXT, timing TEXT, created_at REAL, '
+                                f'PRIMARY KEY ({", ".join(RECORD_COLUMNS)}))')
+        self.connection.commit()
+
+    def close(self):
+        '''
+        Method to close the database connection.
+        '''
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def missing_components(self, configuration, components):
+        '''
+        Method to find the components of a configuration that do not have all their threshold records yet.
+
+        Parameters
+        ----------
+        configuration : dictionary
+            Values of CONFIGURATION_COLUMNS (ica_params as a dictionary of perform_ICA keyword arguments).
+        components : list of int
+            Components the sweep asks for.
+
+        Returns
+        -------
+        missing_components : list of int
+            Components without all N_THRESHOLDS grid records and their best-threshold record.
+
+        '''
+        rows = self.connection.execute(
+            'SELECT component, COUNT(*) FROM results WHERE ' + ' AND '.join(f'{column} = ?' for column in
+                                                                           CONFIGURATION_COLUMNS)
+            + ' GROUP BY component', _get_configuration_values(configuration)).fetchall()
+        n_records = dict(rows)
+        return [component for component in components if n_records.get(int(component), 0) < N_THRESHOLDS + 1]
+
+    def add_records(self, configuration, records):
+        '''
+        Method to store the records of one configuration (replacing any stored records with the same key) in one
+        transaction.
+
+        Parameters
+        ----------
+        configuration : dictionary
+            Values of CONFIGURATION_COLUMNS.
+        records : list of dictionary
+            One dictionary per record holding component, threshold_index and the RESULT_COLUMNS (cm and timing as
+            JSON-serializable values).
+
+        Returns
+        -------
+        None.
+
+        '''
+        configuration_values = _get_configuration_values(configuration)
+        rows = [configuration_values + (int(record['component']), int(record['threshold_index']),
+                                        float(record['threshold']), float(record['accuracy']),
+                                        float(record['true_positive_rate']), float(record['itr']),
+                                        json.dumps(record['cm']), json.dumps(record['timing']),
+                                        record.get('created_at', time.time()))
+                for record in records]
+        with self.connection:
+            self.connection.executemany(f'INSERT OR REPLACE INTO results ({", ".join(RECORD_COLUMNS + RESULT_COLUMNS)}) '
+                                        f'VALUES ({", ".join("?"*len(RECORD_COLUMNS + RESULT_COLUMNS))})', rows)
+
+    def get_records(self, order_by='accuracy DESC', **column_values):
+        '''
+        Method to read stored records.
+
+        Parameters
+        ----------
+        order_by : string, optional
+            SQL ORDER BY clause. The default is 'accuracy DESC'.
+        **column_values :
+            Values of RECORD_COLUMNS to filter on (ica_params as a dictionary), e.g. subject='09'.
+
+        Returns
+        -------
+        records : list of dictionary
+            One dictionary per record, with cm, timing and ica_params decoded from JSON.
+
+        '''
+        unknown_columns = set(column_values) - set(RECORD_COLUMNS)
+        if len(unknown_columns) > 0:
+            raise ValueError(f'Unknown record columns: {sorted(unknown_columns)}')
+        if 'ica_params' in column_values:
+            column_values['ica_params'] = _get_ica_params_key(column_values['ica_params'])
+        query = 'SELECT * FROM results'
+        if len(column_values) > 0:
+            query += ' WHERE ' + ' AND '.join(f'{column} = ?' for column in column_values)
+        cursor = self.connection.execute(f'{query} ORDER BY {order_by}', tuple(column_values.values()))
+        column_names = [description[0] for description in cursor.description]
+        records = []
+        for row in cursor:
+            record = dict(zip(column_names, row))
+            for json_column in ('cm', 'timing', 'ica_params'):
+                record[json_column] = json.loads(record[json_column])
+            records.append(record)
+        return records
+
+
+def _get_ica_params_key(ica_params):
+    '''
+    Function to turn perform_ICA keyword arguments into the canonical JSON text stored in the ica_params column. The
+    arguments are resolved against perform_ICA's defaults first, so stored records name every fit parameter and do not
+    silently match a fit made after a default changed.
+    '''
+    from Project3 import perform_ICA
+    resolved_params = {name: parameter.default for name, parameter in inspect.signature(perform_ICA).parameters.items()
+                       if parameter.default is not inspect.Parameter.empty and name not in ICA_OUTPUT_PARAMETERS}
+    resolved_params.update(ica_params or {})
+    return json.dumps(resolved_params, sort_keys=True)
+
+
+def _get_configuration_values(configuration):
+    '''
+    Function to get the values of CONFIGURATION_COLUMNS of a configuration, in column order.
+    '''
+    return (str(configuration['subject']), float(configuration['start_time']), float(configuration['end_time']),
+            float(configuration['l_freq']), float(configuration['h_freq']),
+            _get_ica_params_key(configuration['ica_params']))
+
+
+#%% Sweep driver
+def run_sweep(store, subjects, epoch_windows=((0, 7.6),), filter_bands=((1, 30),), ica_param_sets=({},),
+              top_n_components=10, cache_dir=None, memory_budget=None):
+    '''
+    Function to run the pipeline over a grid of configurations, computing only the configurations that have missing
+    records in the store. A recording is loaded (and ICA fit) only if one of its configurations is missing something,
+    and is loaded once for all its epoch windows and ICA parameter sets.
+
+    Parameters
+    ----------
+    store : ResultsStore
+        Store to read and add records to.
+    subjects : list of string
+        Subject numbers (two digits).
+    epoch_windows : list of (float, float), optional
+        Epoch (start_time, end_time) pairs in seconds. The default is ((0, 7.6),).
+    filter_bands : list of (float, float), optional
+        Band-pass (l_freq, h_freq) pairs in Hz. The default is ((1, 30),).
+    ica_param_sets : list of dictionary, optional
+        Keyword arguments of Project3.perform_ICA (e.g. {'decim': 3, 'max_iter': 800}). The default is ({},) (the
+        perform_ICA defaults). Records are stored with the defaults filled in.
+    top_n_components : int, optional
+        Components 0 ... top_n_components-1 are tested. The default is 10.
+    cache_dir : string, optional
+        Directory of the pre-processed data and ICA cache, passed on to load_data and perform_ICA. The default is None.
+    memory_budget : int, optional
+        Working memory in bytes for chunked loading, passed on to load_data. The default is None.
+
+    Returns
+    -------
+    sweep_summary : dictionary
+        'computed' and 'skipped': the configurations (dictionaries of CONFIGURATION_COLUMNS) that were run and that
+        were already complete.
+
+    '''
+    import numpy as np
+    import Project3
+
+    components = list(range(top_n_components))
+    sweep_summary = {'computed': [], 'skipped': []}
+    for subject in subjects:
+        for l_freq, h_freq in filter_bands:
+            # find the missing work before loading anything
+            missing_work = []
+            for ica_params in ica_param_sets:
+                for start_time, end_time in epoch_windows:
+                    configuration = dict(subject=subject, start_time=start_time, end_time=end_time, l_freq=l_freq,
+                                         h_freq=h_freq, ica_params=ica_params)
+                    missing_components = store.missing_components(configuration, components)
+                    if len(missing_components) > 0:
+                        missing_work.append((configuration, missing_components))
+                    else:
+                        sweep_summary['skipped'].append(configuration)
+            if len(missing_work) == 0:
+                continue
+
+            stage_start = time.perf_counter()
+            fif_file, raw_eeg_data, eeg_times, channel_names, fs = Project3.load_data(
+                subject, l_freq, h_freq, cache_dir=cache_dir, memory_budget=memory_budget)
+            load_time = time.perf_counter() - stage_start
+            fitted_icas = {}
+            for configuration, missing_components in missing_work:
+                timing = {'load_s': load_time}
+                ica_params_key = _get_ica_params_key(configuration['ica_params'])
+                stage_start = time.perf_counter()
+                if ica_params_key not in fitted_icas:
+                    fitted_icas[ica_params_key] = Project3.perform_ICA(
+                        fif_file, channel_names, top_n_components, cache_dir=cache_dir, plot=False,
+                        **configuration['ica_params'])
+                ica = fitted_icas[ica_params_key]
+                timing['ica_s'] = time.perf_counter() - stage_start
+
+                stage_start = time.perf_counter()
+                start_time, end_time = configuration['start_time'], configuration['end_time']
+                eeg_epochs, epoch_times, all_trials = Project3.get_eeg_epochs(fif_file, raw_eeg_data, start_time,
+                                                                              end_time, fs)
+                is_target_event = Project3.get_event_truth_labels(all_trials)
+                timing['epoch_s'] = time.perf_counter() - stage_start
+
+                stage_start = time.perf_counter()
+                source_activations = Project3.plot_component_variance(ica, np.array(missing_components), eeg_epochs,
+                                                                      is_target_event, plot=False)
+                records = get_threshold_records(np.array(missing_components), source_activations, is_target_event,
+                                                end_time - start_time)
+                timing['sweep_s'] = time.perf_counter() - stage_start
+                for record in records:
+                    record['timing'] = timing
+                store.add_records(configuration, records)
+                sweep_summary['computed'].append(configuration)
+    return sweep_summary
+
+
+def get_threshold_records(components, source_activations, is_target_event, duration):
+    '''
+    Function to score every threshold of Project3.test_all_components_thresholds for a set of components, and the most
+    accurate threshold of each component found by Project3.sweep_thresholds.
+
+    Parameters
+    ----------
+    components : Array of int
+        Components to score.
+    source_activations : Array of float or SourceActivations
+        Source activations of the epochs (see Project3.plot_component_variance).
+    is_target_event : 1-D boolean array
+        Boolean array representing trials the subject perceived music vs imagined music.
+    duration : float
+        Epoch length in seconds (for the ITR).
+
+    Returns
+    -------
+    records : list of dictionary
+        One dictionary per (component, threshold) holding component, threshold_index (BEST_THRESHOLD_INDEX for the
+        best threshold), threshold, accuracy, true_positive_rate, itr and cm (the confusion matrix [[TN, FP], [FN, TP]]
+        as nested lists).
+
+    '''
+    import numpy as np
+    import Project3
+
+    all_accuracies, all_thresholds, all_true_positive_percentages = Project3.test_all_components_thresholds(
+        components, source_activations, is_target_event, plot=False)
+    if all_thresholds.shape[1] != N_THRESHOLDS:
+        raise ValueError(f'Expected {N_THRESHOLDS} grid thresholds per component, got {all_thresholds.shape[1]}')
+    is_target_event = np.asarray(is_target_event, dtype=bool)
+    component_activation_variances = Project3.get_component_variances(source_activations, components)
+    n_targets = int(np.count_nonzero(is_target_event))
+    records = []
+    # the grid results have one row per component (components in reverse order) and one column per threshold
+    for component_row, component in enumerate(components[::-1]):
+        # count the confusion matrix of every grid threshold directly (variance >= threshold is predicted perceived)
+        is_predicted_target = (component_activation_variances[:, len(components) - 1 - component_row, np.newaxis]
+                               >= all_thresholds[component_row])
+        grid_true_positives = np.count_nonzero(is_predicted_target[is_target_event], axis=0)
+        grid_false_positives = np.count_nonzero(is_predicted_target[~is_target_event], axis=0)
+        for threshold_index in range(all_thresholds.shape[1]):
+            accuracy = all_accuracies[component_row, threshold_index]
+            true_positives = int(grid_true_positives[threshold_index])
+            false_positives = int(grid_false_positives[threshold_index])
+            cm = [[len(is_target_event) - n_targets - false_positives, false_positives],
+                  [n_targets - true_positives, true_positives]]
+            records.append(dict(component=int(component), threshold_index=threshold_index,
+                                threshold=all_thresholds[component_row, threshold_index], accuracy=accuracy,
+                                true_positive_rate=all_true_positive_percentages[component_row, threshold_index],
+                                itr=Project3.calculate_itr(accuracy, duration, is_target_event), cm=cm))
+
+    # the most accurate of every achievable threshold of each component
+    thresholds, accuracies, true_positives, false_positives, true_negatives, false_negatives = \
+        Project3.sweep_thresholds(component_activation_variances, is_target_event)
+    best_rows = np.argmax(accuracies, axis=0)
+    for component_index, (component, best_row) in enumerate(zip(components, best_rows)):
+        accuracy = float(accuracies[best_row, component_index])
+        cm = [[int(true_negatives[best_row, component_index]), int(false_positives[best_row, component_index])],
+              [int(false_negatives[best_row, component_index]), int(true_positives[best_row, component_index])]]
+        records.append(dict(component=int(component), threshold_index=BEST_THRESHOLD_INDEX,
+                            threshold=Project3.get_centered_threshold(
+                                component_activation_variances[:, component_index],
+                                thresholds[best_row, component_index]), accuracy=accuracy,
+                            true_positive_rate=true_positives[best_row, component_index]/max(n_targets, 1),
+                            itr=Project3.calculate_itr(accuracy, duration, is_target_event), cm=cm))
+    return records
+
+
+#%% Command line entry point
+def _parse_pair(pair_text):
+    '''
+    Function to parse 'a:b' into a pair of floats.
+    '''
+    first, second = pair_text.split(':')
+    return float(first), float(second)
+
+
+def main(argv=None):
+    '''
+    Function that parses command line arguments, runs the sweep and prints the best stored record of each subject.
+
+    Parameters
+    ----------
+    argv : list of string, optional
+        Command line arguments. The default is None (use sys.argv).
+
+    Returns
+    -------
+    exit_code : int
+        0 when the sweep finished.
+
+    '''
+    parser = argparse.ArgumentParser(prog='python -m results_store', description='Sweep pipeline parameters over '
+                                     'OpenMIIR subjects, computing only configurations missing from the store.')
+    parser.add_argument('subjects', nargs='+', help="subject numbers, e.g. 09 11 13 (a leading 'P' is allowed)")
+    parser.add_argument('--db', default='results.sqlite', help='SQLite results file (default results.sqlite)')
+    parser.add_argument('--windows', nargs='+', type=_parse_pair, default=[(0, 7.6)],
+                        help='epoch windows as start:end in seconds (default 0:7.6)')
+    parser.add_argument('--bands', nargs='+', type=_parse_pair, default=[(1, 30)],
+                        help='filter bands as l_freq:h_freq in Hz (default 1:30)')
+    parser.add_argument('--decim', nargs='+', type=int, default=[3], help='ICA decim values (default 3)')
+    parser.add_argument('--max-iter', nargs='+', type=int, default=[800], help='ICA max_iter values (default 800)')
+    parser.add_argument('--top-n-components', type=int, default=10, help='components to test (default 10)')
+    parser.add_argument('--cache-dir', default=None, help='directory of the pre-processed data and ICA cache')
+    args = parser.parse_args(argv)
+
+    subjects = [subject[1:] if subject.upper().startswith('P') else subject for subject in args.subjects]
+    ica_param_sets = [dict(decim=decim, max_iter=max_iter) for decim in args.decim for max_iter in args.max_iter]
+    with ResultsStore(args.db) as store:
+        sweep_summary = run_sweep(store, subjects, epoch_windows=args.windows, filter_bands=args.bands,
+                                  ica_param_sets=ica_param_sets, top_n_components=args.top_n_components,
+                                  cache_dir=args.cache_dir)
+        print(f"Computed {len(sweep_summary['computed'])} configurations, "
+              f"{len(sweep_summary['skipped'])} were already stored")
+        for subject in subjects:
+            best_records = store.get_records(subject=subject)[:1]
+            for record in best_records:
+                print(f"P{subject}: accuracy {record['accuracy']:.3f}, ITR {record['itr']:.3f} bits/s with component "
+                      f"{record['component']} (threshold {record['threshold']:.3g}), window "
+                      f"{record['start_time']}-{record['end_time']} s, band {record['l_freq']}-{record['h_freq']} Hz, "
+                      f"ICA {record['ica_params']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+run_batch.py
+
+File that defines functions run_subject, run_batch, format_summary_table, and main - the command line entry point that
+runs the full Project3 pipeline (load_data, get_eeg_epochs, get_event_truth_labels, perform_ICA,
+plot_component_variance, test_all_components_thresholds, calculate_itr) on any set of OpenMIIR subjects in parallel
+worker processes and gathers per-subject accuracy, ITR and timing into one summary table.
+
+The component and threshold of each subject are the pair with the highest accuracy found by
+Project3.select_best_component_threshold. The pipeline runs with plotting turned off; with --figures, each subject's figures are
+rendered afterwards by render_figures in parallel worker processes and saved as figures/P{subject}_*.png. With
+--trace-dir, each subject's stages are traced (see pipeline_trace) and saved as P{subject}.json and
+P{subject}.chrome.json. With --group-ica, one ICA is fit across all the subjects first (see Project3.perform_group_ICA)
+and each subject uses its back-projection of the group components instead of its own ICA fit. Since that pair is
+chosen on the trials it is scored on, --cv-folds adds the held-out accuracy and ITR of the same classifier from
+stratified (optionally nested) cross-validation (see cross_validation).
+
+Example:
+    python -m run_batch 09 11 12 13 14 --workers 4 --output results.csv --figures
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+# environment variables limiting the threads of the BLAS/OpenMP libraries numpy, scipy and sklearn are built on
+THREAD_LIMIT_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                          'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+# columns of the summary table
+SUMMARY_COLUMNS = ('subject', 'status', 'component', 'threshold', 'accuracy', 'itr', 'cv_accuracy', 'cv_itr', 'load_s',
+                   'epoch_s', 'ica_s', 'sweep_s', 'cv_s', 'total_s')
+
+
+#%% Running the pipeline on one subject
+def run_subject(subject, start_time=0, end_time=7.6, top_n_components=10, cache_dir=None, figures=False,
+                trace_dir=None, memory_budget=None, dtype='float64', cv_folds=None, nested_cv=False, group_ica=None,
+                resample_fs=None):
+    '''
+    Function to run the full pipeline on one subject and time each stage. Errors are caught and reported in the result
+    so one bad subject does not stop the batch.
+
+    Parameters
+    ----------
+    subject : string of subject number (two digits)
+        String denoting which subject we are analyzing.
+    start_time : float, optional
+        Epoch start time relative to event start in seconds. The default is 0.
+    end_time : float, optional
+        Epoch end time relative to event start in seconds. The default is 7.6.
+    top_n_components : int, optional
+        Number of ICA components to plot and test thresholds for. The default is 10.
+    cache_dir : string, optional
+        Directory of the pre-processed data and ICA cache passed on to load_data and perform_ICA. The default is None.
+    figures : bool, optional
+        If True, return the figures of this subject as render_figures jobs (they are not rendered here). The default
+        is False.
+    trace_dir : string, optional
+        If given, trace the pipeline stages and save the trace there as P{subject}.json and P{subject}.chrome.json
+        (Chrome trace event format). The default is None (no tracing).
+    memory_budget : int, optional
+        Working memory in bytes for chunked loading, passed on to load_data. The default is None (load the whole
+        recording at once).
+    dtype : string, optional
+        Precision of the pipeline, 'float64' or 'float32', passed on to load_data. The default is 'float64'.
+    cv_folds : int, optional
+        If given, also estimate the held-out accuracy and ITR by stratified cross-validation with this many folds (see
+        cross_validation.cross_validate_subject). The default is None (no cross-validation).
+    nested_cv : bool, optional
+        If True, choose the component of each fold by nested cross-validation. The default is False.
+    group_ica : GroupICA, optional
+        Group decomposition fit on this subject among others (see Project3.perform_group_ICA). If given, the subject's
+        back-projection is used instead of fitting ICA, and no component topo map figure is made. The default is None.
+    resample_fs : float, optional
+        Sampling frequency in Hz to decimate the filtered recording to, passed on to load_data. The default is None.
+
+    Returns
+    -------
+    result : dictionary
+        Dictionary holding one summary table row (see SUMMARY_COLUMNS), plus 'error' holding the traceback if the
+        subject failed and 'figure_jobs' holding the figures to render if figures is True.
+
+    '''
+    # imported here so the thread limits set by run_batch apply before numpy is loaded in the worker
+    import numpy as np
+    import Project3
+    from pipeline_trace import PipelineTrace
+
+    trace = None
+    if trace_dir is not None:
+        trace = PipelineTrace(subject=subject, start_time=start_time, end_time=end_time).start()
+    result = dict.fromkeys(SUMMARY_COLUMNS)
+    result['subject'] = subject
+    stage_times = {}
+    total_start = time.perf_counter()
+    try:
+        stage_start = time.perf_counter()
+        fif_file, raw_eeg_data, eeg_times, channel_names, fs = Project3.load_data(subject, cache_dir=cache_dir,
+                                                                                 memory_budget=memory_budget,
+                                                                                 dtype=dtype, resample_fs=resample_fs)
+        stage_times['load_s'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        eeg_epochs, epoch_times, all_trials = Project3.get_eeg_epochs(fif_file, raw_eeg_data, start_time, end_time, fs)
+        is_target_event = Project3.get_event_truth_labels(all_trials)
+        stage_times['epoch_s'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        if group_ica is None:
+            ica = Project3.perform_ICA(fif_file, channel_names, top_n_components, cache_dir=cache_dir, plot=False)
+        else:
+            ica = group_ica.get_subject_ica(subject)
+        components = np.arange(0, top_n_components, 1)
+        source_activations = Project3.plot_component_variance(ica, components, eeg_epochs, is_target_event, plot=False)
+        stage_times['ica_s'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        # every achievable threshold of every component is searched
+        component, threshold, sweep_accuracy = Project3.select_best_component_threshold(components, source_activations,
+                                                                                        is_target_event)
+        predicted_labels = Project3.make_prediction(source_activations, component, is_target_event, threshold)
+        accuracy, cm, disp = Project3.evaluate_predictions(predicted_labels, is_target_event*1)
+        itr_time = Project3.calculate_itr(accuracy, end_time-start_time, is_target_event)
+        stage_times['sweep_s'] = time.perf_counter() - stage_start
+
+        if cv_folds is not None:
+            from cross_validation import cross_validate_subject
+            stage_start = time.perf_counter()
+            # the trial variances are computed once and shared by every fold
+            cv_results = cross_validate_subject(Project3.get_component_variances(source_activations, components),
+                                                is_target_event, end_time-start_time, components=components,
+                                                n_folds=cv_folds, nested=nested_cv)
+            stage_times['cv_s'] = time.perf_counter() - stage_start
+            result.update(cv_accuracy=cv_results['accuracy'], cv_itr=cv_results['itr'])
+
+        result.update(stage_times, status='ok', component=int(component), threshold=float(threshold),
+                      accuracy=float(accuracy), itr=float(itr_time))
+        if figures:
+            # the 10-point threshold grid is only computed for its figure
+            all_accuracies, all_thresholds, all_true_positive_percentages = Project3.test_all_components_thresholds(
+                components, source_activations, is_target_event, plot=False)
+            figure_prefix = f'figures/P{subject}_'
+            result['figure_jobs'] = [] if group_ica is not None else [
+                ('ica_components', dict(ica=ica, top_n_components=top_n_components,
+                                        file_name=f'{figure_prefix}Top{top_n_components}ICA.png'))]
+            result['figure_jobs'] += [
+                ('component_variance_histograms', dict(
+                    component_activation_variances=Project3.get_component_variances(source_activations, components),
+                    components=components, is_target_event=is_target_event,
+                    file_name=f'{figure_prefix}TopComponentVariances.png')),
+                ('threshold_metrics', dict(components=components, all_accuracies=all_accuracies,
+                                           all_true_positive_percentages=all_true_positive_percentages,
+                                           file_name=f'{figure_prefix}AllMetrics.png')),
+                ('confusion_matrix', dict(cm=cm, component=int(component),
+                                          file_name=f'{figure_prefix}ConfusionMatrix.png')),
+            ]
+    except Exception:
+        result.update(stage_times, status='failed', error=traceback.format_exc())
+    result['total_s'] = time.perf_counter() - total_start
+    if trace is not None:
+        trace.stop()
+        os.makedirs(trace_dir, exist_ok=True)
+        trace.save_json(os.path.join(trace_dir, f'P{subject}.json'))
+        trace.save_chrome_trace(os.path.join(trace_dir, f'P{subject}.chrome.json'))
+    return result
+
+
+#%% Running the pipeline on many subjects
+def _limit_worker_threads(threads_per_worker):
+    '''
+    Function run at the start of each worker process to limit its BLAS/OpenMP threads. Workers are started fresh
+    ('spawn') and numpy is only imported by run_subject, so the limits apply before the libraries read them, and the
+    parent process's environment is left unchanged.
+    '''
+    for variable in THREAD_LIMIT_VARIABLES:
+        os.environ[variable] = str(threads_per_worker)
+
+
+def run_batch(subjects, workers=1, threads_per_worker=1, **subject_kwargs):
+    '''
+    Function to run the pipeline on a list of subjects in parallel worker processes.
+
+    Parameters
+    ----------
+    subjects : list of string
+        Subject numbers (two digits) to analyze.
+    workers : int, optional
+        Number of worker processes. The default is 1.
+    threads_per_worker : int, optional
+        Number of BLAS/OpenMP threads each worker may use, so workers*threads_per_worker stays within the machine's cores.
+        The default is 1.
+    **subject_kwargs :
+        Keyword arguments passed on to run_subject.
+
+    Returns
+    -------
+    results : list of dictionary
+        One result per subject (see run_subject), in the order of subjects.
+
+    '''
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_limit_worker_threads, initargs=(threads_per_worker,)) as executor:
+        futures = [executor.submit(run_subject, subject, **subject_kwargs) for subject in subjects]
+        results = [future.result() for future in futures]
+    return results
+
+
+def format_summary_table(results):
+    '''
+    Function to format batch results as a plain-text table.
+
+    Parameters
+    ----------
+    results : list of dictionary
+        Results returned by run_batch.
+
+    Returns
+    -------
+    table : string
+        Summary table with one row per subject.
+
+    '''
+    rows = [SUMMARY_COLUMNS]
+    for result in results:
+        row = []
+        for column in SUMMARY_COLUMNS:
+            value = result.get(column)
+            if value is None:
+                row.append('-')
+            elif column == 'threshold':
+                row.append(f'{value:.3g}')
+            elif isinstance(value, float):
+                row.append(f'{value:.3f}')
+            else:
+                row.append(str(value))
+        rows.append(row)
+    column_widths = [max(len(row[column_index]) for row in rows) for column_index in range(len(SUMMARY_COLUMNS))]
+    lines = ['  '.join(cell.rjust(width) for cell, width in zip(row, column_widths)) for row in rows]
+    lines.insert(1, '-' * len(lines[0]))
+    return '\n'.join(lines)
+
+
+#%% Command line entry point
+def main(argv=None):
+    '''
+    Function that parses command line arguments, runs the batch and prints the summary table.
+
+    Parameters
+    ----------
+    argv : list of string, optional
+        Command line arguments. The default is None (use sys.argv).
+
+    Returns
+    -------
+    exit_code : int
+        0 if every subject succeeded, 1 otherwise.
+
+    '''
+    parser = argparse.ArgumentParser(prog='python -m run_batch', description='Run the Project3 pipeline on many '
+                                     'OpenMIIR subjects in parallel.')
+    parser.add_argument('subjects', nargs='+', help="subject numbers, e.g. 09 11 13 (a leading 'P' is allowed)")
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default 1)')
+    parser.add_argument('--threads-per-worker', type=int, default=1, help='BLAS threads per worker (default 1)')
+    parser.add_argument('--start-time', type=float, default=0, help='epoch start time in seconds (default 0)')
+    parser.add_argument('--end-time', type=float, default=7.6, help='epoch end time in seconds (default 7.6)')
+    parser.add_argument('--top-n-components', type=int, default=10, help='components to test (default 10)')
+    parser.add_argument('--cache-dir', default=None, help='directory of the pre-processed data and ICA cache')
+    parser.add_argument('--memory-budget-mb', type=float, default=None,
+                        help='load each recording in chunks using this much working memory (MiB)')
+    parser.add_argument('--dtype', choices=('float64', 'float32'), default='float64',
+                        help='precision of the pipeline (default float64)')
+    parser.add_argument('--resample-fs', type=float, default=None,
+                        help='decimate the filtered recordings to this sampling frequency, e.g. 128 (Hz)')
+    parser.add_argument('--cv-folds', type=int, default=None,
+                        help='also report held-out accuracy/ITR from stratified k-fold cross-validation')
+    parser.add_argument('--nested-cv', action='store_true', help='choose each fold\'s component by nested CV')
+    parser.add_argument('--group-ica', action='store_true',
+                        help='fit one ICA across all subjects instead of one per subject')
+    parser.add_argument('--trace-dir', default=None, help='save a stage trace of each subject to this directory')
+    parser.add_argument('--output', default=None, help='write the summary table to this CSV file')
+    parser.add_argument('--figures', action='store_true', help='render each subject\'s figures to figures/P{subject}_*.png')
+    args = parser.parse_args(argv)
+
+    memory_budget = None if args.memory_budget_mb is None else int(args.memory_budget_mb*2**20)
+    subjects = [subject[1:] if subject.upper().startswith('P') else subject for subject in args.subjects]
+    group_ica = None
+    if args.group_ica:
+        import Project3
+        group_ica = Project3.perform_group_ICA(subjects, cache_dir=args.cache_dir, memory_budget=memory_budget)
+    results = run_batch(subjects, workers=args.workers, threads_per_worker=args.threads_per_worker,
+                        start_time=args.start_time, end_time=args.end_time,
+                        top_n_components=args.top_n_components, cache_dir=args.cache_dir, figures=args.figures,
+                        trace_dir=args.trace_dir, memory_budget=memory_budget, dtype=args.dtype,
+                        cv_folds=args.cv_folds, nested_cv=args.nested_cv, group_ica=group_ica,
+                        resample_fs=args.resample_fs)
+    if args.figures:
+        from render_figures import render_figure_jobs
+        figure_jobs = [figure_job for result in results for figure_job in result.get('figure_jobs', [])]
+        render_figure_jobs(figure_jobs, workers=args.workers)
+
+    for result in results:
+        if result['status'] != 'ok':
+            print(f"Subject {result['subject']} failed:\n{result['error']}", file=sys.stderr)
+    print(format_summary_table(results))
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as output_file:
+            writer = csv.DictWriter(output_file, fieldnames=SUMMARY_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+    return 0 if all(result['status'] == 'ok' for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
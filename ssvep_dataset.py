@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+ssvep_dataset.py
+
+File that defines the functions convert_ssvep_archive and get_channel_indices and the SSVEPDataset class - a lazy,
+memory-mapped stand-in for the dictionary import_ssvep_data.load_ssvep_data returns.
+
+np.load on SSVEP_S{subject}.npz decompresses and copies every field as soon as it is read. convert_ssvep_archive
+unpacks the archive once into a directory SSVEP_S{subject}/ holding one uncompressed .npy file per field (string fields
+are stored as fixed-width unicode so no field needs pickling), and SSVEPDataset memory-maps those files on first access.
+The dataset has the same keys as the dictionary, and get_eeg serves channel subsets and time ranges, so reading two
+channels of a recording only reads the bytes of those two channels.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import collections.abc
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# file listing the fields of a converted archive, written last so a directory without it is incomplete
+FIELDS_FILE_NAME = 'fields.txt'
+
+
+#%% Converting archives
+def convert_ssvep_archive(subject, data_directory):
+    '''
+    Function to unpack SSVEP_S{subject}.npz into a directory of uncompressed .npy files, one per field. Nothing is done
+    if the directory already exists and is newer than the archive.
+
+    Parameters
+    ----------
+    subject : int
+        Specifies which subject we are looking at.
+    data_directory : string
+        string holding the path to where the data is stored.
+
+    Returns
+    -------
+    dataset_directory : string
+        Directory holding the unpacked fields.
+
+    '''
+    archive_path = os.path.join(data_directory, f'SSVEP_S{subject}.npz')
+    dataset_directory = os.path.join(data_directory, f'SSVEP_S{subject}')
+    fields_path = os.path.join(dataset_directory, FIELDS_FILE_NAME)
+    if os.path.exists(fields_path) and os.path.getmtime(fields_path) >= os.path.getmtime(archive_path):
+        return dataset_directory
+
+    # unpack into a temporary directory next to the final one, then move it into place
+    temp_directory = tempfile.mkdtemp(prefix=f'.SSVEP_S{subject}-', dir=data_directory or '.')
+    try:
+        with np.load(archive_path, allow_pickle=True) as archive:
+            field_names = list(archive.files)
+            for field_name in field_names:
+                field = archive[field_name]
+                if field.dtype == object:
+                    # pickled strings become fixed-width unicode so the field can be memory-mapped
+                    field = field.astype(str)
+                np.save(os.path.join(temp_directory, f'{field_name}.npy'), field, allow_pickle=False)
+                del field
+        with open(os.path.join(temp_directory, FIELDS_FILE_NAME), 'w') as fields_file:
+            fields_file.write('\n'.join(field_names))
+        if os.path.exists(dataset_directory):
+            shutil.rmtree(dataset_directory)
+        os.replace(temp_directory, dataset_directory)
+    except BaseException:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+    return dataset_directory
+
+
+def get_channel_indices(channel_names, channels):
+    '''
+    Function to convert channel names (or indices) into row indices of eeg.
+
+    Parameters
+    ----------
+    channel_names : Array of str
+        Names of the rows of eeg (the channels field).
+    channels : list of str or int
+        Channel names or row indices.
+
+    Returns
+    -------
+    channel_indices : 1-D array of int
+        Row of eeg of each channel.
+
+    '''
+    channel_names = list(channel_names)
+    return np.array([channel if isinstance(channel, (int, np.integer)) else channel_names.index(channel)
+                     for channel in channels], dtype=int)
+
+
+#%% Lazy dataset
+class SSVEPDataset(collections.abc.Mapping):
+    '''
+    Class that exposes the fields of an unpacked SSVEP archive (see convert_ssvep_archive) like the dictionary
+    load_ssvep_data returns, but memory-maps each field on first access instead of reading it.
+
+    Parameters
+    ----------
+    dataset_directory : string
+        Directory written by convert_ssvep_archive.
+
+    '''
+    def __init__(self, dataset_directory):
+        self.dataset_directory = dataset_directory
+        with open(os.path.join(dataset_directory, FIELDS_FILE_NAME)) as fields_file:
+            self._field_names = fields_file.read().split('\n')
+        self._fields = {}
+
+    def __getitem__(self, field_name):
+        if field_name not in self._field_names:
+            raise KeyError(field_name)
+        if field_name not in self._fields:
+            field_path = os.path.join(self.dataset_directory, f'{field_name}.npy')
+            field = np.load(field_path, mmap_mode='r')
+            # scalars (e.g. fs) are read into memory so they behave like numbers
+            self._fields[field_name] = np.array(field) if field.ndim == 0 else field
+        return self._fields[field_name]
+
+    def __iter__(self):
+        return iter(self._field_names)
+
+    def __len__(self):
+        return len(self._field_names)
+
+    def get_eeg(self, channels=None, start=None, stop=None):
+        '''
+        Method to read part of the eeg field. A time range of all channels (or of a contiguous run of channels) is a
+        read-only view into the memory map; other channel subsets are gathered into a new array holding only those
+        channels.
+
+        Parameters
+        ----------
+        channels : list of str or int, optional
+            Channels to read. The default is None (all channels).
+        start : int, optional
+            First sample. The default is None (start of the recording).
+        stop : int, optional
+            Sample after the last one. The default is None (end of the recording).
+
+        Returns
+        -------
+        eeg : Array of size (channels, samples)
+            eeg data in volts.
+
+        '''
+        eeg = self['eeg']
+        if channels is None:
+            return eeg[:, start:stop]
+        channel_indices = get_channel_indices(self['channels'], channels)
+        if len(channel_indices) > 0 and np.all(np.diff(channel_indices) == 1):
+            return eeg[channel_indices[0]:channel_indices[-1]+1, start:stop]
+        return eeg[channel_indices, start:stop]
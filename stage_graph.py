@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+stage_graph.py
+
+File that defines the StageGraph class and the function make_pipeline_graph - a dependency graph of pipeline stages
+whose outputs are memoized on fingerprints of their inputs.
+
+Each stage is a function of the outputs of the stages it depends on and of its own named parameters. A stage's
+fingerprint is the hash of its name, its parameter values and the fingerprints of its inputs, so it changes exactly
+when something the stage depends on changes. Running the graph computes a stage only if its fingerprint is not memoized
+yet: outputs are kept in memory (least recently used evicted past max_memory_items) and, for the stages listed in
+disk_stages, pickled into a data_cache directory.
+
+make_pipeline_graph wires the Project3 functions into such a graph:
+
+    recording (subject, l_freq, h_freq)  ->  epochs (start_time, end_time)  ->  labels
+        |                                       |                          \\
+        v                                       v                           epoch_covariances
+       ica (decim, max_iter,              ->  sources (top_n_components)  <-/
+            random_state, n_components)         |
+                                                v
+                                                sweep            ->  classification (component, threshold)
+
+so changing the threshold only reruns classification, and changing the epoch window reuses the filtered recording and
+the fitted ICA:
+
+    graph = make_pipeline_graph(cache_dir='cache')
+    results = graph.run('classification', subject='09', start_time=0, end_time=7.6)
+    results = graph.run('classification', subject='09', start_time=0, end_time=5)
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import collections
+import hashlib
+import json
+import os
+import pickle
+from data_cache import DEFAULT_CACHE_SIZE_LIMIT, load_cache_entry, save_cache_entry
+from pipeline_trace import stage
+
+# name of the pickled stage output in a disk cache entry
+OUTPUT_FILE_NAME = 'output.pkl'
+
+
+#%% Stage graph
+class StageGraph:
+    '''
+    Class holding a graph of stages and the memoized outputs of the stages that have run.
+
+    Parameters
+    ----------
+    max_memory_items : int, optional
+        Number of stage outputs kept in memory, least recently used evicted first. The default is 32.
+    disk_dir : string, optional
+        data_cache directory for the outputs of disk_stages. The default is None (memory only).
+    disk_stages : tuple of string, optional
+        Stages whose outputs are also stored in disk_dir (outputs must be picklable). The default is ().
+    disk_size_limit : int, optional
+        Size budget of disk_dir in bytes. The default is data_cache.DEFAULT_CACHE_SIZE_LIMIT.
+
+    '''
+    def __init__(self, max_memory_items=32, disk_dir=None, disk_stages=(), disk_size_limit=DEFAULT_CACHE_SIZE_LIMIT):
+        self.max_memory_items = max_memory_items
+        self.disk_dir = disk_dir
+        self.disk_stages = tuple(disk_stages)
+        self.disk_size_limit = disk_size_limit
+        self.stages = {}
+        self._memory = collections.OrderedDict()
+        # how each stage was obtained in the last run: 'computed', 'memory' or 'disk'
+        self.last_run = {}
+
+    def add_stage(self, name, function, inputs=(), parameters=None, fingerprint_extra=None):
+        '''
+        Method to add a stage to the graph.
+
+        Parameters
+        ----------
+        name : string
+            Name of the stage.
+        function : function
+            Function called as function(*input outputs, **parameter values) to compute the stage's output.
+        inputs : tuple of string, optional
+            Stages whose outputs are passed to function, in order (they must already be in the graph). The default
+            is ().
+        parameters : dictionary, optional
+            Names and default values of the parameters the stage depends on. The default is None (no parameters).
+        fingerprint_extra : function, optional
+            Function of the parameter values returning a string added to the fingerprint, for dependencies that are
+            not parameters (e.g. the hash of an input file). The default is None.
+
+        Returns
+        -------
+        None.
+
+        '''
+        unknown_inputs = [input_name for input_name in inputs if input_name not in self.stages]
+        if len(unknown_inputs) > 0:
+            raise ValueError(f'Stage {name} depends on unknown stages {unknown_inputs}')
+        self.stages[name] = dict(function=function, inputs=tuple(inputs), parameters=dict(parameters or {}),
+                                 fingerprint_extra=fingerprint_extra)
+
+    def get_parameters(self):
+        '''
+        Method to get the parameters of all stages with their default values.
+
+        Returns
+        -------
+        parameters : dictionary
+            Default value of each parameter.
+
+        '''
+        parameters = {}
+        for stage_definition in self.stages.values():
+            parameters.update(stage_definition['parameters'])
+        return parameters
+
+    def run(self, targets, **parameter_values):
+        '''
+        Method to compute the outputs of the target stages, reusing every memoized stage output whose fingerprint
+        matches.
+
+        Parameters
+        ----------
+        targets : string or list of string
+            Stage(s) to compute.
+        **parameter_values :
+            Parameter values overriding the stage defaults (see get_parameters).
+
+        Returns
+        -------
+        outputs : dictionary
+            Output of each target stage (a single output if targets is a string).
+
+        '''
+        unknown_parameters = set(parameter_values) - set(self.get_parameters())
+        if len(unknown_parameters) > 0:
+            raise ValueError(f'Unknown stage parameters: {sorted(unknown_parameters)}')
+        self.last_run = {}
+        fingerprints = {}
+        outputs = {}
+        target_names = [targets] if isinstance(targets, str) else list(targets)
+        for target_name in target_names:
+            self._run_stage(target_name, parameter_values, fingerprints, outputs)
+        if isinstance(targets, str):
+            return outputs[targets]
+        return {target_name: outputs[target_name] for target_name in target_names}
+
+    def _run_stage(self, name, parameter_values, fingerprints, outputs):
+        '''
+        Method to get a stage's output (from memory, disk, or by computing it), computing its inputs first as needed.
+        '''
+        if name in outputs:
+            return outputs[name]
+        stage_definition = self.stages[name]
+        stage_parameters = {parameter_name: parameter_values.get(parameter_name, default_value)
+                            for parameter_name, default_value in stage_definition['parameters'].items()}
+        # the fingerprint only needs the inputs' fingerprints, so a memoized stage never computes its inputs
+        fingerprint = self._get_fingerprint(name, parameter_values, fingerprints)
+
+        if fingerprint in self._memory:
+            self._memory.move_to_end(fingerprint)
+            self.last_run[name] = 'memory'
+            outputs[name] = self._memory[fingerprint]
+            return outputs[name]
+        if name in self.disk_stages and self.disk_dir is not None:
+            _, cache_metadata = load_cache_entry(self.disk_dir, fingerprint)
+            if cache_metadata is not None:
+                with open(os.path.join(cache_metadata['entry_dir'], OUTPUT_FILE_NAME), 'rb') as output_file:
+                    output = pickle.load(output_file)
+                self.last_run[name] = 'disk'
+                outputs[name] = self._remember(fingerprint, output)
+                return output
+
+        input_outputs = [self._run_stage(input_name, parameter_values, fingerprints, outputs)
+                         for input_name in stage_definition['inputs']]
+        with stage(f'graph:{name}', fingerprint=fingerprint[:12]):
+            output = stage_definition['function'](*input_outputs, **stage_parameters)
+        self.last_run[name] = 'computed'
+        if name in self.disk_stages and self.disk_dir is not None:
+            save_cache_entry(self.disk_dir, fingerprint, {}, dict(kind='stage', stage=name),
+                             size_limit=self.disk_size_limit,
+                             file_writers={OUTPUT_FILE_NAME: lambda output_path: _write_pickle(output_path, output)})
+        outputs[name] = self._remember(fingerprint, output)
+        return output
+
+    def _get_fingerprint(self, name, parameter_values, fingerprints):
+        '''
+        Method to compute a stage's fingerprint from its name, parameter values and the fingerprints of its inputs.
+        '''
+        if name not in fingerprints:
+            stage_definition = self.stages[name]
+            stage_parameters = {parameter_name: parameter_values.get(parameter_name, default_value)
+                                for parameter_name, default_value in stage_definition['parameters'].items()}
+            fingerprint_fields = dict(stage=name, parameters=stage_parameters,
+                                      inputs=[self._get_fingerprint(input_name, parameter_values, fingerprints)
+                                              for input_name in stage_definition['inputs']])
+            if stage_definition['fingerprint_extra'] is not None:
+                fingerprint_fields['extra'] = stage_definition['fingerprint_extra'](**stage_parameters)
+            fingerprint_text = json.dumps(fingerprint_fields, sort_keys=True, default=repr)
+            fingerprints[name] = hashlib.sha256(fingerprint_text.encode()).hexdigest()
+        return fingerprints[name]
+
+    def _remember(self, fingerprint, output):
+        '''
+        Method to keep a stage output in memory, evicting the least recently used outputs past max_memory_items.
+        '''
+        self._memory[fingerprint] = output
+        self._memory.move_to_end(fingerprint)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+        return output
+
+    def clear_memory(self):
+        '''
+        Method to drop every stage output kept in memory.
+        '''
+        self._memory.clear()
+
+
+def _write_pickle(output_path, output):
+    '''
+    Function to pickle a stage output to a file.
+    '''
+    with open(output_path, 'wb') as output_file:
+        pickle.dump(output, output_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+#%% The Project3 pipeline as a stage graph
+def make_pipeline_graph(cache_dir=None, memory_budget=None, dtype='float64', max_memory_items=32, disk_dir=None,
+                        disk_stages=('sweep', 'classification')):
+    '''
+    Function to build the stage graph of the Project3 pipeline (see the module docstring). Its parameters and defaults
+    are subject (required), l_freq=1, h_freq=30, resample_fs=None (recording), start_time=0, end_time=7.6, decim=3,
+    max_iter=800, random_state=97, n_components=0.999 (ica), top_n_components=10, component=None and threshold=None
+    (None: the component and threshold with the highest accuracy in the sweep, or the best threshold of the given
+    component).
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        Directory of the pre-processed data and ICA cache, passed on to load_data and perform_ICA. The default is None.
+    memory_budget : int, optional
+        Working memory in bytes for chunked loading, passed on to load_data. The default is None.
+    dtype : string, optional
+        Precision of the pipeline, passed on to load_data. The default is 'float64'.
+    max_memory_items : int, optional
+        Number of stage outputs kept in memory. The default is 32.
+    disk_dir : string, optional
+        Directory for the disk memo of disk_stages. The default is None (memory only).
+    disk_stages : tuple of string, optional
+        Stages also memoized on disk when disk_dir is given (the recording and ICA already have their own caches in
+        cache_dir). The default is ('sweep', 'classification').
+
+    Returns
+    -------
+    graph : StageGraph
+        Graph with the stages recording, epochs, labels, epoch_covariances, ica, sources, sweep and classification.
+
+    '''
+    import numpy as np
+    import Project3
+    from component_features import SourceActivations, get_epoch_covariances
+    from data_cache import hash_file
+
+    graph = StageGraph(max_memory_items=max_memory_items, disk_dir=disk_dir, disk_stages=disk_stages)
+
+    def load_recording(subject, l_freq, h_freq, resample_fs):
+        return Project3.load_data(subject, l_freq, h_freq, cache_dir=cache_dir, memory_budget=memory_budget,
+                                  dtype=dtype, resample_fs=resample_fs)
+
+    def epoch_recording(recording, start_time, end_time):
+        fif_file, raw_eeg_data, eeg_times, channel_names, fs = recording
+        return Project3.get_eeg_epochs(fif_file, raw_eeg_data, start_time, end_time, fs)
+
+    def fit_ica(recording, decim, max_iter, random_state, n_components):
+        fif_file, raw_eeg_data, eeg_times, channel_names, fs = recording
+        return Project3.perform_ICA(fif_file, channel_names, 0, decim=decim, max_iter=max_iter,
+                                    random_state=random_state, cache_dir=cache_dir, plot=False,
+                                    n_components=n_components)
+
+    def make_sources(ica, epochs, epoch_covariances, top_n_components):
+        source_activations = SourceActivations(Project3.get_unmixing_matrix(ica), epochs[0],
+                                               epoch_covariances=epoch_covariances)
+        return np.arange(top_n_components), source_activations
+
+    def sweep_sources(sources, labels):
+        components, source_activations = sources
+        # every achievable threshold of every component (see Project3.sweep_thresholds)
+        component_activation_variances = Project3.get_component_variances(source_activations, components)
+        thresholds, accuracies = Project3.sweep_thresholds(component_activation_variances, labels)[:2]
+        return dict(component_activation_variances=component_activation_variances, thresholds=thresholds,
+                    accuracies=accuracies)
+
+    def classify(sources, sweep, labels, component, threshold, start_time, end_time):
+        components, source_activations = sources
+        # columns of the sweep are the components: the best component, or the best threshold of the given one
+        if component is None:
+            best_row, best_column = np.unravel_index(np.argmax(sweep['accuracies']), sweep['accuracies'].shape)
+            component = components[best_column]
+        elif threshold is None:
+            best_column = list(components).index(component)
+            best_row = np.argmax(sweep['accuracies'][:, best_column])
+        if threshold is None:
+            threshold = Project3.get_centered_threshold(sweep['component_activation_variances'][:, best_column],
+                                                        sweep['thresholds'][best_row, best_column])
+        predicted_labels = Project3.make_prediction(source_activations, component, labels, threshold)
+        accuracy, cm, disp = Project3.evaluate_predictions(predicted_labels, labels*1)
+        return dict(component=int(component), threshold=float(threshold), accuracy=float(accuracy), cm=cm,
+                    itr=float(Project3.calculate_itr(accuracy, end_time-start_time, labels)),
+                    predicted_labels=np.array(predicted_labels))
+
+    graph.add_stage('recording', load_recording, parameters=dict(subject=None, l_freq=1, h_freq=30, resample_fs=None),
+                    fingerprint_extra=lambda subject, **parameters: hash_file(f'data/P{subject}-raw.fif', cache_dir))
+    graph.add_stage('epochs', epoch_recording, inputs=('recording',), parameters=dict(start_time=0, end_time=7.6))
+    graph.add_stage('labels', lambda epochs: Project3.get_event_truth_labels(epochs[2]), inputs=('epochs',))
+    graph.add_stage('epoch_covariances', lambda epochs: get_epoch_covariances(epochs[0]), inputs=('epochs',))
+    graph.add_stage('ica', fit_ica, inputs=('recording',), parameters=dict(decim=3, max_iter=800, random_state=97,
+                                                                          n_components=0.999))
+    graph.add_stage('sources', make_sources, inputs=('ica', 'epochs', 'epoch_covariances'),
+                    parameters=dict(top_n_components=10))
+    graph.add_stage('sweep', sweep_sources, inputs=('sources', 'labels'))
+    graph.add_stage('classification', classify, inputs=('sources', 'sweep', 'labels'),
+                    parameters=dict(component=None, threshold=None, start_time=0, end_time=7.6))
+    return graph
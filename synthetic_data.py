@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 2026
+
+synthetic_data.py
+
+File that defines functions make_synthetic_recording and make_synthetic_ssvep_data.
+
+The data files in data/ are Git LFS pointers, so these functions write synthetic recordings with the layout the
+pipeline expects, for benchmarks and for trying the code without the real dataset:
+
+- make_synthetic_recording writes an OpenMIIR-shaped .fif file: 64 EEG channels (BioSemi 64 montage) plus a stim
+  channel, 512 Hz, and one event per trial whose id is stimulus id * 10 + condition (id % 10 == 1 is perception, 2 - 4
+  are imagination). During perception trials a non-Gaussian "auditory" source is added, so the variance classifier has
+  something to find.
+- make_synthetic_ssvep_data writes an SSVEP_S{subject}.npz file with the fields import_ssvep_data expects.
+
+@author: spenc, JJ
+"""
+#%% Import Statements
+import mne
+import numpy as np
+
+# OpenMIIR stimulus ids (songs with lyrics, the same songs without lyrics, instrumental pieces)
+STIMULUS_IDS = (1, 2, 3, 4, 11, 12, 13, 14, 21, 22, 23, 24)
+# OpenMIIR conditions: 1 = perception, 2 - 4 = imagination
+CONDITIONS = (1, 2, 3, 4)
+
+
+#%% OpenMIIR-shaped recordings
+def make_synthetic_recording(file_name, n_trials=240, trial_spacing=10.0, fs=512.0, trial_duration=7.6, seed=0):
+    '''
+    Function to write a synthetic OpenMIIR-shaped raw .fif recording.
+
+    Parameters
+    ----------
+    file_name : string
+        Path of the .fif file to write (should end in -raw.fif, e.g. data/P90-raw.fif).
+    n_trials : int, optional
+        Number of trials. The conditions cycle 1, 2, 3, 4 so a quarter of the trials are perception trials. The default
+        is 240 (as in OpenMIIR).
+    trial_spacing : float, optional
+        Time between trial onsets in seconds (the recording lasts about n_trials*trial_spacing seconds). The default is
+        10.
+    fs : float, optional
+        Sampling frequency in Hz. The default is 512.
+    trial_duration : float, optional
+        Length in seconds of the auditory source added to perception trials. The default is 7.6.
+    seed : int, optional
+        Seed of the random number generator. The default is 0.
+
+    Returns
+    -------
+    all_trials : array of size (trials, 3)
+        Events written to the stim channel (onset sample, 0, event id), as mne.find_events returns them.
+
+    '''
+    rng = np.random.default_rng(seed)
+    montage = mne.channels.make_standard_montage('biosemi64')
+    n_channels = len(montage.ch_names)
+    n_samples = int((n_trials*trial_spacing + trial_duration + 2)*fs)
+
+    # independent Laplacian sources (in volts), generated and later mixed onto the electrodes a block at a time so the
+    # recording is held in memory only once
+    raw_data = np.zeros((n_channels + 1, n_samples))
+    block_size = 2**16
+    for block_start in range(0, n_samples, block_size):
+        block_stop = min(block_start + block_size, n_samples)
+        raw_data[:n_channels, block_start:block_stop] = rng.laplace(scale=1e-5, size=(n_channels, block_stop-block_start))
+
+    onsets = (fs + np.arange(n_trials)*trial_spacing*fs + rng.integers(0, int(fs/4), n_trials)).astype(int)
+    event_ids = (10*rng.choice(STIMULUS_IDS, n_trials) + np.resize(CONDITIONS, n_trials)).astype(int)
+    n_trial_samples = int(trial_duration*fs)
+    for onset, event_id in zip(onsets, event_ids):
+        raw_data[n_channels, onset:onset+int(0.1*fs)] = event_id
+        # perception trials carry extra activity on the first source
+        if event_id % 10 == 1:
+            raw_data[0, onset:onset+n_trial_samples] += rng.laplace(scale=2e-5, size=n_trial_samples)
+
+    mixing_matrix = rng.standard_normal((n_channels, n_channels))/np.sqrt(n_channels)
+    for block_start in range(0, n_samples, block_size):
+        block_stop = min(block_start + block_size, n_samples)
+        raw_data[:n_channels, block_start:block_stop] = mixing_matrix @ raw_data[:n_channels, block_start:block_stop]
+
+    info = mne.create_info(montage.ch_names + ['STI 014'], fs, ['eeg']*n_channels + ['stim'])
+    raw = mne.io.RawArray(raw_data, info, verbose=False)
+    raw.set_montage(montage)
+    raw.save(file_name, overwrite=True, verbose=False)
+    return np.column_stack([onsets, np.zeros(n_trials, dtype=int), event_ids])
+
+
+#%% SSVEP-shaped recordings
+def make_synthetic_ssvep_data(data_directory, subject=1, n_trials=20, trial_duration=20.0, fs=1000.0,
+                              channels=('Fz', 'Cz', 'P3', 'Pz', 'P4', 'PO7', 'PO8', 'Oz'), seed=0):
+    '''
+    Function to write a synthetic SSVEP_S{subject}.npz file with the fields import_ssvep_data.load_ssvep_data reads.
+    Trials alternate between 12 Hz and 15 Hz flashing, and each trial carries a sinusoid at its flash frequency.
+
+    Parameters
+    ----------
+    data_directory : string
+        Directory to write the file to (ending in a path separator, as load_ssvep_data expects).
+    subject : int, optional
+        Subject number in the file name. The default is 1.
+    n_trials : int, optional
+        Number of trials. The default is 20.
+    trial_duration : float, optional
+        Length of each trial in seconds. The default is 20.
+    fs : float, optional
+        Sampling frequency in Hz. The default is 1000.
+    channels : tuple of string, optional
+        Channel names. The default is 8 occipital/parietal/central channels.
+    seed : int, optional
+        Seed of the random number generator. The default is 0.
+
+    Returns
+    -------
+    file_name : string
+        Path of the written file.
+
+    '''
+    rng = np.random.default_rng(seed)
+    n_trial_samples = int(trial_duration*fs)
+    gap_samples = int(2*fs)
+    n_samples = n_trials*(n_trial_samples + gap_samples) + gap_samples
+    eeg = rng.standard_normal((len(channels), n_samples))*1e-5
+    event_samples = gap_samples + np.arange(n_trials)*(n_trial_samples + gap_samples)
+    event_types = np.resize(np.array(['12hz', '15hz']), n_trials)
+    trial_times = np.arange(n_trial_samples)/fs
+    for event_sample, event_type in zip(event_samples, event_types):
+        flash_frequency = 12 if event_type == '12hz' else 15
+        eeg[:, event_sample:event_sample+n_trial_samples] += 5e-6*np.sin(2*np.pi*flash_frequency*trial_times)
+
+    file_name = data_directory + f'SSVEP_S{subject}.npz'
+    np.savez(file_name, eeg=eeg, channels=np.array(channels), fs=np.array(fs), event_samples=event_samples,
+             event_durations=np.full(n_trials, n_trial_samples), event_types=event_types)
+    return file_name
@@ -7,69 +7,282 @@ File that calls functions load_data, get_eeg_epochs, get_truth_event_labels, plo
 plot_component_variance, make_prediction, evaluate_predictions, test_all_components_thresholds, make_prediction, 
 evaluate_predictions, and calculate_itr that are that are defined in the Project3.py file.
 
+Run as a script it goes through the pipeline on subject 13. The test_ functions are small deterministic tests run with
+pytest on synthetic data (see synthetic_data): that the float32 pipeline classifies a recording like the float64 one,
+and the behaviour of the threshold sweep, epoching, the data cache, the event index, ragged epochs, the results store
+and the prefix-sum window variances.
+
 @author: spenc, JJ
     
 """
 #%% Import Statements
+import gc
+import os
 from import_ssvep_data import get_frequency_spectrum
 import Project3
 import numpy as np
 import matplotlib.pyplot as plt
+import mne
+import pytest
+from synthetic_data import make_synthetic_recording
+
+#%% Regression test: float32 pipeline
+def test_float32_matches_float64(tmp_path, monkeypatch):
+    '''
+    Test that running the pipeline in float32 gives the same source variances (within float32 rounding), picks the same
+    component and threshold, and predicts the same label for every trial as float64, on a synthetic recording. Both
+    runs use the same ICA fit.
+    '''
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    make_synthetic_recording('data/P90-raw.fif', n_trials=40, trial_spacing=9.0)
+    components = np.arange(0, 10, 1)
+    ica = None
+    results = {}
+    for dtype in (np.float64, np.float32):
+        fif_file, raw_eeg_data, eeg_times, channel_names, fs = Project3.load_data('90', dtype=dtype)
+        assert raw_eeg_data.dtype == dtype
+        if ica is None:
+            ica = Project3.perform_ICA(fif_file, channel_names, len(components), max_iter=50, warm_start=False,
+                                       plot=False)
+        eeg_epochs, epoch_times, all_trials = Project3.get_eeg_epochs(fif_file, raw_eeg_data, 0, 7.6, fs)
+        is_target_event = Project3.get_event_truth_labels(all_trials)
+        source_activations = Project3.plot_component_variance(ica, components, eeg_epochs, is_target_event,
+                                                              plot=False)
+        results[dtype] = dict(is_target_event=is_target_event, source_activations=source_activations,
+                              variances=Project3.get_component_variances(source_activations, components),
+                              best=Project3.select_best_component_threshold(components, source_activations,
+                                                                            is_target_event))
+
+    float64_results, float32_results = results[np.float64], results[np.float32]
+    np.testing.assert_array_equal(float32_results['is_target_event'], float64_results['is_target_event'])
+    # variances are accumulated in float64, so only the float32 epochs' rounding (~1e-7) separates them
+    np.testing.assert_allclose(float32_results['variances'], float64_results['variances'], rtol=1e-5)
+    component, threshold, accuracy = float64_results['best']
+    assert float32_results['best'][0] == component
+    assert abs(float32_results['best'][1] - threshold) <= 1e-5*abs(threshold)
+    assert float32_results['best'][2] == accuracy
+    float64_labels = Project3.make_prediction(float64_results['source_activations'], component,
+                                              float64_results['is_target_event'], threshold)
+    float32_labels = Project3.make_prediction(float32_results['source_activations'], component,
+                                              float32_results['is_target_event'], threshold)
+    assert float32_labels == float64_labels
+
+
+#%% Behaviour tests
+def test_sweep_thresholds_matches_make_prediction():
+    '''
+    Test that every threshold of sweep_thresholds scores and counts exactly like make_prediction and
+    evaluate_predictions, and that the centered best threshold reproduces the best accuracy.
+    '''
+    rng = np.random.default_rng(0)
+    source_activations = rng.standard_normal((24, 3, 64))*rng.uniform(0.5, 2, (24, 3, 1))
+    is_target_event = np.arange(24) % 4 == 0
+    components = np.arange(3)
+    component_activation_variances = Project3.get_component_variances(source_activations, components)
+    thresholds, accuracies, true_positives, false_positives, true_negatives, false_negatives = \
+        Project3.sweep_thresholds(component_activation_variances, is_target_event)
+    for threshold_row, component in np.ndindex(thresholds.shape):
+        predicted_labels = Project3.make_prediction(source_activations, component, is_target_event,
+                                                    thresholds[threshold_row, component])
+        accuracy, cm, disp = Project3.evaluate_predictions(predicted_labels, is_target_event*1)
+        assert accuracy == accuracies[threshold_row, component]
+        np.testing.assert_array_equal(cm, [[true_negatives[threshold_row, component],
+                                            false_positives[threshold_row, component]],
+                                           [false_negatives[threshold_row, component],
+                                            true_positives[threshold_row, component]]])
+
+    component, threshold, best_accuracy = Project3.select_best_component_threshold(components, source_activations,
+                                                                                   is_target_event)
+    assert best_accuracy == np.max(accuracies)
+    predicted_labels = Project3.make_prediction(source_activations, component, is_target_event, threshold)
+    assert np.mean(np.array(predicted_labels) == is_target_event) == best_accuracy
+
+
+def test_extract_epochs_bounds_and_views():
+    '''
+    Test that extract_epochs rejects windows outside the recording, returns a read-only view for evenly spaced windows
+    and a writable copy otherwise.
+    '''
+    from epoching import extract_epochs
+    data = np.arange(200, dtype=float).reshape(2, 100)
+    with pytest.raises(ValueError):
+        extract_epochs(data, [-1, 10], 5)
+    with pytest.raises(ValueError):
+        extract_epochs(data, [10, 96], 5)
+    with pytest.raises(ValueError):
+        extract_epochs(data, [10, 20], 0)
+
+    expected_epochs = np.stack([data[:, 0:5], data[:, 10:15], data[:, 20:25]])
+    epoch_view = extract_epochs(data, [0, 10, 20], 5)
+    np.testing.assert_array_equal(epoch_view, expected_epochs)
+    assert np.shares_memory(epoch_view, data) and not epoch_view.flags.writeable
+
+    epoch_copy = extract_epochs(data, [0, 10, 25], 5)
+    np.testing.assert_array_equal(epoch_copy[2], data[:, 25:30])
+    assert not np.shares_memory(epoch_copy, data) and epoch_copy.flags.writeable
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    '''
+    Test that evict_cache deletes the least recently used entry first, where loading an entry counts as using it.
+    '''
+    from data_cache import METADATA_FILE_NAME, evict_cache, load_cache_entry, save_cache_entry
+    cache_dir = str(tmp_path)
+    for entry_time, cache_key in enumerate(('first', 'second', 'third')):
+        save_cache_entry(cache_dir, cache_key, {'data': np.zeros(1000)})
+        metadata_path = os.path.join(cache_dir, cache_key, METADATA_FILE_NAME)
+        os.utime(metadata_path, (1000 + entry_time, 1000 + entry_time))
+    # loading the oldest entry marks it as the most recently used
+    arrays, metadata = load_cache_entry(cache_dir, 'first')
+    np.testing.assert_array_equal(arrays['data'], np.zeros(1000))
+
+    entry_size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(cache_dir, 'first')))
+    assert evict_cache(cache_dir, size_limit=2*entry_size + entry_size//2) == ['second']
+    assert load_cache_entry(cache_dir, 'second') == (None, None)
+    assert load_cache_entry(cache_dir, 'third')[1] is not None
+
+
+def test_event_index_matches_find_events(tmp_path, monkeypatch):
+    '''
+    Test that the event index decodes the trials mne.find_events finds, is built once per Raw object and is forgotten
+    when the Raw is garbage collected.
+    '''
+    import event_index
+    monkeypatch.chdir(tmp_path)
+    all_trials = make_synthetic_recording('P91-raw.fif', n_trials=12, trial_spacing=2.0, trial_duration=1.0)
+    raw = mne.io.read_raw_fif('P91-raw.fif', preload=False, verbose=False)
+    trial_index = event_index.get_event_index(raw)
+    np.testing.assert_array_equal(event_index.get_events_array(trial_index), all_trials)
+    np.testing.assert_array_equal(trial_index['condition'], all_trials[:, 2] % 10)
+    assert event_index.get_event_index(raw) is trial_index
+    perception_trials = event_index.select_trials(trial_index, conditions=event_index.PERCEPTION_CONDITIONS)
+    np.testing.assert_array_equal(perception_trials['onset'], all_trials[all_trials[:, 2] % 10 == 1, 0])
+
+    raw_id = id(raw)
+    del raw
+    gc.collect()
+    assert raw_id not in event_index._event_indexes
+
+
+def test_ragged_epoch_variance_matches_np_var():
+    '''
+    Test that RaggedEpochs holds each epoch's samples and that its per-epoch variances match np.var.
+    '''
+    from epoching import extract_ragged_epochs
+    data = np.random.default_rng(1).standard_normal((3, 1000)) + 5
+    window_starts = np.array([0, 100, 400, 700])
+    window_lengths = np.array([50, 230, 120, 300])
+    ragged_epochs = extract_ragged_epochs(data, window_starts, window_lengths)
+    assert len(ragged_epochs) == 4
+    for trial_index, (window_start, window_length) in enumerate(zip(window_starts, window_lengths)):
+        np.testing.assert_array_equal(ragged_epochs[trial_index], data[:, window_start:window_start+window_length])
+    expected_variances = [np.var(data[:, window_start:window_start+window_length], axis=1)
+                          for window_start, window_length in zip(window_starts, window_lengths)]
+    np.testing.assert_allclose(ragged_epochs.variance(), expected_variances, rtol=1e-10)
+
+
+def test_results_store_resumes(tmp_path, monkeypatch):
+    '''
+    Test that run_sweep stores every record of a configuration, skips it when run again, and only computes the
+    configuration a grown sweep adds.
+    '''
+    from results_store import N_THRESHOLDS, ResultsStore, run_sweep
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    make_synthetic_recording('data/P92-raw.fif', n_trials=20, trial_spacing=9.0)
+    sweep_kwargs = dict(ica_param_sets=({'max_iter': 20},), top_n_components=3, cache_dir='cache')
+    with ResultsStore('results.sqlite') as store:
+        sweep_summary = run_sweep(store, ['92'], **sweep_kwargs)
+        assert (len(sweep_summary['computed']), len(sweep_summary['skipped'])) == (1, 0)
+        assert len(store.get_records(subject='92')) == 3*(N_THRESHOLDS + 1)
+
+        sweep_summary = run_sweep(store, ['92'], **sweep_kwargs)
+        assert (len(sweep_summary['computed']), len(sweep_summary['skipped'])) == (0, 1)
+
+        sweep_summary = run_sweep(store, ['92'], epoch_windows=((0, 7.6), (0, 5)), **sweep_kwargs)
+        assert [configuration['end_time'] for configuration in sweep_summary['computed']] == [5]
+        assert len(sweep_summary['skipped']) == 1
+        assert len(store.get_records(subject='92')) == 2*3*(N_THRESHOLDS + 1)
+
+
+def test_window_variances_match_np_var():
+    '''
+    Test that the prefix-sum window variances of decision_latency match np.var of every window, also for activations
+    with a large offset.
+    '''
+    from decision_latency import get_window_variances
+    source_activations = np.random.default_rng(2).standard_normal((7, 3, 200)) + 100
+    fs = 100
+    components = [0, 2]
+    window_durations = [0.1, 0.5, 1.3]
+    window_starts = [0, 0.2, 0.7]
+    window_variances = get_window_variances(source_activations, components, fs, window_durations, window_starts,
+                                            batch_size=3)
+    assert window_variances.shape == (3, 3, 7, 2)
+    for start_index, window_start in enumerate(window_starts):
+        for duration_index, window_duration in enumerate(window_durations):
+            first_sample = int(round(window_start*fs))
+            last_sample = first_sample + int(round(window_duration*fs))
+            expected_variances = np.var(source_activations[:, components, first_sample:last_sample], axis=2)
+            np.testing.assert_allclose(window_variances[start_index, duration_index], expected_variances, rtol=1e-9)
+
 
-#%% Loading in the data
-plt.rcParams["figure.figsize"] = (14,8)
+if __name__ == '__main__':
+    #%% Loading in the data
+    plt.rcParams["figure.figsize"] = (14,8)
 
-fif_file, raw_eeg_data, eeg_times, channel_names, fs = Project3.load_data('13')
+    fif_file, raw_eeg_data, eeg_times, channel_names, fs = Project3.load_data('13')
 
-#%% Epoching the data
-start_time = 0
-# Explanation for end time from author of experiemnt:
-# A trial epoch (as I used it) starts at a trial onset marker (I used the audio onsets when available). 
-# The duration depends on what you want to do. The length of the stimuli is known but it is different for each stimulus. 
-# You can either have epochs that correspond to the full audio stimulus but vary in length (e.g. for stimulus reconstruction experiments). 
-# Or you can cut of at the length of the shortest stimulus if they need to have the same length (e.g. for stimulus recognition experiments).
-end_time = 7.6
+    #%% Epoching the data
+    start_time = 0
+    # Explanation for end time from author of experiemnt:
+    # A trial epoch (as I used it) starts at a trial onset marker (I used the audio onsets when available). 
+    # The duration depends on what you want to do. The length of the stimuli is known but it is different for each stimulus. 
+    # You can either have epochs that correspond to the full audio stimulus but vary in length (e.g. for stimulus reconstruction experiments). 
+    # Or you can cut of at the length of the shortest stimulus if they need to have the same length (e.g. for stimulus recognition experiments).
+    end_time = 7.6
 
-eeg_epochs, epoch_times, all_trials = Project3.get_eeg_epochs(fif_file, raw_eeg_data, start_time, end_time, fs)
+    eeg_epochs, epoch_times, all_trials = Project3.get_eeg_epochs(fif_file, raw_eeg_data, start_time, end_time, fs)
 
-#%% Extract truth labels
-is_target_event = Project3.get_event_truth_labels(all_trials)
+    #%% Extract truth labels
+    is_target_event = Project3.get_event_truth_labels(all_trials)
 
 
-#%% Computing ICA and Plotting component variance
-top_n_components = 10
+    #%% Computing ICA and Plotting component variance
+    top_n_components = 10
 
-ica = Project3.perform_ICA(fif_file, channel_names, top_n_components)
+    ica = Project3.perform_ICA(fif_file, channel_names, top_n_components)
 
-components = np.arange(0, top_n_components, 1)
-source_activations = Project3.plot_component_variance(ica, components, eeg_epochs, is_target_event)
+    components = np.arange(0, top_n_components, 1)
+    source_activations = Project3.plot_component_variance(ica, components, eeg_epochs, is_target_event)
 
 
-# %% Classification
+    # %% Classification
 
-# Using eye test to test component 2 using a certain threshold
-component = 2
-threshold = 0.0000000017
-predicted_labels = Project3.make_prediction(source_activations, component, is_target_event, threshold)
+    # Using eye test to test component 2 using a certain threshold
+    component = 2
+    threshold = 0.0000000017
+    predicted_labels = Project3.make_prediction(source_activations, component, is_target_event, threshold)
 
-truth_labels_binary = is_target_event*1
-accuracy, cm, disp = Project3.evaluate_predictions(predicted_labels, truth_labels_binary)
-disp.plot()
-plt.title(f"Confusion Matrix Using Component {component}")
-plt.savefig(f'figures/ConfusionMatrixEyeTest.png')
+    truth_labels_binary = is_target_event*1
+    accuracy, cm, disp = Project3.evaluate_predictions(predicted_labels, truth_labels_binary)
+    disp.plot()
+    plt.title(f"Confusion Matrix Using Component {component}")
+    plt.savefig(f'figures/ConfusionMatrixEyeTest.png')
 
 
-all_accuracies, all_thresholds, all_true_positive_percentages = Project3.test_all_components_thresholds(components, source_activations, is_target_event)
+    all_accuracies, all_thresholds, all_true_positive_percentages = Project3.test_all_components_thresholds(components, source_activations, is_target_event)
 
-# using above results to choose component and threshold best suited as of now
-component = 6
-threshold = all_thresholds[len(components)-7, 1]
-predicted_labels = Project3.make_prediction(source_activations, component, is_target_event, threshold)
-truth_labels_binary = is_target_event*1
-accuracy, cm, disp = Project3.evaluate_predictions(predicted_labels, truth_labels_binary)
-disp.plot()
-plt.title(f"Confusion Matrix Using Component {component}")
-plt.savefig(f'figures/ConfusionMatrix.png')
+    # using above results to choose component and threshold best suited as of now
+    component = 6
+    threshold = all_thresholds[len(components)-7, 1]
+    predicted_labels = Project3.make_prediction(source_activations, component, is_target_event, threshold)
+    truth_labels_binary = is_target_event*1
+    accuracy, cm, disp = Project3.evaluate_predictions(predicted_labels, truth_labels_binary)
+    disp.plot()
+    plt.title(f"Confusion Matrix Using Component {component}")
+    plt.savefig(f'figures/ConfusionMatrix.png')
 
-#%% Calculating ITR
-itr_time = Project3.calculate_itr(accuracy, end_time-start_time, is_target_event)
+    #%% Calculating ITR
+    itr_time = Project3.calculate_itr(accuracy, end_time-start_time, is_target_event)